@@ -0,0 +1,168 @@
+import asyncio
+import math
+import os
+from collections import deque
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+EXEMPT_PATHS = {"/", "/docs", "/redoc", "/openapi.json", "/admin/admission"}
+# token refreshes are a keyed hash and an indexed lookup, not a bcrypt verify
+CHEAP_AUTH_PATHS = {"/auth/refresh", "/auth/revoke"}
+
+
+class RouteClassLimiter:
+    """
+    Concurrency limit with a bounded, deadline-aware wait queue.
+
+    At most ``limit`` requests run at once. Up to ``queue_size`` more wait in
+    FIFO order for at most ``timeout`` seconds; anything beyond that is shed.
+    All bookkeeping happens on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.timeout))
+
+    async def acquire(self) -> bool:
+        """
+        Waits for a free slot.
+
+        :return: true if the request was admitted, false if it must be shed
+        """
+        if self.active < self.limit:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+        return True
+
+    def release(self):
+        """Hands the slot to the oldest live waiter, or frees it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> dict[str, int | float]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_size": self.queue_size,
+            "queue_depth": len(self._waiters),
+            "timeout": self.timeout,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "expired": self.expired,
+        }
+
+
+class AdmissionController:
+    """Sorts requests into route classes, each with its own limiter."""
+
+    def __init__(self, auth: RouteClassLimiter, writes: RouteClassLimiter, reads: RouteClassLimiter):
+        self.auth = auth
+        self.writes = writes
+        self.reads = reads
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        def limiter(name: str, default_limit: int, default_timeout: float) -> RouteClassLimiter:
+            prefix = f"ADMISSION_{name.upper()}"
+            limit = int(os.environ.get(f"{prefix}_LIMIT", default=default_limit))
+            return RouteClassLimiter(
+                name,
+                limit=limit,
+                queue_size=int(os.environ.get(f"{prefix}_QUEUE", default=4 * limit)),
+                timeout=float(os.environ.get(f"{prefix}_TIMEOUT", default=default_timeout)),
+            )
+
+        return cls(
+            auth=limiter("auth", os.cpu_count() or 1, 10.0),
+            writes=limiter("writes", 8, 5.0),
+            reads=limiter("reads", 24, 5.0),
+        )
+
+    def limiter_for(self, method: str, path: str) -> RouteClassLimiter:
+        if path.startswith("/auth") and path not in CHEAP_AUTH_PATHS:
+            return self.auth
+        if method not in READ_METHODS:
+            return self.writes
+        return self.reads
+
+    def snapshot(self) -> dict[str, dict[str, int | float]]:
+        return {
+            limiter.name: limiter.snapshot()
+            for limiter in (self.auth, self.writes, self.reads)
+        }
+
+
+controller = AdmissionController.from_env()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that bounds how many requests of each route class reach the
+    thread pool at once and sheds the excess with 503 and Retry-After.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController = controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.controller.limiter_for(scope["method"], scope["path"])
+        if not await limiter.acquire():
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "detail": {
+                        "type": "overloaded",
+                        "route_class": limiter.name,
+                    },
+                },
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
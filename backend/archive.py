@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from itertools import takewhile
+from typing import Callable, Optional
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from backend import database as db
+from backend.database import MESSAGE_COLUMNS, engine, pack_message_block
+from backend.jobs import JobContext
+from backend.schema import ChatInDB, MessageArchiveBlockInDB, MessageInDB
+
+archive_after_days = int(os.environ.get("ARCHIVE_AFTER_DAYS", default=365))
+archive_block_size = 500
+
+
+def archive_chat(
+    session: Session,
+    chat_id: int,
+    cutoff: datetime,
+    block_size: int = archive_block_size,
+) -> int:
+    """
+    Moves the messages of a chat created before ``cutoff`` into archive blocks.
+
+    Only the oldest run of messages is archived, so archived ids always sit
+    below the hot ones and reads can stitch the two ranges back together.
+    Every block is written in its own short transaction on the chat's shard.
+
+    :param chat_id: id of the chat to archive
+    :param cutoff: messages created before this moment are archived
+    :param block_size: maximum number of messages per block
+    :return: the number of archived messages
+    """
+    with db.shards.session_for(chat_id, session) as shard_session:
+        return _archive_chat(shard_session, chat_id, cutoff, block_size)
+
+
+def _archive_chat(session: Session, chat_id: int, cutoff: datetime, block_size: int) -> int:
+    archived = 0
+    while True:
+        rows = session.exec(
+            select(*MESSAGE_COLUMNS)
+            .where(MessageInDB.chat_id == chat_id)
+            .order_by(MessageInDB.id)
+            .limit(block_size)
+        ).all()
+        cold = list(takewhile(
+            lambda row: row[3] is not None and row[3] < cutoff,
+            rows,
+        ))
+        if not cold:
+            return archived
+
+        session.add(MessageArchiveBlockInDB(
+            chat_id=chat_id,
+            first_message_id=cold[0][0],
+            last_message_id=cold[-1][0],
+            message_count=len(cold),
+            payload=pack_message_block(cold),
+        ))
+        session.execute(
+            delete(MessageInDB)
+            .where(MessageInDB.chat_id == chat_id)
+            .where(MessageInDB.id <= cold[-1][0])
+        )
+        session.commit()
+        archived += len(cold)
+
+        if len(cold) < block_size:
+            return archived
+
+
+def archive_messages(
+    session: Session,
+    older_than: timedelta = timedelta(days=archive_after_days),
+    block_size: int = archive_block_size,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict[int, int]:
+    """
+    Archives the cold messages of every chat.
+
+    :param older_than: minimum age of an archived message
+    :param block_size: maximum number of messages per block
+    :param progress: called with ``(1, chat_count)`` after every chat
+    :return: the number of archived messages per chat id
+    """
+    cutoff = datetime.now() - older_than
+    chat_ids = session.exec(select(ChatInDB.id)).all()
+    archived = {}
+    for chat_id in chat_ids:
+        count = archive_chat(session, chat_id, cutoff, block_size)
+        if count:
+            archived[chat_id] = count
+        if progress is not None:
+            progress(1, len(chat_ids))
+    return archived
+
+
+def archive_messages_job(
+    session: Session,
+    context: JobContext,
+    older_than_days: int = archive_after_days,
+    block_size: int = archive_block_size,
+) -> dict[int, int]:
+    """Job handler for ``archive_messages``; reports archived chats as progress."""
+    return archive_messages(session, timedelta(days=older_than_days), block_size, context.advance)
+
+
+def lambda_handler(event, context):
+    try:
+        with Session(engine) as session:
+            result = archive_messages(session)
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result),
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)}),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive cold chat messages.")
+    parser.add_argument("--older-than-days", type=int, default=archive_after_days)
+    parser.add_argument("--block-size", type=int, default=archive_block_size)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        result = archive_messages(
+            session,
+            older_than=timedelta(days=args.older_than_days),
+            block_size=args.block_size,
+        )
+    print(json.dumps(result))
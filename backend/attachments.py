@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import AsyncIterator, Optional
+
+import anyio
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from backend.schema import AttachmentInDB
+
+if os.environ.get("DB_LOCATION") == "EFS":
+    attachment_dir = "/mnt/efs/attachments"
+else:
+    attachment_dir = os.environ.get("ATTACHMENT_DIR", default="backend/attachments")
+max_attachment_size = int(os.environ.get("ATTACHMENT_MAX_BYTES", default=100 * 1024 * 1024))
+# internal nginx location that serves ``attachment_dir``, e.g. /protected-attachments/
+accel_prefix = os.environ.get("ATTACHMENT_ACCEL_PREFIX")
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def attachment_path(attachment_id: str) -> str:
+    """Path of a stored blob, fanned out by the first two hex digits of its hash."""
+    return os.path.join(attachment_dir, attachment_id[:2], attachment_id)
+
+
+def accel_redirect(attachment_id: str) -> str:
+    """``X-Accel-Redirect`` target of a stored blob under ``accel_prefix``."""
+    return f"{accel_prefix.rstrip('/')}/{attachment_id[:2]}/{attachment_id}"
+
+
+async def store_upload(
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    session: Session,
+) -> AttachmentInDB:
+    """
+    Streams an upload to disk and stores it under its SHA-256 hash.
+
+    Chunks are hashed and written as they arrive, so the upload is never held
+    in memory. If a blob with the same hash already exists, the temporary copy
+    is discarded and the existing attachment is returned.
+
+    :param chunks: the request body
+    :param content_type: media type of the upload
+    :return: the stored attachment
+    :raises HTTPException: if the upload exceeds ``max_attachment_size``
+    """
+    os.makedirs(attachment_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, upload_path = tempfile.mkstemp(dir=attachment_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as upload:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_attachment_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail={
+                            "type": "attachment_too_large",
+                            "max_size": max_attachment_size,
+                        },
+                    )
+                digest.update(chunk)
+                await run_in_threadpool(upload.write, chunk)
+        return await run_in_threadpool(
+            _save_upload, session, upload_path, digest.hexdigest(), size, content_type
+        )
+    finally:
+        if os.path.exists(upload_path):
+            os.unlink(upload_path)
+
+
+def _save_upload(
+    session: Session,
+    upload_path: str,
+    attachment_id: str,
+    size: int,
+    content_type: str,
+) -> AttachmentInDB:
+    attachment = session.get(AttachmentInDB, attachment_id)
+    if attachment is not None:
+        return attachment
+
+    path = attachment_path(attachment_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(upload_path, path)
+    attachment = AttachmentInDB(id=attachment_id, size=size, content_type=content_type)
+    session.add(attachment)
+    try:
+        session.commit()
+    except IntegrityError:
+        # a concurrent upload of the same content won the race
+        session.rollback()
+        return session.get(AttachmentInDB, attachment_id)
+    session.refresh(attachment)
+    return attachment
+
+
+class RangeFileResponse(FileResponse):
+    """
+    File response that honours single-range ``Range`` requests.
+
+    Bodies are handed to the server with the ``http.response.zerocopysend``
+    extension when it is available, so the kernel copies the file straight to
+    the socket; otherwise the requested range is streamed in fixed-size chunks.
+    uvicorn does not offer the extension, so behind it every byte passes
+    through Python; set ``ATTACHMENT_ACCEL_PREFIX`` to let nginx send the file.
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result, range_header: Optional[str] = None, **kwargs):
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        size = stat_result.st_size
+        self.start, self.end = 0, size - 1
+        self.headers["accept-ranges"] = "bytes"
+        if range_header is None:
+            return
+
+        match = RANGE_PATTERN.match(range_header.strip())
+        if match is None or match.groups() == ("", ""):
+            return  # multiple or malformed ranges: send the whole file
+        first, last = match.groups()
+        if first == "":
+            self.start = max(0, size - int(last))
+        else:
+            self.start = int(first)
+            if last != "":
+                self.end = min(int(last), size - 1)
+        if self.start > self.end or self.start >= size:
+            self.status_code = 416
+            self.start, self.end = 0, -1
+            self.headers["content-range"] = f"bytes */{size}"
+        else:
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        count = self.end - self.start + 1
+        if self.send_header_only or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.wrapped.fileno(),
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+                return
+
+            await file.seek(self.start)
+            while count > 0:
+                chunk = await file.read(min(self.chunk_size, count))
+                count -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": count > 0 and len(chunk) > 0,
+                })
+                if not chunk:
+                    break
@@ -1,6 +1,9 @@
+import hashlib
+import hmac
 import os
-from datetime import datetime, timezone
-from typing import Annotated
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import (
@@ -10,12 +13,16 @@ from fastapi.security import (
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, ValidationError
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, SQLModel, select
 
 from backend import database as db
+from backend import events
 from backend.schema import (
     UserChatLinkInDB,
     UserInDB,
+    RefreshTokenInDB,
     ChatInDB,
     MessageInDB,
     UserResponse,
@@ -28,6 +35,11 @@ access_token_duration = 3600  # seconds
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 jwt_key = os.environ.get("JWT_KEY", default="dev jwt key")
 jwt_alg = "HS256"
+refresh_token_duration = int(os.environ.get("REFRESH_TOKEN_DAYS", default=30)) * 24 * 3600  # seconds
+refresh_key = os.environ.get("REFRESH_TOKEN_KEY", default=jwt_key).encode()
+admin_usernames = {  # comma separated usernames allowed under /admin
+    username.strip() for username in os.environ.get("ADMIN_USERNAMES", default="").split(",") if username.strip()
+}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
@@ -44,6 +56,12 @@ class AccessToken(BaseModel):
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: Optional[str] = None
+    refresh_expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    """Request model to exchange or revoke a refresh token."""
+    refresh_token: str
 
 class Claims(BaseModel):
     """Access token claims (aka payload)."""
@@ -81,6 +99,13 @@ class ExpiredToken(AuthException):
             description="expired access token",
         )
 
+class InvalidRefreshToken(AuthException):
+    def __init__(self):
+        super().__init__(
+            error="invalid_grant",
+            description="invalid or expired refresh token",
+        )
+
 def get_current_user(
     session: Session = Depends(db.get_session),
     token: str = Depends(oauth2_scheme),
@@ -89,6 +114,19 @@ def get_current_user(
     user = _decode_access_token(session, token)
     return user
 
+def get_admin_user(user: UserInDB = Depends(get_current_user)) -> UserInDB:
+    """FastAPI dependency for admin routes; the current user must be listed in ``ADMIN_USERNAMES``."""
+    if user.username not in admin_usernames:
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "type":"permission_denied",
+                "entity_name":"User",
+                "entity_id":user.id
+            }
+        )
+    return user
+
 @auth_router.post("/registration", response_model=UserResponse, status_code=201)
 def register_new_user(
     registration: UserRegistration,
@@ -118,13 +156,33 @@ def register_new_user(
             }
         )
     else:
+        db.release(session)
         hashed_password = pwd_context.hash(registration.password)
         user = UserInDB(
             **registration.model_dump(),
             hashed_password=hashed_password,
         )
         session.add(user)
-        session.commit()
+        try:
+            session.flush()
+            events.bus.publish(session, "user", user.id)
+            session.commit()
+        except IntegrityError:
+            # a concurrent registration took the name or email while hashing
+            session.rollback()
+            if session.exec(select(UserInDB.id).where(UserInDB.username == registration.username)).first():
+                field, value = "username", registration.username
+            else:
+                field, value = "email", registration.email
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    "type":"duplicate_value",
+                    "entity_name":"User",
+                    "entity_field":field,
+                    "entity_value":value
+                }
+            )
         session.refresh(user)
         return UserResponse(user=UserResponseModel(id=user.id,
                                                    username=user.username,
@@ -136,32 +194,121 @@ def get_access_token(
     form: OAuth2PasswordRequestForm = Depends(),
     session: Session = Depends(db.get_session),
 ):
-    """Get access token for user."""
-    user = _get_authenticated_user(session, form)
-    return _build_access_token(user)
+    """Get access token and refresh token for user."""
+    user_id = _get_authenticated_user_id(session, form)
+    return _build_access_token(user_id, _issue_refresh_token(session, user_id))
 
-def _get_authenticated_user(
+@auth_router.post("/refresh", response_model=AccessToken)
+def refresh_access_token(
+    request: RefreshRequest,
+    session: Session = Depends(db.get_session),
+):
+    """Exchange a refresh token for a new access token and refresh token."""
+    user_id, refresh_token = _rotate_refresh_token(session, request.refresh_token)
+    return _build_access_token(user_id, refresh_token)
+
+@auth_router.post("/revoke", status_code=204)
+def revoke_refresh_token(
+    request: RefreshRequest,
+    session: Session = Depends(db.get_session),
+):
+    """Revoke a refresh token and every token rotated from the same login."""
+    stored = _get_refresh_token(session, request.refresh_token)
+    if stored is not None:
+        _revoke_family(session, stored.family)
+
+def _get_authenticated_user_id(
     session: Session,
     form: OAuth2PasswordRequestForm,
-) -> UserInDB:
+) -> int:
     user = session.exec(
-        select(UserInDB).where(UserInDB.username == form.username)
+        select(UserInDB.id, UserInDB.hashed_password).where(UserInDB.username == form.username)
     ).first()
+    db.release(session)  # do not hold the writer while bcrypt runs
 
     if user is None or not pwd_context.verify(form.password, user.hashed_password):
         raise InvalidCredentials()
-    return user
+    return user.id
 
-def _build_access_token(user: UserInDB) -> AccessToken:
+def _build_access_token(user_id: int, refresh_token: Optional[str] = None) -> AccessToken:
     expiration = int(datetime.now(timezone.utc).timestamp()) + access_token_duration
-    claims = Claims(sub=str(user.id), exp=expiration)
+    claims = Claims(sub=str(user_id), exp=expiration)
     access_token = jwt.encode(claims.model_dump(), key=jwt_key, algorithm=jwt_alg)
 
     return AccessToken(
         access_token=access_token,
         token_type="Bearer",
         expires_in=access_token_duration,
+        refresh_token=refresh_token,
+        refresh_expires_in=None if refresh_token is None else refresh_token_duration,
+    )
+
+def _hash_refresh_token(token: str) -> str:
+    # refresh tokens are random, so a keyed hash is enough; no need for bcrypt
+    return hmac.new(refresh_key, token.encode(), hashlib.sha256).hexdigest()
+
+def _issue_refresh_token(session: Session, user_id: int, family: Optional[str] = None) -> str:
+    token = secrets.token_urlsafe(32)
+    session.add(RefreshTokenInDB(
+        token_hash=_hash_refresh_token(token),
+        family=family or secrets.token_hex(16),
+        user_id=user_id,
+        expires_at=datetime.now() + timedelta(seconds=refresh_token_duration),
+    ))
+    session.commit()
+    return token
+
+def _get_refresh_token(session: Session, token: str) -> Optional[RefreshTokenInDB]:
+    return session.exec(
+        select(RefreshTokenInDB).where(RefreshTokenInDB.token_hash == _hash_refresh_token(token))
+    ).first()
+
+def _rotate_refresh_token(session: Session, token: str) -> tuple[int, str]:
+    """
+    Revokes a refresh token and issues its successor.
+
+    Presenting a token that was already rotated means it was copied, so
+    every token of its login is revoked.
+
+    :return: the id of the token's user and the new refresh token
+    :raises InvalidRefreshToken: if the token is unknown, expired or revoked
+    """
+    stored = _get_refresh_token(session, token)
+    now = datetime.now()
+    if stored is None or stored.expires_at <= now:
+        raise InvalidRefreshToken()
+    if stored.revoked_at is not None:
+        _revoke_family(session, stored.family)
+        raise InvalidRefreshToken()
+    rotated = session.execute(
+        update(RefreshTokenInDB)
+        .where(RefreshTokenInDB.id == stored.id)
+        .where(RefreshTokenInDB.revoked_at == None)
+        .values(revoked_at=now)
+    ).rowcount
+    if not rotated:
+        # a concurrent refresh with the same token won
+        session.rollback()
+        raise InvalidRefreshToken()
+    return stored.user_id, _issue_refresh_token(session, stored.user_id, stored.family)
+
+def _revoke_family(session: Session, family: str):
+    session.execute(
+        update(RefreshTokenInDB)
+        .where(RefreshTokenInDB.family == family)
+        .where(RefreshTokenInDB.revoked_at == None)
+        .values(revoked_at=datetime.now())
+    )
+    session.commit()
+
+def prune_refresh_tokens_job(session: Session, context) -> dict[str, int]:
+    """Job handler that deletes expired refresh tokens."""
+    result = session.execute(
+        delete(RefreshTokenInDB).where(RefreshTokenInDB.expires_at <= datetime.now())
     )
+    session.commit()
+    context.advance(result.rowcount)
+    return {"deleted": result.rowcount}
 
 def _decode_access_token(session: Session, token: str) -> UserInDB:
     try:
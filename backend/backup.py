@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import Engine, func
+from sqlmodel import Session, SQLModel, select
+
+from backend import database as db
+from backend import events
+from backend.jobs import JobContext
+from backend.migrations import migrate
+from backend.schema import EventInDB
+
+if os.environ.get("DB_LOCATION") == "EFS":
+    backup_dir = "/mnt/efs/backups"
+else:
+    backup_dir = os.environ.get("BACKUP_DIR", default="backend/backups")
+backup_step_pages = int(os.environ.get("BACKUP_STEP_PAGES", default=4096))
+backup_pause = float(os.environ.get("BACKUP_PAUSE", default=0.005))  # seconds between steps
+backup_keep = int(os.environ.get("BACKUP_KEEP", default=7))  # newest backups kept; 0 keeps every one
+max_restarts = 3
+
+BACKUP_NAME = re.compile(r"\d{8}-\d{6}")
+
+# topics whose caches must be dropped once a database has been replaced
+RESTORED_TOPICS = ("user", "chat", "message")
+
+Progress = Callable[[int, int], None]
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy_database(
+    source: sqlite3.Connection,
+    target: sqlite3.Connection,
+    step_pages: int = backup_step_pages,
+    pause: float = backup_pause,
+    progress: Optional[Progress] = None,
+) -> dict[str, int]:
+    """
+    Copies a database page by page with SQLite's online backup API.
+
+    The source is only locked while a step of ``step_pages`` pages is copied,
+    and the copy pauses for ``pause`` seconds between steps, so writers keep
+    committing throughout. A write from another connection makes SQLite start
+    the copy over; after ``max_restarts`` restarts the rest is copied in one
+    step, which in WAL mode reads a single snapshot without blocking writers.
+
+    With a rollback journal (``DELETE`` mode, used on EFS) every step holds a
+    read lock that keeps writers from committing, and the one-step fallback
+    holds it for the whole copy, so writes wait for the backup instead.
+
+    :param progress: called with ``(pages copied since the last call, total pages)``
+    :return: the number of pages, steps and restarts
+    """
+    stats = {"pages": 0, "steps": 0, "restarts": 0}
+    copied = 0
+
+    def step(status: int, remaining: int, total: int):
+        nonlocal copied
+        done = total - remaining
+        if done < copied:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+            copied = 0
+        stats["pages"] = total
+        stats["steps"] += 1
+        if progress is not None and done > copied:
+            progress(done - copied, total)
+        copied = done
+        if remaining:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=step_pages, progress=step)
+    except _TooManyRestarts:
+        source.backup(target)
+        stats["steps"] += 1
+    return stats
+
+
+def backup_database(
+    engine: Engine,
+    path: str,
+    step_pages: int = backup_step_pages,
+    pause: float = backup_pause,
+    progress: Optional[Progress] = None,
+) -> dict[str, int]:
+    """
+    Writes a consistent copy of a live database to ``path``.
+
+    The copy is built next to ``path`` and renamed into place, so a crash
+    never leaves a torn backup behind. No connection of the engine is used;
+    the writer stays free for requests.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = f"{path}.partial"
+    source = sqlite3.connect(engine.url.database)
+    target = sqlite3.connect(partial_path)
+    try:
+        stats = copy_database(source, target, step_pages, pause, progress)
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial_path, path)
+    return stats
+
+
+def backup_all(
+    directory: Optional[str] = None,
+    step_pages: int = backup_step_pages,
+    pause: float = backup_pause,
+    progress: Optional[Progress] = None,
+) -> dict[str, dict[str, int]]:
+    """
+    Backs up the primary database and every shard into a new timestamped directory.
+
+    Afterwards only the newest ``backup_keep`` backups are kept.
+
+    :param directory: parent of the new directory, ``backup_dir`` by default
+    :param progress: called with ``(1, number of databases)`` after every database
+    :return: the copy statistics per written file
+    """
+    target_dir = os.path.join(directory or backup_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    engines = db.shards.engines
+    result = {}
+    for engine in engines:
+        path = os.path.join(target_dir, os.path.basename(engine.url.database))
+        started = time.monotonic()
+        result[path] = backup_database(engine, path, step_pages, pause)
+        result[path]["seconds"] = round(time.monotonic() - started, 3)
+        if progress is not None:
+            progress(1, len(engines))
+    prune_backups(directory or backup_dir)
+    return result
+
+
+def prune_backups(directory: Optional[str] = None, keep: Optional[int] = None) -> list[str]:
+    """
+    Removes all but the newest ``keep`` timestamped backup directories.
+
+    :param keep: ``backup_keep`` by default; 0 keeps every backup
+    :return: the removed directories
+    """
+    directory = directory or backup_dir
+    keep = backup_keep if keep is None else keep
+    if keep <= 0 or not os.path.isdir(directory):
+        return []
+    backups = sorted(name for name in os.listdir(directory) if BACKUP_NAME.fullmatch(name))
+    removed = [os.path.join(directory, name) for name in backups[:-keep]]
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+def blocks_writers() -> bool:
+    """Whether an online backup makes writers wait, i.e. the databases do not use WAL."""
+    return db.journal_mode.upper() != "WAL"
+
+
+def restore_database(engine: Engine, path: str, step_pages: int = backup_step_pages) -> dict[str, int]:
+    """
+    Replaces the contents of a live database with a backup, page by page.
+
+    The pages are written through the engine's writer connection, so writes
+    of this process wait for the restore instead of failing. SQLite holds the
+    destination locked until the last page is in, so there are no pauses
+    between steps. Tables and migrations the backup predates are applied
+    afterwards.
+
+    :param path: a file written by ``backup_database``, or any SQLite database
+        such as ``initial.db``
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        with engine.connect() as connection:
+            stats = copy_database(source, connection.connection.driver_connection, step_pages, pause=0)
+    finally:
+        source.close()
+
+    if engine is db.engine:
+        SQLModel.metadata.create_all(engine)
+    else:
+        SQLModel.metadata.create_all(engine, tables=db.SHARDED_TABLES)
+    migrate(engine)
+    return stats
+
+
+def restore_all(paths: list[str], step_pages: int = backup_step_pages) -> dict[str, dict[str, int]]:
+    """
+    Restores the primary database and its shards, then tells every worker to
+    drop its caches.
+
+    The restored ``events`` table may end below ids the workers have already
+    seen, so a placeholder event keeps new ids growing past them. Shards
+    copied after the primary may hold newer messages, so the message id
+    sequence is moved past them.
+
+    :param paths: one backup file per shard, primary first
+    """
+    with Session(db.engine) as session:
+        last_event_id = session.scalar(select(func.max(EventInDB.id))) or 0
+    result = {
+        engine.url.database: restore_database(engine, path, step_pages)
+        for engine, path in zip(db.shards.engines, paths)
+    }
+    db.shards.seed_message_ids()
+    with Session(db.engine) as session:
+        if (session.scalar(select(func.max(EventInDB.id))) or 0) < last_event_id:
+            session.add(EventInDB(id=last_event_id, topic="restore", origin=events.bus.origin))
+        for topic in RESTORED_TOPICS:
+            events.bus.publish(session, topic)
+        session.commit()
+    return result
+
+
+def backup_database_job(session: Session, context: JobContext, directory: Optional[str] = None) -> dict:
+    """Job handler for ``backup_database``; every copied database counts as one step."""
+    return backup_all(directory, progress=context.advance)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up or restore the databases without stopping the server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_parser = commands.add_parser("backup", help="copy every database into a new timestamped directory")
+    backup_parser.add_argument("--directory", default=None)
+    restore_parser = commands.add_parser("restore", help="replace the databases with the files of a backup")
+    restore_parser.add_argument("directory", help="a directory written by backup, or one database file")
+    parser.add_argument("--step-pages", type=int, default=backup_step_pages)
+    parser.add_argument("--pause", type=float, default=backup_pause, help="seconds between backup steps")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        result = backup_all(args.directory, args.step_pages, args.pause)
+    elif os.path.isfile(args.directory):
+        result = restore_all([args.directory], args.step_pages)
+    else:
+        result = restore_all(
+            [os.path.join(args.directory, os.path.basename(engine.url.database)) for engine in db.shards.engines],
+            args.step_pages,
+        )
+    print(json.dumps(result))
@@ -0,0 +1,98 @@
+import functools
+import inspect
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+
+from sqlmodel import Session
+
+from backend import events
+
+coalescing_enabled = os.environ.get("READ_COALESCING", default="1") == "1"
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Shares one in-flight computation between identical concurrent calls.
+
+    The first caller with a key runs the computation; callers arriving with
+    the same key while it runs wait for it and get the same result, or the
+    same exception. Nothing is kept once the computation finishes, so this
+    only removes duplicate work and never serves an old result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, Future] = {}
+        self.led = 0
+        self.joined = 0
+
+    def do(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """
+        Runs ``compute``, or waits for the running computation with the same key.
+
+        :return: the result of the computation
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.led += 1
+            else:
+                self.joined += 1
+        if leader:
+            try:
+                flight.set_result(compute())
+            except BaseException as e:
+                flight.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._flights[key]
+        return flight.result()
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._flights), "led": self.led, "joined": self.joined}
+
+
+flights = SingleFlight()
+
+
+def coalesced(read: Callable[..., T]) -> Callable[..., T]:
+    """
+    Coalesces concurrent identical calls of a read function.
+
+    Calls are identical when they pass the same arguments, other than the
+    session, to the same database, and no event has been dispatched in this
+    process in between: the key includes ``events.bus.generation``, so a call
+    made after a write never joins a computation that started before it.
+    Writes from other workers are seen once the event poller dispatches them,
+    as with every other cache here.
+
+    Only sessions on the read-only pool are coalesced; a writer session may
+    hold uncommitted changes that other callers must not see. Anything the
+    result depends on, such as the caller's id, must be an argument. Callers
+    share the returned objects and must not modify them.
+    """
+    signature = inspect.signature(read)
+
+    @functools.wraps(read)
+    def wrapper(*args, **kwargs) -> T:
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        session: Session = arguments.arguments["session"]
+        if not coalescing_enabled or not session.info.get("read_only"):
+            return read(*args, **kwargs)
+        key = (
+            read.__qualname__,
+            id(session.get_bind()),
+            events.bus.generation,
+            tuple((name, value) for name, value in arguments.arguments.items() if name != "session"),
+        )
+        return flights.do(key, lambda: read(*args, **kwargs))
+
+    return wrapper
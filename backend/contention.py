@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import Engine, QueuePool, event
+from sqlalchemy.orm import Session
+
+contention_enabled = os.environ.get("CONTENTION_STATS", default="0") == "1"
+contention_log = os.environ.get("CONTENTION_LOG")  # file every worker appends its statistics to on shutdown
+max_samples = 10000  # most recent durations kept per statistic for percentiles
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+LOCKED_MESSAGE = "database is locked"
+
+
+def summarize(samples: list[float], count: Optional[int] = None) -> dict[str, float]:
+    """
+    Summarizes durations in seconds as milliseconds.
+
+    :param count: number of recorded durations, if more than ``samples``
+    """
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3) if ordered else 0.0
+
+    return {
+        "count": len(ordered) if count is None else count,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+class LatencyStats:
+    """Durations of one kind of operation; only the latest ``max_samples`` are kept."""
+
+    def __init__(self, max_samples: int = max_samples):
+        self._lock = threading.Lock()
+        self._samples: deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def samples(self) -> list[float]:
+        with self._lock:
+            return list(self._samples)
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            samples, count = list(self._samples), self.count
+        return summarize(samples, count)
+
+
+class ContentionMonitor:
+    """
+    Lock contention statistics of one process.
+
+    ``writer_wait`` is how long a checkout waited for the process's single
+    writer connection. ``lock_wait`` is the duration of the first write
+    statement of every transaction, which takes SQLite's write lock and waits
+    for other processes for up to ``busy_timeout``. ``commit`` is the time a
+    writer session spends in ``commit()``, including its flush. Errors saying
+    "database is locked" are counted on every instrumented engine.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.writer_wait = LatencyStats()
+        self.lock_wait = LatencyStats()
+        self.commit = LatencyStats()
+        self.locked_errors = 0
+        self._lock = threading.Lock()
+
+    def instrument(self, engine: Engine):
+        """Records lock waits and "database is locked" errors of an engine."""
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_execute(connection, cursor, statement, parameters, context, executemany):
+            connection.info["statement_started"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_execute(connection, cursor, statement, parameters, context, executemany):
+            if connection.info.get("write_locked") or not _is_write(statement):
+                return
+            connection.info["write_locked"] = True
+            self.lock_wait.record(time.perf_counter() - connection.info["statement_started"])
+
+        @event.listens_for(engine, "commit")
+        @event.listens_for(engine, "rollback")
+        def end_transaction(connection):
+            connection.info.pop("write_locked", None)
+
+        @event.listens_for(engine, "handle_error")
+        def handle_error(context):
+            if LOCKED_MESSAGE not in str(context.original_exception):
+                return
+            with self._lock:
+                self.locked_errors += 1
+            started = context.connection.info.get("statement_started") if context.connection else None
+            if started is not None and _is_write(context.statement or ""):
+                self.lock_wait.record(time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        uptime = time.monotonic() - self.started
+        commit = self.commit.snapshot()
+        return {
+            "pid": os.getpid(),
+            "uptime": round(uptime, 3),
+            "commits_per_second": round(commit["count"] / uptime, 1) if uptime else 0.0,
+            "locked_errors": self.locked_errors,
+            "writer_wait": self.writer_wait.snapshot(),
+            "lock_wait": self.lock_wait.snapshot(),
+            "commit": commit,
+        }
+
+    def dump(self, path: str):
+        """Appends the statistics and the raw samples of this process to a JSON lines file."""
+        record = self.snapshot()
+        record["samples"] = {
+            "writer_wait": self.writer_wait.samples(),
+            "lock_wait": self.lock_wait.samples(),
+            "commit": self.commit.samples(),
+        }
+        with open(path, "a") as log:
+            log.write(json.dumps(record) + "\n")
+
+
+monitor = ContentionMonitor()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long every checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            monitor.writer_wait.record(time.perf_counter() - started)
+
+
+def _is_write(statement: str) -> bool:
+    return statement.lstrip().upper().startswith(WRITE_STATEMENTS)
+
+
+def _before_commit(session: Session):
+    if not session.info.get("read_only"):
+        session.info["commit_started"] = time.perf_counter()
+
+
+def _after_commit(session: Session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        monitor.commit.record(time.perf_counter() - started)
+
+
+if contention_enabled:
+    event.listen(Session, "before_commit", _before_commit)
+    event.listen(Session, "after_commit", _after_commit)
@@ -1,68 +1,445 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import json
 import os
+import re
+import time
+import weakref
+import zlib
+from typing import Any, Callable, Iterator, Optional
+from sqlalchemy import QueuePool, delete, event, func, insert, literal, or_
+from sqlalchemy.dialects.sqlite import insert as upsert
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, SQLModel, create_engine, select
 
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+
+from backend import contention, events, jobs, recent_messages
+from backend.coalesce import coalesced
+from backend.migrations import migrate
 
 from backend.schema import (
+    UserChatLinkInDB,
     UserInDB,
     UserUpdate,
     ChatInDB,
     MessageInDB,
+    MessageArchiveBlockInDB,
+    AttachmentInDB,
+    MessageAttachmentLinkInDB,
+    MentionInDB,
+    ChatActivityInDB,
+    ChatPosterInDB,
+    ChatShardInDB,
+    MessageIdSequenceInDB,
+    MessageOutboxInDB,
+    ChangeInDB,
+    ChangeModel,
+    JobInDB,
     UserResponseModel,
     ChatResponseModel,
     MessageResponseModel,
+    MentionResponseModel,
+    AttachmentResponseModel,
+    AttachmentReference,
     ChatUpdate
 )
 
-def get_engine():
+journal_mode = os.environ.get(
+    "SQLITE_JOURNAL_MODE",
+    # WAL needs shared memory, which network file systems such as EFS lack
+    default="DELETE" if os.environ.get("DB_LOCATION") == "EFS" else "WAL",
+)
+busy_timeout = 30000  # milliseconds
+writer_timeout = float(os.environ.get("DB_WRITER_TIMEOUT", default=30))  # seconds
+reader_pool_size = int(os.environ.get("DB_READER_POOL_SIZE", default=8))
+echo = os.environ.get("DB_ECHO", default="0" if os.environ.get("DB_LOCATION") == "EFS" else "1") == "1"
+
+READ_METHODS = {"GET", "HEAD"}
+
+def get_db_path(name: str = "pony_express") -> str:
     if os.environ.get("DB_LOCATION") == "EFS":
-        db_path = "/mnt/efs/pony_express.db"
-        echo = False
-    else:
-        db_path = "backend/pony_express.db"
-        echo = True
-    return create_engine(
-    f"sqlite:///{db_path}",
-    echo=echo,
-    connect_args={"check_same_thread": False},
+        return f"/mnt/efs/{name}.db"
+    return os.path.join(os.environ.get("DB_DIR", default="backend"), f"{name}.db")
+
+def get_engine(name: str = "pony_express", db_path: Optional[str] = None):
+    """
+    Creates the writer engine of a database.
+
+    It holds a single connection, so writes within a process queue for it in
+    order instead of racing each other into "database is locked" errors.
+    """
+    writer = create_engine(
+        f"sqlite:///{db_path or get_db_path(name)}",
+        echo=echo,
+        connect_args={"check_same_thread": False},
+        poolclass=contention.TimedQueuePool if contention.contention_enabled else QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=writer_timeout,
     )
 
+    @event.listens_for(writer, "connect")
+    def configure(connection, _record):
+        connection.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+        connection.execute(f"PRAGMA journal_mode = {journal_mode}")
+        connection.execute("PRAGMA synchronous = NORMAL")
+
+    if contention.contention_enabled:
+        contention.monitor.instrument(writer)
+    return writer
+
+def get_read_engine(name: str = "pony_express", db_path: Optional[str] = None):
+    """
+    Creates a pool of read-only connections to a database.
+
+    Connections are opened with ``mode=ro`` and ``query_only``, so a bug can
+    never write through them. Under WAL they read a snapshot and never wait
+    for the writer.
+    """
+    reader = create_engine(
+        f"sqlite:///file:{db_path or get_db_path(name)}?mode=ro&uri=true",
+        echo=echo,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=reader_pool_size,
+        max_overflow=reader_pool_size,
+    )
+
+    @event.listens_for(reader, "connect")
+    def configure(connection, _record):
+        connection.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+        connection.execute("PRAGMA query_only = ON")
+
+    if contention.contention_enabled:
+        contention.monitor.instrument(reader)
+    return reader
+
 engine = get_engine()
+read_engine = get_read_engine()
 
 # with open("backend/fake_db.json", "r") as f:
 #     DB = json.load(f)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+SHARDED_TABLES = [
+    MessageInDB.__table__,
+    MessageArchiveBlockInDB.__table__,
+    MessageIdSequenceInDB.__table__,
+    MessageOutboxInDB.__table__,
+]
+
+# sharded message ids encode their shard, see ShardRouter.allocate_message_id
+MAX_SHARDS = 64
+SHARD_ID_BASE = 1 << 40
+
+class ShardRouter:
+    """
+    Routes the message tables of each chat to one of several SQLite files.
+
+    Users, chats and memberships always live in the primary database, which
+    doubles as shard 0. A chat's messages live on shard 0 until a
+    ``chat_shards`` row places them elsewhere (see ``backend.rebalance``).
+    """
+
+    def __init__(self, engines: list, read_engines: Optional[list] = None):
+        self.engines = engines
+        self.read_engines = read_engines or engines
+        self.clock = time.time
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.engines) > 1
+
+    def shard_of(self, chat_id: str, session: Session) -> int:
+        """
+        Looks up the shard that holds the messages of a chat.
+
+        :param chat_id: id of the chat
+        :param session: a session on the primary database
+        :return: the shard index
+        """
+        if not self.enabled:
+            return 0
+        placement = session.get(ChatShardInDB, chat_id)
+        return placement.shard if placement else 0
+
+    def bind_for(self, shard: int, session: Session):
+        """
+        Returns the engine of a shard, reusing the bind of the primary session
+        for shard 0 and matching its read-only mode for the others.
+        """
+        if shard == 0:
+            return session.get_bind()
+        if session.info.get("read_only"):
+            return self.read_engines[shard]
+        return self.engines[shard]
+
+    def read_bind(self, session: Session):
+        """Returns the read-only engine of the database a primary session is bound to."""
+        bind = session.get_bind()
+        for engine, read_engine in zip(self.engines, self.read_engines):
+            if bind is engine:
+                return read_engine
+        return bind
+
+    @contextmanager
+    def session_for(self, chat_id: str, session: Session) -> Iterator[Session]:
+        """
+        Opens a session on the shard that holds the messages of a chat.
+
+        For chats on shard 0 the primary session itself is yielded, so message
+        writes share its transaction.
+
+        :param chat_id: id of the chat
+        :param session: a session on the primary database
+        """
+        shard = self.shard_of(chat_id, session)
+        if shard == 0:
+            yield session
+        else:
+            with Session(self.bind_for(shard, session), info=dict(session.info)) as shard_session:
+                yield shard_session
+
+    def allocate_message_id(self, shard: int, session: Session) -> Optional[int]:
+        """
+        Hands out a message id that is unique across all shards.
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+        Every shard keeps its own sequence, so allocating an id takes no lock
+        on any other database. Sequence values follow the clock in
+        milliseconds and never go backwards, and the shard sits in the low
+        bits, so ids from different shards never collide and still grow
+        roughly in the order messages are written. Without sharding the
+        database assigns ids as usual and ``None`` is returned.
+
+        :param shard: index of the shard the message is written to
+        :param session: a session on that shard, in the message's transaction
+        """
+        if not self.enabled:
+            return None
+        now = int(self.clock() * 1000)
+        sequence = session.execute(
+            insert(MessageIdSequenceInDB)
+            .from_select(
+                ["id"],
+                select(func.max(func.coalesce(func.max(MessageIdSequenceInDB.id), 0) + 1, now)),
+            )
+            .returning(MessageIdSequenceInDB.id)
+        ).scalar_one()
+        session.execute(
+            delete(MessageIdSequenceInDB).where(MessageIdSequenceInDB.id < sequence)
+        )
+        return SHARD_ID_BASE + sequence * MAX_SHARDS + shard
+
+    def reserve_message_ids(self, session: Session, message_id: Optional[int]):
+        """
+        Moves the sequence of the shard a session is bound to past a message
+        id, e.g. one copied over from another shard.
+        """
+        if not self.enabled or not _sequence_of(message_id):
+            return
+        session.execute(
+            upsert(MessageIdSequenceInDB).values(id=_sequence_of(message_id)).on_conflict_do_nothing()
+        )
+
+    def seed_message_ids(self):
+        """
+        Moves the sequence of every shard past the message ids it holds,
+        e.g. on shards restored from backups taken after their sequence was.
+        """
+        if not self.enabled:
+            return
+        for shard_engine in self.engines:
+            with Session(shard_engine) as shard_session:
+                highest = max(
+                    shard_session.scalar(select(func.max(MessageInDB.id))) or 0,
+                    shard_session.scalar(select(func.max(MessageArchiveBlockInDB.last_message_id))) or 0,
+                )
+                if _sequence_of(highest) > (shard_session.scalar(select(func.max(MessageIdSequenceInDB.id))) or 0):
+                    self.reserve_message_ids(shard_session, highest)
+                    shard_session.commit()
+
+    def fan_out(self, session: Session, query: Callable[[Session], Any]) -> list:
+        """
+        Runs a read against every shard in parallel.
+
+        :param session: a session on the primary database
+        :param query: function receiving a shard session
+        :return: the results in shard order
+        """
+        def run(shard: int):
+            if shard == 0:
+                return query(session)
+            with Session(self.bind_for(shard, session)) as shard_session:
+                return query(shard_session)
+
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as executor:
+            return list(executor.map(run, range(len(self.engines))))
+
+def _sequence_of(message_id: Optional[int]) -> int:
+    return max(0, (message_id - SHARD_ID_BASE) // MAX_SHARDS) if message_id else 0
+
+def get_shard_count() -> int:
+    shard_count = int(os.environ.get("SHARD_COUNT", default=1))
+    if not 1 <= shard_count <= MAX_SHARDS:
+        raise ValueError(f"SHARD_COUNT must be between 1 and {MAX_SHARDS}")
+    return shard_count
+
+def get_shard_engines() -> list:
+    return [engine] + [get_engine(f"pony_express_shard{shard}") for shard in range(1, get_shard_count())]
+
+def get_shard_read_engines() -> list:
+    return [read_engine] + [get_read_engine(f"pony_express_shard{shard}") for shard in range(1, get_shard_count())]
+
+shards = ShardRouter(get_shard_engines(), get_shard_read_engines())
+
+def create_db_and_tables() -> list[list[int]]:
+    """
+    Creates missing tables and applies pending migrations on every shard.
+
+    Tables are created under the migration lock, so workers starting together
+    never race each other into "table already exists" errors.
+
+    :return: the migration versions applied per shard
+    """
+    applied = [migrate(engine, SQLModel.metadata.create_all)]
+    for shard_engine in shards.engines[1:]:
+        applied.append(migrate(
+            shard_engine, lambda connection: SQLModel.metadata.create_all(connection, tables=SHARDED_TABLES)
+        ))
+    shards.seed_message_ids()
+    return applied
+
+def get_session(request: Request):
+    """
+    FastAPI dependency for a database session.
+
+    GET and HEAD requests get a session on the read-only pool; everything
+    else shares the single writer connection.
+    """
+    if request.method in READ_METHODS:
+        with Session(read_engine, info={"read_only": True}) as session:
+            yield session
+    else:
+        with Session(engine) as session:
+            yield session
+
+def release(session: Session):
+    """
+    Ends the session's transaction so its connection goes back to the pool.
+
+    Call it before slow work that does not need the database, such as
+    password hashing or reading an upload, so writes are not held up.
+    Loaded objects are expired and reload on their next access.
+    """
+    session.rollback()
 
 class EntityNotFoundException(Exception):
     def __init__(self, *, entity_name: str, entity_id: str):
         self.entity_name = entity_name
         self.entity_id = entity_id
 
+""" pagination """
+
+count_cache_ttl = 5.0  # seconds
+_count_cache: "weakref.WeakKeyDictionary[Any, dict[str, tuple[float, int]]]" = weakref.WeakKeyDictionary()
+
+def cached_count(name: str, session: Session, statement) -> int:
+    """
+    Runs a COUNT query at most once per ``count_cache_ttl`` seconds per database.
+
+    Cached counts are also dropped as soon as an event for ``name`` arrives,
+    so a worker's own writes show up at once.
+
+    :param name: topic of the counted entity, e.g. ``"user"``
+    :param statement: the COUNT query
+    """
+    counts = _count_cache.setdefault(session.get_bind(), {})
+    now = time.monotonic()
+    cached = counts.get(name)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    count = session.scalar(statement)
+    counts[name] = (now + count_cache_ttl, count)
+    return count
+
+def _forget_count(topic: str, key: Optional[str]):
+    for counts in list(_count_cache.values()):
+        counts.pop(topic, None)
+
+events.bus.subscribe("user", _forget_count)
+events.bus.subscribe("chat", _forget_count)
+
+def encode_cursor(*values: Any) -> str:
+    """Encodes the sort key of the last row of a page as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, types: tuple[type, ...]) -> tuple:
+    """
+    Decodes a cursor made by ``encode_cursor``.
+
+    :param types: the expected type of each value of the sort key
+    :raises HTTPException: if the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) == len(types) and all(isinstance(v, t) for v, t in zip(values, types)):
+            return tuple(values)
+    except ValueError:
+        pass
+    raise HTTPException(
+        status_code=422,
+        detail={
+            "type":"invalid_value",
+            "entity_field":"cursor",
+            "entity_value":cursor
+        }
+    )
+
 """ users """
 
-def get_all_users(session: Session) -> list[UserResponseModel]:
+# list endpoints select these columns instead of whole entities, skipping ORM
+# instantiation and the identity map; rows go straight into response models
+USER_COLUMNS = (
+    UserInDB.id,
+    UserInDB.username,
+    UserInDB.email,
+    UserInDB.created_at,
+)
+
+def user_columns(user=UserInDB) -> tuple:
+    """``USER_COLUMNS`` of a user entity or an alias of it, e.g. a chat owner."""
+    return (user.id, user.username, user.email, user.created_at)
+
+def _user_response(row: tuple) -> UserResponseModel:
+    user_id, username, email, created_at = row
+    return UserResponseModel(id=user_id, username=username, email=email, created_at=created_at)
+
+@coalesced
+def get_users_page(
+    session: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> tuple[list[UserResponseModel], Optional[str]]:
     """
-    Retrieve all users from the database.
+    Retrieve one page of users, ordered by id.
 
-    :return: ordered list of Users
+    :param limit: maximum number of users on the page
+    :param cursor: ``next_cursor`` of the previous page
+    :return: the users and the cursor of the next page, if there is one
     """
-    users = session.exec(select(UserInDB)).all()
-    return [
-        UserResponseModel(
-            id=user.id,
-            username=user.username,
-            email=user.email,
-            created_at=user.created_at
-        ) for user in users
-    ]
+    statement = select(*USER_COLUMNS).order_by(UserInDB.id).limit(limit + 1)
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, (int,))
+        statement = statement.where(UserInDB.id > after_id)
+    rows = session.exec(statement).all()
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return [_user_response(row) for row in rows[:limit]], next_cursor
+
+def count_users(session: Session) -> int:
+    return cached_count("user", session, select(func.count(UserInDB.id)))
 
 def get_user_by_id(user_id: str, session: Session) -> UserInDB:
     """
@@ -85,6 +462,26 @@ def get_user_by_id(user_id: str, session: Session) -> UserInDB:
                 }
             )
     
+def get_users_by_ids(user_ids: list[int], session: Session) -> tuple[list[UserResponseModel], list[int]]:
+    """
+    Retrieve a batch of users with a single query.
+
+    :param user_ids: ids of the users to be retrieved
+    :return: the found users in request order, and the ids that do not exist
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    users = _get_user_responses(user_ids, session)
+    return (
+        [users[user_id] for user_id in user_ids if user_id in users],
+        [user_id for user_id in user_ids if user_id not in users],
+    )
+
+def _get_user_responses(user_ids, session: Session) -> dict[int, UserResponseModel]:
+    if not user_ids:
+        return {}
+    statement = select(*USER_COLUMNS).where(UserInDB.id.in_(user_ids))
+    return {row[0]: _user_response(row) for row in session.exec(statement)}
+
 def update_user(user: UserInDB, user_update: UserUpdate, session: Session) -> UserInDB:
     """
     Update an chat in the database for a given ID.
@@ -98,6 +495,8 @@ def update_user(user: UserInDB, user_update: UserUpdate, session: Session) -> Us
         user.username = user_update.username
     if user_update.email:
         user.email = user_update.email
+    events.bus.publish(session, "user", user.id)
+    record_change(session, "user", "update", user.id)
     session.commit()
     session.refresh(user)
     return user
@@ -110,49 +509,84 @@ def get_user_chats(user_id: str, session: Session) -> list[ChatResponseModel]:
     :return a list of chats alongside some metadata
     """
     user = get_user_by_id(user_id, session)
-    user_chats = []
-    all_chats = session.exec(select(ChatInDB)).all()
-    for chat in all_chats:
-        if user in chat.users:
-            user_chats.append(chat)
-    return [
-        ChatResponseModel(
-            id=chat.id,
-            name=chat.name,
-            owner=UserResponseModel(
-                id=chat.owner.id,
-                username=chat.owner.username,
-                email=chat.owner.email,
-                created_at=chat.owner.created_at
-            ),
-            created_at=chat.created_at
-        ) for chat in user_chats
-    ]
+    return get_member_chats(user.id, session)
+
+@coalesced
+def get_member_chats(user_id: int, session: Session) -> list[ChatResponseModel]:
+    """
+    Retrieves the chats a user participates in, with their owners, in one query.
+
+    :param user_id: the id of an existing user
+    :return: the chats of the user
+    """
+    owner = aliased(UserInDB)
+    statement = (
+        select(*chat_columns(owner))
+        .join(UserChatLinkInDB, UserChatLinkInDB.chat_id == ChatInDB.id)
+        .join(owner, owner.id == ChatInDB.owner_id)
+        .where(UserChatLinkInDB.user_id == user_id)
+        .where(ChatInDB.deleted_at == None)
+    )
+    return [_chat_response(row) for row in session.exec(statement)]
 
 """ end users """
 
 """ chats """
 
-def get_all_chats(session: Session) -> list[ChatResponseModel]:
+# chats with more messages than this are purged in the background
+inline_delete_limit = 1000
+delete_batch_size = 500
+
+def chat_columns(owner) -> tuple:
+    """Columns of a chat followed by ``user_columns`` of its owner."""
+    return (ChatInDB.id, ChatInDB.name, ChatInDB.created_at) + user_columns(owner)
+
+def _chat_response(row: tuple) -> ChatResponseModel:
+    chat_id, name, created_at = row[:3]
+    return ChatResponseModel(
+        id=chat_id,
+        name=name,
+        owner=_user_response(row[3:]),
+        created_at=created_at,
+    )
+
+@coalesced
+def get_chats_page(
+    session: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> tuple[list[ChatResponseModel], Optional[str]]:
     """
-    Retrieve all chats from the database.
+    Retrieve one page of chats with their owners, ordered by name.
 
-    :return: ordered list of Chats
+    :param limit: maximum number of chats on the page
+    :param cursor: ``next_cursor`` of the previous page
+    :return: the chats and the cursor of the next page, if there is one
     """
-    chats = session.exec(select(ChatInDB)).all()
-    return [
-        ChatResponseModel(
-            id=chat.id,
-            name=chat.name,
-            owner=UserResponseModel(
-                id=chat.owner.id,
-                username=chat.owner.username,
-                email=chat.owner.email,
-                created_at=chat.owner.created_at
-            ),
-            created_at=chat.created_at
-        ) for chat in chats
-    ]
+    owner = aliased(UserInDB)
+    statement = (
+        select(*chat_columns(owner))
+        .join(owner, owner.id == ChatInDB.owner_id)
+        .where(ChatInDB.deleted_at == None)
+        .order_by(ChatInDB.name, ChatInDB.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        after_name, after_id = decode_cursor(cursor, (str, int))
+        statement = statement.where(
+            or_(ChatInDB.name > after_name, (ChatInDB.name == after_name) & (ChatInDB.id > after_id))
+        )
+    rows = session.exec(statement).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last_id, last_name = rows[limit - 1][:2]
+        next_cursor = encode_cursor(last_name, last_id)
+    return [_chat_response(row) for row in rows[:limit]], next_cursor
+
+def count_chats(session: Session) -> int:
+    return cached_count(
+        "chat", session, select(func.count(ChatInDB.id)).where(ChatInDB.deleted_at == None)
+    )
 
 def get_chat_by_id(chat_id: str, session: Session) -> ChatInDB:
     """
@@ -163,7 +597,7 @@ def get_chat_by_id(chat_id: str, session: Session) -> ChatInDB:
     :raises HTTPException: if no such chat exists
     """
     chat = session.get(ChatInDB, chat_id)
-    if chat:
+    if chat and chat.deleted_at is None:
         return chat
     else:
         raise HTTPException(
@@ -189,75 +623,716 @@ def update_chat(chat_id: str, chat_update: ChatUpdate, session: Session) -> Chat
         # chat.name = chat_update.name
         setattr(chat, "name", chat_update.name)
         # session.add(chat)
+        events.bus.publish(session, "chat", chat.id)
+        record_change(session, "chat", "update", chat.id, chat_id=chat.id)
         session.commit()
         session.refresh(chat)
         return chat
 
-def delete_chat(chat_id: str, session: Session):
+def delete_chat(chat_id: str, session: Session) -> bool:
     """
     Delete an chat from the database.
 
-    :param chat_id: the id of the user to be deleted
-    :return: true if delection is succesful, false otherwise
+    The chat is marked deleted first, which hides it from every read, and a
+    ``purge_chat`` job is queued in the same transaction as the mark. Small
+    chats are then purged right away and the job is dropped; if that purge
+    fails, e.g. on a lock timeout, the job finishes it.
+
+    :param chat_id: the id of the chat to be deleted
+    :return: true if the purge was left to the job runner
+    :raises HTTPException: if no such chat exists
+    """
+    chat = get_chat_by_id(chat_id, session)
+    chat_id = chat.id
+    deferred = count_chat_messages(chat_id, session) > inline_delete_limit
+    chat.deleted_at = datetime.now()
+    events.bus.publish(session, "chat", chat_id)
+    record_chat_deletion(session, chat_id)
+    job = jobs.enqueue(session, "purge_chat", {"chat_id": chat_id})
+    session.commit()
+    if deferred:
+        return True
+    job_id = job.id
+    try:
+        purge_chat(chat_id, session)
+    except (OperationalError, TimeoutError):
+        session.rollback()
+        return True
+    # a worker that claimed the job meanwhile finds nothing left to purge
+    session.execute(delete(JobInDB).where(JobInDB.id == job_id, JobInDB.status == "queued"))
+    session.commit()
+    return False
+
+def purge_chat(
+    chat_id: int,
+    session: Session,
+    batch_size: int = delete_batch_size,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
     """
-    chat = get_user_by_id(session, chat_id)
-    session.delete(chat)
+    Removes a deleted chat together with its messages, mentions and memberships.
+
+    Rows are removed with set-based DELETEs of at most ``batch_size`` rows,
+    each in its own transaction, so a huge chat never holds SQLite's write lock
+    for long.
+
+    :param chat_id: the id of a chat marked deleted
+    :param progress: called with the number of rows removed by every batch
+    :return: the number of message, archive, mention and membership rows removed
+    :raises ValueError: if the chat has not been marked deleted
+    """
+    chat = session.get(ChatInDB, chat_id)
+    if chat is not None and chat.deleted_at is None:
+        raise ValueError(f"chat {chat_id} is not deleted; delete it before purging")
+    progress = progress or (lambda deleted: None)
+    with shards.session_for(chat_id, session) as shard_session:
+        deleted = _delete_in_batches(
+            shard_session, MessageInDB, MessageInDB.id, MessageInDB.chat_id == chat_id, batch_size, progress
+        )
+        deleted += _delete_in_batches(
+            shard_session,
+            MessageArchiveBlockInDB,
+            MessageArchiveBlockInDB.id,
+            MessageArchiveBlockInDB.chat_id == chat_id,
+            batch_size,
+            progress,
+        )
+    deleted += _delete_in_batches(
+        session,
+        MessageAttachmentLinkInDB,
+        MessageAttachmentLinkInDB.message_id,
+        MessageAttachmentLinkInDB.chat_id == chat_id,
+        batch_size,
+        progress,
+    )
+    deleted += _delete_in_batches(
+        session,
+        MentionInDB,
+        MentionInDB.id,
+        MentionInDB.chat_id == chat_id,
+        batch_size,
+        progress,
+    )
+    deleted += _delete_in_batches(
+        session,
+        UserChatLinkInDB,
+        UserChatLinkInDB.user_id,
+        UserChatLinkInDB.chat_id == chat_id,
+        batch_size,
+        progress,
+    )
+    session.execute(delete(ChatActivityInDB).where(ChatActivityInDB.chat_id == chat_id))
+    session.execute(delete(ChatPosterInDB).where(ChatPosterInDB.chat_id == chat_id))
+    session.execute(delete(ChatShardInDB).where(ChatShardInDB.chat_id == chat_id))
+    session.execute(delete(ChatInDB).where(ChatInDB.id == chat_id))
     session.commit()
+    return deleted
+
+def purge_chat_job(session: Session, context: jobs.JobContext, chat_id: int) -> dict[str, int]:
+    """Job handler for ``purge_chat``; reports removed rows as progress."""
+    return {"deleted": purge_chat(chat_id, session, progress=context.advance)}
+
+def _delete_in_batches(session: Session, model, key, condition, batch_size: int, progress) -> int:
+    deleted = 0
+    while True:
+        batch = select(key).where(condition).limit(batch_size)
+        result = session.execute(delete(model).where(condition).where(key.in_(batch)))
+        session.commit()
+        deleted += result.rowcount
+        if result.rowcount:
+            progress(result.rowcount)
+        if result.rowcount < batch_size:
+            return deleted
 
 """ end chats """
 
+""" changes """
+
+def record_change(
+    session: Session,
+    kind: str,
+    op: str,
+    entity_id: int,
+    chat_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+):
+    """
+    Appends an entry to the change feed in the session's current transaction.
+
+    Changes with a ``chat_id`` are visible to the members of that chat and
+    changes with a ``user_id`` to that user; changes with neither are public.
+    SQLite runs one write transaction at a time, so sequence numbers become
+    visible in order and a client never skips a change by resuming after the
+    highest one it has seen.
+
+    :param kind: ``"message"``, ``"chat"``, ``"user"`` or ``"membership"``
+    :param op: ``"create"``, ``"update"`` or ``"delete"``
+    :param entity_id: id of the changed entity; the chat id for memberships
+    """
+    session.add(ChangeInDB(kind=kind, op=op, entity_id=entity_id, chat_id=chat_id, user_id=user_id))
+
+def record_chat_deletion(session: Session, chat_id: int):
+    """
+    Records the deletion of a chat once for every member.
+
+    Memberships are purged together with the chat, so each change carries the
+    member it is addressed to. All rows are written by one INSERT ... SELECT.
+    """
+    session.execute(
+        insert(ChangeInDB).from_select(
+            ["kind", "op", "entity_id", "chat_id", "user_id", "created_at"],
+            select(
+                literal("chat"),
+                literal("delete"),
+                UserChatLinkInDB.chat_id,
+                UserChatLinkInDB.chat_id,
+                UserChatLinkInDB.user_id,
+                literal(datetime.now()),
+            ).where(UserChatLinkInDB.chat_id == chat_id),
+        )
+    )
+
+def get_changes(user_id: int, since: int, limit: int, session: Session) -> list[ChangeModel]:
+    """
+    Retrieves the changes visible to a user, oldest first.
+
+    :param user_id: id of the user syncing
+    :param since: the highest sequence number the user has already seen
+    :param limit: maximum number of changes to return
+    """
+    member_chats = select(UserChatLinkInDB.chat_id).where(UserChatLinkInDB.user_id == user_id)
+    rows = session.exec(
+        select(ChangeInDB.seq, ChangeInDB.kind, ChangeInDB.op, ChangeInDB.entity_id, ChangeInDB.chat_id)
+        .where(ChangeInDB.seq > since)
+        .where(or_(
+            ChangeInDB.chat_id.in_(member_chats),
+            ChangeInDB.user_id == user_id,
+            (ChangeInDB.chat_id == None) & (ChangeInDB.user_id == None),
+        ))
+        .order_by(ChangeInDB.seq)
+        .limit(limit)
+    ).all()
+    return [
+        ChangeModel(seq=seq, kind=kind, op=op, id=entity_id, chat_id=chat_id)
+        for seq, kind, op, entity_id, chat_id in rows
+    ]
+
+""" end changes """
+
+""" mentions """
+
+max_mentions = 20  # per message
+MENTION_PATTERN = re.compile(r"(?<![\w@])@(\w(?:[\w.-]*\w)?)")
+
+def parse_mentions(text: str) -> list[str]:
+    """
+    Finds the ``@username`` mentions in a message text.
+
+    :return: the distinct usernames in order of appearance, at most ``max_mentions``
+    """
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text)))[:max_mentions]
+
+def resolve_mentions(text: str, session: Session) -> list[int]:
+    """
+    Looks up the users mentioned in a message text on the ``users.username`` index.
+
+    :return: the ids of the mentioned users; unknown usernames are skipped
+    """
+    usernames = parse_mentions(text)
+    if not usernames:
+        return []
+    return session.exec(select(UserInDB.id).where(UserInDB.username.in_(usernames))).all()
+
+def _visible_mentions(user_id: int):
+    member_chats = (
+        select(UserChatLinkInDB.chat_id)
+        .join(ChatInDB, ChatInDB.id == UserChatLinkInDB.chat_id)
+        .where(UserChatLinkInDB.user_id == user_id)
+        .where(ChatInDB.deleted_at == None)
+    )
+    return (MentionInDB.user_id == user_id) & MentionInDB.chat_id.in_(member_chats)
+
+@coalesced
+def get_mentions_page(
+    user_id: int,
+    session: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> tuple[list[MentionResponseModel], Optional[str]]:
+    """
+    Retrieve one page of the mentions of a user, newest first.
+
+    Only mentions in chats the user belongs to are listed. The page is a range
+    scan of the ``(user_id, id)`` index; its messages are then read by id from
+    the shards that hold them.
+
+    :param limit: maximum number of mentions on the page
+    :param cursor: ``next_cursor`` of the previous page
+    :return: the mentions and the cursor of the next page, if there is one
+    """
+    statement = (
+        select(MentionInDB.id, MentionInDB.chat_id, MentionInDB.message_id, MentionInDB.created_at)
+        .where(_visible_mentions(user_id))
+        .order_by(MentionInDB.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        (before_id,) = decode_cursor(cursor, (int,))
+        statement = statement.where(MentionInDB.id < before_id)
+    rows = session.exec(statement).all()
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    message_ids = {}
+    for _id, chat_id, message_id, _created_at in rows:
+        message_ids.setdefault(chat_id, set()).add(message_id)
+    message_rows = []
+    for chat_id, ids in message_ids.items():
+        message_rows += _get_message_rows_by_id(chat_id, ids, session)
+    messages = {message.id: message for message in _build_message_responses(message_rows, session)}
+    mentions = [
+        MentionResponseModel(id=mention_id, created_at=created_at, message=messages[message_id])
+        for mention_id, _chat_id, message_id, created_at in rows
+        if message_id in messages
+    ]
+    return mentions, next_cursor
+
+def count_mentions(user_id: int, session: Session) -> int:
+    return session.scalar(select(func.count(MentionInDB.id)).where(_visible_mentions(user_id)))
+
+def _get_message_rows_by_id(chat_id: int, message_ids: set[int], session: Session) -> list[tuple]:
+    with shards.session_for(chat_id, session) as shard_session:
+        rows = shard_session.exec(
+            select(*MESSAGE_COLUMNS).where(MessageInDB.id.in_(message_ids))
+        ).all()
+        missing = message_ids - {row[0] for row in rows}
+        if missing:
+            archived = _get_archived_message_rows(
+                chat_id, shard_session, before=max(missing) + 1, after=min(missing) - 1
+            )
+            rows += [row for row in archived if row[0] in missing]
+    return rows
+
+""" end mentions """
+
+""" rollups """
+
+ROLLUP_PERIODS = ("hour", "day")
+
+def rollup_bucket(created_at: datetime, period: str) -> datetime:
+    """Truncates a timestamp to the start of its hour or day."""
+    if period == "day":
+        return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return created_at.replace(minute=0, second=0, microsecond=0)
+
+def record_activity(session: Session, chat_id: int, user_id: int, created_at: datetime, count: int = 1):
+    """
+    Adds messages to the activity rollups of a chat in the session's current transaction.
+
+    Every period bucket and the author's count are bumped with an upsert on
+    their primary key, so the cost does not depend on the chat's history.
+
+    :param count: number of messages, negative to take them away
+    """
+    for period in ROLLUP_PERIODS:
+        session.execute(
+            upsert(ChatActivityInDB)
+            .values(chat_id=chat_id, period=period, bucket=rollup_bucket(created_at, period), message_count=count)
+            .on_conflict_do_update(
+                index_elements=["chat_id", "period", "bucket"],
+                set_={"message_count": ChatActivityInDB.message_count + count},
+            )
+        )
+    session.execute(
+        upsert(ChatPosterInDB)
+        .values(chat_id=chat_id, user_id=user_id, message_count=count)
+        .on_conflict_do_update(
+            index_elements=["chat_id", "user_id"],
+            set_={"message_count": ChatPosterInDB.message_count + count},
+        )
+    )
+
+""" end rollups """
+
 """ messages """
 
-def get_chat_messages(chat_id: str, session: Session) -> list[MessageInDB]:
+MESSAGE_COLUMNS = (
+    MessageInDB.id,
+    MessageInDB.chat_id,
+    MessageInDB.text,
+    MessageInDB.created_at,
+    MessageInDB.user_id,
+)
+
+@coalesced
+def get_chat_messages(
+    chat_id: str,
+    session: Session,
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+) -> list[MessageResponseModel]:
     """
-    Retrieves a list of messages for a given chat_id
+    Retrieves a list of messages for a given chat_id, oldest first.
+
+    Archived blocks and hot messages are stitched together, so callers cannot
+    tell where the archive boundary lies. Reads on the read-only pool are
+    served from the chat's recent messages buffer when it covers them.
 
     :param chat_id: id of the chat
+    :param limit: only return the newest ``limit`` matching messages
+    :param before: only return messages with an id lower than this one
+    :param after: only return messages with an id higher than this one
     :return: the retrieved message list
     :raises HTTPException: if no such chat exists
     """
     chat = get_chat_by_id(chat_id, session)
-    if chat:
-        return [
-            MessageResponseModel(
-                id=message.id,
-                chat_id=message.chat_id,
-                text=message.text,
-                user=UserResponseModel(
-                    id=message.user.id,
-                    username=message.user.username,
-                    email=message.user.email,
-                    created_at=message.user.created_at
-                ),
-                created_at=message.created_at
-            ) for message in chat.messages
-        ]
-    
-def create_message(chat_id: str, text: str, session: Session, user: UserInDB) -> MessageInDB:
+    if recent_messages.recent_enabled and session.info.get("read_only"):
+        def load(after_id: Optional[int], count: int) -> list[MessageResponseModel]:
+            # a fresh snapshot, so nothing committed before the call is missed
+            with Session(session.get_bind(), info=dict(session.info)) as load_session:
+                return _read_chat_messages(chat.id, load_session, count, None, after_id)
+
+        messages = recent_messages.cache_for(session.get_bind()).read(chat.id, load, limit, before, after)
+        if messages is not None:
+            return messages
+    return _read_chat_messages(chat.id, session, limit, before, after)
+
+def _read_chat_messages(
+    chat_id: int,
+    session: Session,
+    limit: Optional[int],
+    before: Optional[int],
+    after: Optional[int],
+) -> list[MessageResponseModel]:
+    statement = select(*MESSAGE_COLUMNS).where(MessageInDB.chat_id == chat_id)
+    if before is not None:
+        statement = statement.where(MessageInDB.id < before)
+    if after is not None:
+        statement = statement.where(MessageInDB.id > after)
+    with shards.session_for(chat_id, session) as shard_session:
+        if limit is None:
+            rows = list(shard_session.exec(statement.order_by(MessageInDB.id)).all())
+        else:
+            statement = statement.order_by(MessageInDB.id.desc()).limit(limit)
+            rows = list(reversed(shard_session.exec(statement).all()))
+        if limit is None or len(rows) < limit:
+            remaining = None if limit is None else limit - len(rows)
+            rows = _get_archived_message_rows(chat_id, shard_session, remaining, before, after) + rows
+    return _build_message_responses(rows, session)
+
+@coalesced
+def count_chat_messages(chat_id: str, session: Session) -> int:
+    """
+    Counts the messages of a chat, including archived ones.
+
+    :param chat_id: id of the chat
+    :return: the number of messages
+    """
+    with shards.session_for(chat_id, session) as shard_session:
+        hot_count = shard_session.scalar(
+            select(func.count(MessageInDB.id)).where(MessageInDB.chat_id == chat_id)
+        )
+        archived_count = shard_session.scalar(
+            select(func.sum(MessageArchiveBlockInDB.message_count))
+            .where(MessageArchiveBlockInDB.chat_id == chat_id)
+        )
+    return hot_count + (archived_count or 0)
+
+def pack_message_block(rows: list[tuple]) -> bytes:
+    """
+    Compresses message rows into an archive block payload.
+
+    :param rows: tuples shaped like ``MESSAGE_COLUMNS``
+    :return: the compressed payload
+    """
+    return zlib.compress(json.dumps([
+        [message_id, text, created_at.isoformat(), user_id]
+        for message_id, _chat_id, text, created_at, user_id in rows
+    ]).encode())
+
+def unpack_message_block(chat_id: int, payload: bytes) -> list[tuple]:
+    """
+    Decompresses an archive block payload back into message rows.
+
+    :param chat_id: id of the chat the block belongs to
+    :param payload: the compressed payload
+    :return: tuples shaped like ``MESSAGE_COLUMNS``, oldest first
+    """
+    return [
+        (message_id, chat_id, text, datetime.fromisoformat(created_at), user_id)
+        for message_id, text, created_at, user_id in json.loads(zlib.decompress(payload))
+    ]
+
+def _get_archived_message_rows(
+    chat_id: str,
+    session: Session,
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+) -> list[tuple]:
+    statement = (
+        select(MessageArchiveBlockInDB.chat_id, MessageArchiveBlockInDB.payload)
+        .where(MessageArchiveBlockInDB.chat_id == chat_id)
+        .order_by(MessageArchiveBlockInDB.first_message_id.desc())
+    )
+    if before is not None:
+        statement = statement.where(MessageArchiveBlockInDB.first_message_id < before)
+    if after is not None:
+        statement = statement.where(MessageArchiveBlockInDB.last_message_id > after)
+    rows = []
+    for block_chat_id, payload in session.exec(statement):
+        block_rows = unpack_message_block(block_chat_id, payload)
+        if before is not None:
+            block_rows = [row for row in block_rows if row[0] < before]
+        if after is not None:
+            block_rows = [row for row in block_rows if row[0] > after]
+        rows = block_rows + rows
+        if limit is not None and len(rows) >= limit:
+            return rows[-limit:]
+    return rows
+
+# every field is passed on construction, so all messages can share one fields set
+_MESSAGE_FIELDS = set(MessageResponseModel.model_fields)
+
+def _build_message_responses(rows: list[tuple], session: Session) -> list[MessageResponseModel]:
+    """
+    Turns message rows into response models.
+
+    Rows come straight from the database, so the models are built without
+    validation; they share one user model per author and one fields set,
+    which more than halves their memory per message.
+
+    :param rows: tuples shaped like ``MESSAGE_COLUMNS``
+    """
+    users = _get_user_responses({row[4] for row in rows}, session)
+    attachments = get_message_attachments([row[0] for row in rows], session)
+    return [
+        MessageResponseModel.model_construct(
+            _MESSAGE_FIELDS,
+            id=message_id,
+            chat_id=chat_id,
+            text=text,
+            user=users[user_id],
+            created_at=created_at,
+            attachments=attachments.get(message_id, [])
+        ) for message_id, chat_id, text, created_at, user_id in rows
+    ]
+
+def get_message_attachments(message_ids: list[int], session: Session) -> dict[int, list[AttachmentResponseModel]]:
+    """
+    Retrieves the attachments of a batch of messages with a single query.
+
+    :param message_ids: ids of the messages
+    :return: the attachments per message id; messages without any are left out
+    """
+    if not message_ids:
+        return {}
+    statement = (
+        select(
+            MessageAttachmentLinkInDB.message_id,
+            AttachmentInDB.id,
+            MessageAttachmentLinkInDB.filename,
+            AttachmentInDB.content_type,
+            AttachmentInDB.size,
+        )
+        .join(AttachmentInDB, AttachmentInDB.id == MessageAttachmentLinkInDB.attachment_id)
+        .where(MessageAttachmentLinkInDB.message_id.in_(message_ids))
+    )
+    attachments = {}
+    for message_id, attachment_id, filename, content_type, size in session.exec(statement):
+        attachments.setdefault(message_id, []).append(AttachmentResponseModel(
+            id=attachment_id,
+            filename=filename,
+            content_type=content_type,
+            size=size
+        ))
+    return attachments
+
+def create_message(
+    chat_id: str,
+    text: str,
+    session: Session,
+    user: UserInDB,
+    attachments: list[AttachmentReference] = [],
+) -> MessageInDB:
+    """
+    Writes a new message to a chat, on the shard that holds the chat.
+
+    For chats on shard 0 the message and its rows in the primary database
+    commit together. On any other shard only that shard is written: the
+    primary's rows go into the shard's outbox in the message's transaction
+    and ``backend.outbox`` relays them shortly after.
+
+    :param chat_id: id of the chat
+    :param text: text of the message
+    :param user: author of the message
+    :param attachments: previously uploaded attachments to link to the message
+    :return: the created message
+    :raises HTTPException: if no such chat or attachment exists
+    """
     chat = get_chat_by_id(chat_id, session)
-    if chat:
+    chat_id, user_id = chat.id, user.id
+    linked = get_attachment_responses(attachments, session)
+    mentioned = [mentioned_id for mentioned_id in resolve_mentions(text, session) if mentioned_id != user_id]
+    shard = shards.shard_of(chat_id, session)
+    cache = recent_messages.cache_for(shards.read_bind(session))
+    buffered = chat_id in cache
+    if shard != 0:
+        release(session)
+    with shards.session_for(chat_id, session) as shard_session:
         message = MessageInDB(
+            id=shards.allocate_message_id(shard, shard_session),
             text=text,
-            user_id=user.id,
+            user_id=user_id,
             chat_id=chat_id,
-            user=user,
-            chat=chat
             )
-        session.add(message)
-        chat.messages.append(message)
-        session.commit()
-        session.refresh(message)
-        return message
-    else:
+        shard_session.add(message)
+        shard_session.flush()
+        # the insert holds the write lock, so no other message can commit in between
+        previous_id = shard_session.scalar(
+            select(func.max(MessageInDB.id))
+            .where(MessageInDB.chat_id == chat_id)
+            .where(MessageInDB.id < message.id)
+        ) if buffered else None
+        attachment_links = [(attachment.id, attachment.filename) for attachment in linked]
+        if shard_session is session:
+            record_message(session, message.id, chat_id, user_id, message.created_at, attachment_links, mentioned)
+            events.bus.publish(session, "message", chat_id)
+        else:
+            shard_session.add(MessageOutboxInDB(
+                message_id=message.id,
+                chat_id=chat_id,
+                user_id=user_id,
+                created_at=message.created_at,
+                origin=events.bus.origin,
+                payload=json.dumps({"attachments": attachment_links, "mentions": mentioned}),
+            ))
+        shard_session.commit()
+        shard_session.refresh(message)
+    if shard != 0:
+        events.bus.dispatch("message", str(chat_id))
+    if buffered:
+        cache.append(chat_id, MessageResponseModel.model_construct(
+            _MESSAGE_FIELDS,
+            id=message.id,
+            chat_id=chat_id,
+            text=message.text,
+            user=_get_user_responses({user_id}, session)[user_id],
+            created_at=message.created_at,
+            attachments=linked,
+        ), previous_id)
+    return message
+
+def get_attachment_responses(
+    attachments: list[AttachmentReference],
+    session: Session,
+) -> list[AttachmentResponseModel]:
+    """
+    Looks up previously uploaded attachments under the filenames a message
+    links them with; an attachment given twice is linked once.
+
+    :raises HTTPException: if no such attachment exists
+    """
+    linked = {attachment.id: attachment for attachment in attachments}
+    if not linked:
+        return []
+    found = {
+        attachment_id: (content_type, size)
+        for attachment_id, content_type, size in session.exec(
+            select(AttachmentInDB.id, AttachmentInDB.content_type, AttachmentInDB.size)
+            .where(AttachmentInDB.id.in_(linked))
+        )
+    }
+    for attachment_id in linked.keys() - found.keys():
         raise HTTPException(
             status_code=404,
             detail={
                 "type":"entity_not_found",
-                "entity_name":"Chat",
-                "entity_id":chat_id
+                "entity_name":"Attachment",
+                "entity_id":attachment_id
             }
         )
+    return [
+        AttachmentResponseModel(
+            id=attachment.id,
+            filename=attachment.filename,
+            content_type=found[attachment.id][0],
+            size=found[attachment.id][1],
+        ) for attachment in linked.values()
+    ]
+
+def record_message(
+    session: Session,
+    message_id: int,
+    chat_id: int,
+    user_id: int,
+    created_at: datetime,
+    attachments: list[tuple[str, str]],
+    mentions: list[int],
+):
+    """
+    Adds the rows a new message keeps in the primary database to the
+    session's current transaction: attachment links, mentions, activity
+    rollups and the change feed entry.
+
+    :param attachments: ``(attachment_id, filename)`` pairs to link
+    :param mentions: ids of the mentioned users
+    """
+    session.add_all([
+        MessageAttachmentLinkInDB(
+            message_id=message_id,
+            attachment_id=attachment_id,
+            chat_id=chat_id,
+            filename=filename,
+        ) for attachment_id, filename in attachments
+    ])
+    session.add_all([
+        MentionInDB(user_id=mentioned_id, message_id=message_id, chat_id=chat_id, created_at=created_at)
+        for mentioned_id in mentions
+    ])
+    record_activity(session, chat_id, user_id, created_at)
+    record_change(session, "message", "create", message_id, chat_id=chat_id)
+
+def export_chat_messages(chat_id: str, session: Session, chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Streams every message of a chat as newline-delimited JSON.
+
+    Archived blocks are decompressed one at a time, then hot rows are pulled
+    from a single cursor ``chunk_size`` at a time. Each chunk is yielded as soon
+    as it has been serialized, so memory use does not grow with the size of the
+    chat. The export runs on its own sessions because the request session is
+    closed before a streaming response is sent.
+
+    :param chat_id: id of the chat
+    :param chunk_size: number of rows fetched from the cursor per step
+    :return: an iterator of NDJSON encoded chunks
+    """
+    statement = (
+        select(*MESSAGE_COLUMNS)
+        .where(MessageInDB.chat_id == chat_id)
+        .order_by(MessageInDB.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    blocks = (
+        select(MessageArchiveBlockInDB.chat_id, MessageArchiveBlockInDB.payload)
+        .where(MessageArchiveBlockInDB.chat_id == chat_id)
+        .order_by(MessageArchiveBlockInDB.first_message_id)
+        .execution_options(yield_per=1)
+    )
+    shard = shards.shard_of(chat_id, session)
+    with Session(session.get_bind()) as user_session, \
+            Session(shards.bind_for(shard, session)) as export_session:
+        for block_chat_id, payload in export_session.exec(blocks):
+            rows = unpack_message_block(block_chat_id, payload)
+            yield _encode_ndjson(_build_message_responses(rows, user_session))
+        for rows in export_session.exec(statement).partitions():
+            yield _encode_ndjson(_build_message_responses(rows, user_session))
 
+def _encode_ndjson(messages: list[MessageResponseModel]) -> bytes:
+    return b"".join(message.model_dump_json().encode() + b"\n" for message in messages)
+
+@coalesced
 def get_chat_users(chat_id: str, session: Session) -> list[UserResponseModel]:
     """
     Retrieves a list of users for a given chat_id
@@ -266,16 +1341,12 @@ def get_chat_users(chat_id: str, session: Session) -> list[UserResponseModel]:
     :return: the retrieved user list
     :raises HTTPException: if no such chat exists
     """
-    chat = get_chat_by_id(chat_id, session)
-    if chat:
-        users = chat.users
-        return [
-            UserResponseModel(
-                id=user.id,
-                username=user.username,
-                email=user.email,
-                created_at=user.created_at
-            ) for user in users
-        ]
+    get_chat_by_id(chat_id, session)
+    statement = (
+        select(*USER_COLUMNS)
+        .join(UserChatLinkInDB, UserChatLinkInDB.user_id == UserInDB.id)
+        .where(UserChatLinkInDB.chat_id == chat_id)
+    )
+    return [_user_response(row) for row in session.exec(statement)]
 
 """ end chats """
\ No newline at end of file
@@ -1,17 +1,39 @@
 import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
 
-from sqlalchemy import func
+from sqlalchemy import Engine, func
 from sqlmodel import Session, create_engine, select
 
 from backend.schema import *
-from backend.database import engine
+from backend.database import engine, record_change
+from backend.migrations import migrate
 
 SQLModel.metadata.create_all(engine)
 
-local_engine = create_engine(
-    "sqlite:///backend/initial.db",
-    connect_args={"check_same_thread": False},
-)
+initial_db = "backend/initial.db"
+
+
+@contextmanager
+def initial_database() -> Iterator[Engine]:
+    """
+    Opens a migrated copy of ``initial.db``.
+
+    The file predates columns the models read, e.g. ``users.username_lower``,
+    so it is brought up to date in a temporary directory rather than in place.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "initial.db")
+        shutil.copyfile(initial_db, path)
+        local_engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        try:
+            migrate(local_engine, SQLModel.metadata.create_all)
+            yield local_engine
+        finally:
+            local_engine.dispose()
 
 
 def upsert_all(session, cls, local_models) -> int:
@@ -37,6 +59,8 @@ def upsert_links(session, local_models) -> int:
     for local_model in local_models:
         if link_lookup.get((local_model.user_id, local_model.chat_id)) is None:
             session.add(UserChatLinkInDB(**local_model.model_dump()))
+            record_change(session, "membership", "create", local_model.chat_id,
+                          chat_id=local_model.chat_id, user_id=local_model.user_id)
             count += 1
     session.commit()
     return count
@@ -48,7 +72,7 @@ def get_count(session, model):
     return session.scalar(select(func.count(model.id)))
 
 
-def add_users() -> dict[str, int]:
+def add_users(local_engine: Engine) -> dict[str, int]:
     with Session(local_engine) as local_session:
         users = local_session.exec(select(UserInDB)).all()
         local_count = len(users)
@@ -66,7 +90,7 @@ def add_users() -> dict[str, int]:
     }
 
 
-def add_chats() -> dict[str, int]:
+def add_chats(local_engine: Engine) -> dict[str, int]:
     with Session(local_engine) as local_session:
         chats = local_session.exec(select(ChatInDB)).all()
         local_count = len(chats)
@@ -84,7 +108,7 @@ def add_chats() -> dict[str, int]:
     }
 
 
-def add_messages() -> dict[str, int]:
+def add_messages(local_engine: Engine) -> dict[str, int]:
     with Session(local_engine) as local_session:
         messages = local_session.exec(select(MessageInDB)).all()
         local_count = len(messages)
@@ -102,7 +126,7 @@ def add_messages() -> dict[str, int]:
     }
 
 
-def add_user_chat_links() -> dict[str, int]:
+def add_user_chat_links(local_engine: Engine) -> dict[str, int]:
     with Session(local_engine) as local_session:
         links = local_session.exec(select(UserChatLinkInDB)).all()
         local_count = len(links)
@@ -121,10 +145,11 @@ def add_user_chat_links() -> dict[str, int]:
 
 
 def seed_database():
-    user_count = add_users()
-    chat_count = add_chats()
-    message_count = add_messages()
-    link_count = add_user_chat_links()
+    with initial_database() as local_engine:
+        user_count = add_users(local_engine)
+        chat_count = add_chats(local_engine)
+        message_count = add_messages(local_engine)
+        link_count = add_user_chat_links(local_engine)
 
     return {
         "user_count": user_count,
@@ -134,6 +159,21 @@ def seed_database():
     }
 
 
+def seed_database_job(session, context) -> dict[str, dict[str, int]]:
+    """Job handler for ``seed_database``; every seeded table counts as one step."""
+    result = {}
+    with initial_database() as local_engine:
+        for key, add in [
+            ("user_count", add_users),
+            ("chat_count", add_chats),
+            ("message_count", add_messages),
+            ("link_count", add_user_chat_links),
+        ]:
+            result[key] = add(local_engine)
+            context.advance(1, 4)
+    return result
+
+
 def lambda_handler(event, context):
     try:
         result = seed_database()
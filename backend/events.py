@@ -0,0 +1,142 @@
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import Engine, delete, event, func
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from backend.schema import EventInDB
+
+Listener = Callable[[str, Optional[str]], None]
+
+poll_interval = float(os.environ.get("EVENTS_POLL_INTERVAL", default=0.05))  # seconds
+event_retention = timedelta(minutes=10)
+prune_interval = 60.0  # seconds
+
+
+class EventBus:
+    """
+    Cross-process invalidation channel backed by the primary SQLite database.
+
+    Writers add an ``events`` row in the same transaction as their change.
+    Listeners in the writing process are called as soon as it commits. Every
+    other worker runs a poller that watches ``PRAGMA data_version`` on a
+    dedicated connection and only reads new events once another connection
+    has committed, so idle polling never touches a table. Workers therefore
+    see each other's writes within ``poll_interval`` seconds.
+    """
+
+    def __init__(self, origin: Optional[str] = None):
+        self.origin = origin or f"{socket.gethostname()}:{os.getpid()}"
+        self.generation = 0
+        self._listeners: dict[str, list[Listener]] = defaultdict(list)
+        self._last_id = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, topic: str, listener: Listener):
+        """
+        Registers a listener for a topic.
+
+        Listeners must be cheap and idempotent; they run on the committing
+        thread or on the poller thread.
+        """
+        self._listeners[topic].append(listener)
+
+    def publish(self, session: Session, topic: str, key: Optional[str] = None, origin: Optional[str] = None):
+        """
+        Records an event in the session's current transaction.
+
+        :param topic: kind of entity that changed, e.g. ``"chat"``
+        :param key: id of the entity that changed
+        :param origin: worker that made the change and has dispatched it
+            already, for events recorded on its behalf; defaults to this one
+        """
+        key = None if key is None else str(key)
+        session.add(EventInDB(topic=topic, key=key, origin=origin or self.origin))
+        if origin is None:
+            session.info.setdefault("pending_events", []).append((self, topic, key))
+
+    def dispatch(self, topic: str, key: Optional[str]):
+        self.generation += 1
+        for listener in self._listeners.get(topic, []):
+            listener(topic, key)
+
+    def start(self, engine: Engine, read_engine: Optional[Engine] = None):
+        """
+        Starts polling the database for events published by other processes.
+
+        :param read_engine: engine to poll with, so the poller holds a reader
+            instead of the writer; old events are pruned through ``engine``
+        """
+        if self._thread is not None:
+            return
+        with Session(engine) as session:
+            self._last_id = session.scalar(select(func.max(EventInDB.id))) or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, args=(engine, read_engine or engine), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def poll_once(self, session: Session):
+        """Dispatches events published by other processes since the last poll."""
+        events = session.exec(
+            select(EventInDB.id, EventInDB.topic, EventInDB.key, EventInDB.origin)
+            .where(EventInDB.id > self._last_id)
+            .order_by(EventInDB.id)
+        ).all()
+        for event_id, topic, key, origin in events:
+            self._last_id = event_id
+            if origin != self.origin:
+                self.dispatch(topic, key)
+
+    def _poll(self, engine: Engine, read_engine: Engine):
+        last_pruned = time.monotonic()
+        with read_engine.connect() as connection:
+            data_version = None
+            while not self._stop.wait(poll_interval):
+                current = connection.exec_driver_sql("PRAGMA data_version").scalar()
+                if current == data_version:
+                    continue
+                try:
+                    with Session(read_engine) as session:
+                        self.poll_once(session)
+                    if time.monotonic() - last_pruned > prune_interval:
+                        with Session(engine) as session:
+                            _prune(session)
+                        last_pruned = time.monotonic()
+                except OperationalError:
+                    continue  # locked; retry on the next tick
+                data_version = current
+
+
+def _prune(session: Session):
+    session.execute(
+        delete(EventInDB).where(EventInDB.created_at < datetime.now() - event_retention)
+    )
+    session.commit()
+
+
+bus = EventBus()
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed_events(session: Session):
+    for event_bus, topic, key in session.info.pop("pending_events", []):
+        event_bus.dispatch(topic, key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_events(session: Session):
+    session.info.pop("pending_events", None)
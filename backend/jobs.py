@@ -0,0 +1,354 @@
+import argparse
+import importlib
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Engine, func, update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from backend.schema import JobInDB, JobResponseModel
+
+poll_interval = float(os.environ.get("JOBS_POLL_INTERVAL", default=1.0))  # seconds
+throttle = float(os.environ.get("JOBS_THROTTLE", default=0.05))  # seconds slept after every step
+retry_delay = 5.0  # seconds before the first retry; doubles with every attempt
+job_lease = timedelta(minutes=10)
+
+# job kind -> "module:function"; handlers are imported when first run
+HANDLERS = {
+    "purge_chat": "backend.database:purge_chat_job",
+    "archive_messages": "backend.archive:archive_messages_job",
+    "spread_chats": "backend.rebalance:spread_chats_job",
+    "seed_database": "backend.db_seeder:seed_database_job",
+    "prune_refresh_tokens": "backend.auth:prune_refresh_tokens_job",
+    "backup_database": "backend.backup:backup_database_job",
+    "purge_expired_messages": "backend.retention:purge_expired_messages_job",
+    "backfill_rollups": "backend.rollups:backfill_rollups_job",
+}
+
+FINISHED = {"succeeded", "failed", "cancelled"}
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once its cancellation has been requested."""
+
+
+class JobContext:
+    """
+    Handle passed to a running job for reporting progress.
+
+    Every call to ``advance`` records progress, renews the job's lease and
+    checks for cancellation, then sleeps for ``throttle`` seconds so a long
+    job leaves the write lock to request handlers between its steps.
+
+    Progress is written through the job's own session when there is one, and
+    committed with it, since a process has a single writer connection; call
+    ``advance`` between units of work, not in the middle of one.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        job_id: int,
+        throttle: float = throttle,
+        session: Optional[Session] = None,
+    ):
+        self.engine = engine
+        self.job_id = job_id
+        self.throttle = throttle
+        self.session = session
+        self.progress = 0
+        self.total: Optional[int] = None
+
+    def cancel_requested(self) -> bool:
+        with Session(self.engine) as session:
+            return session.scalar(
+                select(JobInDB.cancel_requested).where(JobInDB.id == self.job_id)
+            )
+
+    def advance(self, done: int = 1, total: Optional[int] = None):
+        """
+        Records finished work.
+
+        :param done: units of work finished since the last call
+        :param total: total units of work, if known
+        :raises JobCancelled: if the job should stop
+        """
+        self.progress += done
+        if total is not None:
+            self.total = total
+        if self.session is not None:
+            cancelled = self._record(self.session)
+        else:
+            with Session(self.engine) as session:
+                cancelled = self._record(session)
+        if cancelled:
+            raise JobCancelled()
+        time.sleep(self.throttle)
+
+    def _record(self, session: Session) -> bool:
+        session.execute(
+            update(JobInDB)
+            .where(JobInDB.id == self.job_id)
+            .values(progress=self.progress, total=self.total, heartbeat_at=datetime.now())
+        )
+        cancelled = session.scalar(select(JobInDB.cancel_requested).where(JobInDB.id == self.job_id))
+        session.commit()
+        return cancelled
+
+
+def enqueue(
+    session: Session,
+    kind: str,
+    payload: Optional[dict[str, Any]] = None,
+    max_attempts: int = 3,
+) -> JobInDB:
+    """
+    Adds a job to the session's current transaction.
+
+    The job only becomes visible to workers once the caller commits, so it is
+    never run for a change that was rolled back.
+
+    :param kind: one of ``HANDLERS``
+    :param payload: keyword arguments for the handler
+    :raises ValueError: for an unknown kind
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    job = JobInDB(kind=kind, payload=json.dumps(payload or {}), max_attempts=max(1, max_attempts))
+    session.add(job)
+    return job
+
+
+def get_job(session: Session, job_id: int) -> Optional[JobInDB]:
+    return session.get(JobInDB, job_id)
+
+
+def list_jobs(session: Session, status: Optional[str] = None, limit: int = 100) -> tuple[int, list[JobInDB]]:
+    """
+    Lists the most recent jobs.
+
+    :return: the number of matching jobs and the newest ``limit`` of them
+    """
+    query = select(JobInDB)
+    count_query = select(func.count(JobInDB.id))
+    if status is not None:
+        query = query.where(JobInDB.status == status)
+        count_query = count_query.where(JobInDB.status == status)
+    jobs = session.exec(query.order_by(JobInDB.id.desc()).limit(limit)).all()
+    return session.scalar(count_query), jobs
+
+
+def cancel(session: Session, job_id: int) -> Optional[JobInDB]:
+    """
+    Cancels a job.
+
+    Queued jobs are cancelled at once; running jobs stop at their next call
+    to ``JobContext.advance``. Finished jobs are left as they are.
+    """
+    job = session.get(JobInDB, job_id)
+    if job is None or job.status in FINISHED:
+        return job
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = datetime.now()
+    else:
+        job.cancel_requested = True
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def to_response(job: JobInDB) -> JobResponseModel:
+    return JobResponseModel(
+        **job.model_dump(exclude={"payload", "result"}),
+        payload=json.loads(job.payload),
+        result=None if job.result is None else json.loads(job.result),
+    )
+
+
+def resolve(kind: str) -> Callable[..., Any]:
+    module_name, function_name = HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class JobRunner:
+    """
+    Worker loop that runs queued jobs one at a time.
+
+    Every worker process runs one, next to the FastAPI lifespan. Jobs are
+    claimed with a conditional UPDATE, so each job runs in exactly one
+    process; a job whose worker died is requeued once its lease runs out.
+    Failed jobs are retried with exponential backoff up to their
+    ``max_attempts``.
+    """
+
+    def __init__(self, origin: Optional[str] = None, poll_interval: float = poll_interval):
+        self.origin = origin or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, engine: Engine):
+        """Starts running jobs in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, args=(engine,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the worker thread after its current job step."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def run_once(self, engine: Engine) -> Optional[int]:
+        """
+        Claims and runs the next due job.
+
+        :return: the id of the job that ran, or None if none was due
+        """
+        with Session(engine) as session:
+            job_id = self._claim(session)
+        if job_id is not None:
+            self._execute(engine, job_id)
+        return job_id
+
+    def _claim(self, session: Session) -> Optional[int]:
+        now = datetime.now()
+        expired = (JobInDB.status == "running") & (JobInDB.heartbeat_at < now - job_lease)
+        if session.scalar(select(JobInDB.id).where(expired).limit(1)) is not None:
+            session.execute(update(JobInDB).where(expired).values(status="queued", worker=None))
+        job_id = session.scalar(
+            select(JobInDB.id)
+            .where(JobInDB.status == "queued")
+            .where(JobInDB.run_after <= now)
+            .order_by(JobInDB.run_after, JobInDB.id)
+            .limit(1)
+        )
+        if job_id is None:
+            session.commit()
+            return None
+        claimed = session.execute(
+            update(JobInDB)
+            .where(JobInDB.id == job_id)
+            .where(JobInDB.status == "queued")
+            .values(
+                status="running",
+                worker=self.origin,
+                attempts=JobInDB.attempts + 1,
+                heartbeat_at=now,
+            )
+        ).rowcount
+        session.commit()
+        return job_id if claimed else None
+
+    def _execute(self, engine: Engine, job_id: int):
+        with Session(engine) as session:
+            job = session.get(JobInDB, job_id)
+            kind, payload = job.kind, json.loads(job.payload)
+            attempts, max_attempts = job.attempts, job.max_attempts
+
+        context = JobContext(engine, job_id, throttle)
+        values: dict[str, Any] = {"finished_at": datetime.now()}
+        try:
+            with Session(engine) as work_session:
+                context.session = work_session
+                result = resolve(kind)(work_session, context, **payload)
+        except JobCancelled:
+            values.update(status="cancelled")
+        except Exception as e:
+            values.update(error=repr(e))
+            if context.cancel_requested():
+                values.update(status="cancelled")
+            elif attempts < max_attempts:
+                delay = retry_delay * 2 ** (attempts - 1)
+                values.update(
+                    status="queued",
+                    worker=None,
+                    finished_at=None,
+                    run_after=datetime.now() + timedelta(seconds=delay),
+                )
+            else:
+                values.update(status="failed")
+        else:
+            values.update(status="succeeded", error=None, result=json.dumps(result, default=str))
+
+        with Session(engine) as session:
+            session.execute(update(JobInDB).where(JobInDB.id == job_id).values(**values))
+            session.commit()
+
+    def _poll(self, engine: Engine):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                while not self._stop.is_set() and self.run_once(engine) is not None:
+                    pass
+            except OperationalError:
+                continue  # locked; retry on the next tick
+
+
+runner = JobRunner()
+
+
+def lambda_handler(event, context):
+    from backend.database import engine
+
+    try:
+        ran = []
+        while (job_id := runner.run_once(engine)) is not None:
+            ran.append(job_id)
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"jobs": ran}),
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)}),
+        }
+
+
+if __name__ == "__main__":
+    from backend.database import engine
+
+    parser = argparse.ArgumentParser(description="Enqueue, inspect and run background jobs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = commands.add_parser("enqueue", help="queue a job")
+    enqueue_parser.add_argument("kind", choices=sorted(HANDLERS))
+    enqueue_parser.add_argument("--payload", type=json.loads, default={})
+    list_parser = commands.add_parser("list", help="list recent jobs")
+    list_parser.add_argument("--status")
+    cancel_parser = commands.add_parser("cancel", help="cancel a job")
+    cancel_parser.add_argument("job_id", type=int)
+    commands.add_parser("work", help="run queued jobs until interrupted")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        runner.start(engine)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            runner.stop()
+    else:
+        with Session(engine) as session:
+            if args.command == "enqueue":
+                job = enqueue(session, args.kind, args.payload)
+                session.commit()
+                session.refresh(job)
+                result = to_response(job).model_dump(mode="json")
+            elif args.command == "list":
+                _, jobs = list_jobs(session, args.status)
+                result = [to_response(job).model_dump(mode="json") for job in jobs]
+            else:
+                job = cancel(session, args.job_id)
+                result = None if job is None else to_response(job).model_dump(mode="json")
+        print(json.dumps(result))
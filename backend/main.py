@@ -3,17 +3,31 @@ from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
+from backend.admission import AdmissionMiddleware
+from backend.routers.admin import admin_router
+from backend.routers.attachments import attachments_router
 from backend.routers.chats import chats_router
+from backend.routers.sync import sync_router
 from backend.routers.users import users_router
 from backend.auth import auth_router
-from backend.database import EntityNotFoundException, create_db_and_tables
+from backend import contention, events, jobs, outbox, provisioning
+from backend.database import EntityNotFoundException, create_db_and_tables, engine, read_engine
 
 from mangum import Mangum
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    events.bus.start(engine, read_engine)
+    jobs.runner.start(engine)
+    outbox.relay.start()
     yield
+    outbox.relay.stop()
+    jobs.runner.stop()
+    events.bus.stop()
+    provisioning.shutdown_pool()
+    if contention.contention_enabled and contention.contention_log:
+        contention.monitor.dump(contention.contention_log)
 
 app = FastAPI(
     title="Pony Express",
@@ -22,6 +36,8 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://127.0.0.1:8000",
@@ -34,6 +50,9 @@ app.add_middleware(
 app.include_router(chats_router)
 app.include_router(users_router)
 app.include_router(auth_router)
+app.include_router(admin_router)
+app.include_router(attachments_router)
+app.include_router(sync_router)
 
 @app.exception_handler(EntityNotFoundException)
 def handle_entity_not_found(
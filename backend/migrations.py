@@ -0,0 +1,233 @@
+import argparse
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional, Union
+
+from sqlalchemy import Connection, Engine
+
+Step = Union[str, Callable[[Connection], None]]
+
+
+class Migration(NamedTuple):
+    """A versioned schema change, applied one step per transaction."""
+    version: int
+    name: str
+    table: str
+    steps: list[Step]
+
+
+def add_column(table: str, column: str, definition: str) -> Step:
+    """
+    Builds a step that adds a column unless it already exists.
+
+    SQLite has no ``ADD COLUMN IF NOT EXISTS``, and databases created by
+    ``create_all`` already carry every column of the current models.
+    """
+    def step(connection: Connection):
+        columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def lowercase_usernames(connection: Connection):
+    """Fills ``users.username_lower`` the way the model does; SQLite's lower() only folds ASCII."""
+    rows = connection.exec_driver_sql(
+        "SELECT id, username FROM users WHERE username_lower IS NULL"
+    ).all()
+    for user_id, username in rows:
+        connection.exec_driver_sql(
+            "UPDATE users SET username_lower = ? WHERE id = ?", (username.lower(), user_id)
+        )
+
+
+def queue_rollup_backfill(connection: Connection):
+    """Queues a ``backfill_rollups`` job, so chats from before the rollups get their statistics."""
+    if connection.exec_driver_sql("SELECT 1 FROM chats LIMIT 1").first() is None:
+        return
+    now = datetime.now().isoformat(" ")
+    connection.exec_driver_sql(
+        "INSERT INTO jobs (kind, payload, status, attempts, max_attempts, progress, cancel_requested, "
+        "created_at, run_after) VALUES ('backfill_rollups', '{}', 'queued', 0, 3, 0, 0, ?, ?)",
+        (now, now),
+    )
+
+
+def autoincrement_events(connection: Connection):
+    """
+    Rebuilds ``events`` with ``AUTOINCREMENT``.
+
+    Without it SQLite hands out the ids of pruned events again once the table
+    is empty, and pollers that already saw those ids skip the new events.
+    """
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'events'"
+    ).scalar()
+    if "AUTOINCREMENT" in sql.upper():
+        return
+    connection.exec_driver_sql(
+        "CREATE TABLE events_autoincrement ("
+        "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+        "topic VARCHAR NOT NULL, "
+        "\"key\" VARCHAR, "
+        "origin VARCHAR NOT NULL, "
+        "created_at DATETIME)"
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO events_autoincrement (id, topic, \"key\", origin, created_at) "
+        "SELECT id, topic, \"key\", origin, created_at FROM events"
+    )
+    connection.exec_driver_sql("DROP TABLE events")
+    connection.exec_driver_sql("ALTER TABLE events_autoincrement RENAME TO events")
+    connection.exec_driver_sql("CREATE INDEX ix_events_created_at ON events (created_at)")
+
+
+MIGRATIONS = [
+    Migration(1, "index messages by chat and creation time", "messages", [
+        "CREATE INDEX IF NOT EXISTS ix_messages_chat_id_created_at ON messages (chat_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_chat_id_id ON messages (chat_id, id)",
+    ]),
+    Migration(2, "index messages by author", "messages", [
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_id ON messages (user_id)",
+    ]),
+    Migration(3, "index memberships by chat", "user_chat_links", [
+        "CREATE INDEX IF NOT EXISTS ix_user_chat_links_chat_id ON user_chat_links (chat_id)",
+    ]),
+    Migration(4, "soft-delete chats", "chats", [
+        add_column("chats", "deleted_at", "DATETIME"),
+    ]),
+    Migration(5, "index chats by name", "chats", [
+        "CREATE INDEX IF NOT EXISTS ix_chats_name_id ON chats (name, id)",
+    ]),
+    Migration(6, "index lowercase usernames", "users", [
+        add_column("users", "username_lower", "VARCHAR"),
+        lowercase_usernames,
+        "CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (username_lower)",
+    ]),
+    Migration(7, "per-chat message retention", "chats", [
+        add_column("chats", "retention_days", "INTEGER"),
+    ]),
+    Migration(8, "backfill chat statistics", "chat_activity", [
+        queue_rollup_backfill,
+    ]),
+    Migration(9, "never reuse event ids", "events", [
+        autoincrement_events,
+    ]),
+]
+
+busy_timeout = 30000  # milliseconds
+
+
+def migrate(engine: Engine, create: Optional[Callable[[Connection], None]] = None) -> list[int]:
+    """
+    Applies every pending migration to a database.
+
+    Each step runs and is recorded in its own transaction, so an interrupted
+    run resumes at the first unrecorded step. Every transaction takes SQLite's
+    write lock up front with ``BEGIN IMMEDIATE`` and re-reads the progress of
+    its migration under it, so when several workers start at once each step
+    is applied by exactly one of them and the others find it recorded. Index
+    builds hold the lock only for their own step; WAL readers keep going
+    meanwhile. Migrations whose table does not exist in this database (e.g.
+    memberships on a message shard) are skipped.
+
+    :param create: creates missing tables on the connection; it runs first,
+        under the same lock
+    :return: the versions applied by this call
+    """
+    applied = []
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f"PRAGMA busy_timeout = {busy_timeout}")
+        with _write_lock(connection):
+            if create is not None:
+                create(connection)
+            connection.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, "
+                "name VARCHAR NOT NULL, "
+                "steps_done INTEGER NOT NULL DEFAULT 0, "
+                "applied_at DATETIME)"
+            )
+        tables = {
+            row[0] for row in connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        connection.commit()
+
+        for migration in MIGRATIONS:
+            if migration.table not in tables:
+                continue
+            while True:
+                with _write_lock(connection):
+                    steps_done, applied_at = _progress(connection, migration)
+                    if applied_at is not None:
+                        break
+                    if steps_done < len(migration.steps):
+                        _run_step(connection, migration.steps[steps_done])
+                        _record(connection, migration, steps_done + 1, None)
+                        continue
+                    _record(connection, migration, steps_done, datetime.now().isoformat(" "))
+                    applied.append(migration.version)
+                    break
+    return applied
+
+
+def migration_status(engine: Engine) -> list[dict]:
+    """Lists the recorded migrations of a database."""
+    with engine.connect() as connection:
+        return [
+            {"version": version, "name": name, "steps_done": steps_done, "applied_at": applied_at}
+            for version, name, steps_done, applied_at in connection.exec_driver_sql(
+                "SELECT version, name, steps_done, applied_at FROM schema_migrations ORDER BY version"
+            )
+        ]
+
+
+@contextmanager
+def _write_lock(connection: Connection):
+    """Runs a block in one transaction that holds SQLite's write lock from its start."""
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+def _progress(connection: Connection, migration: Migration) -> tuple[int, Optional[str]]:
+    row = connection.exec_driver_sql(
+        "SELECT steps_done, applied_at FROM schema_migrations WHERE version = ?", (migration.version,)
+    ).first()
+    return tuple(row) if row else (0, None)
+
+
+def _run_step(connection: Connection, step: Step):
+    if callable(step):
+        step(connection)
+    else:
+        connection.exec_driver_sql(step)
+
+
+def _record(connection: Connection, migration: Migration, steps_done: int, applied_at):
+    connection.exec_driver_sql(
+        "INSERT INTO schema_migrations (version, name, steps_done, applied_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (version) DO UPDATE SET steps_done = excluded.steps_done, applied_at = excluded.applied_at",
+        (migration.version, migration.name, steps_done, applied_at),
+    )
+
+
+if __name__ == "__main__":
+    from backend.database import create_db_and_tables, shards
+
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument("--status", action="store_true", help="only list recorded migrations")
+    args = parser.parse_args()
+
+    if args.status:
+        result = [migration_status(shard_engine) for shard_engine in shards.engines]
+    else:
+        result = create_db_and_tables()
+    print(json.dumps(result, default=str))
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from backend import database as db, events
+from backend.schema import ChatInDB, MessageOutboxInDB, OutboxProgressInDB
+
+poll_interval = float(os.environ.get("OUTBOX_POLL_INTERVAL", default=0.1))  # seconds
+relay_batch_size = 500
+
+
+class OutboxRelay:
+    """
+    Copies the primary database's rows of messages written to other shards.
+
+    A message on shard 1 and up commits only there, together with a
+    ``message_outbox`` entry holding its attachment links and mentions. The
+    relay writes those, the activity rollups, the change feed entry and the
+    events into the primary a batch at a time, so the primary's write lock is
+    taken once per batch instead of once per message. Every worker process
+    runs one; the relayed position of each shard is kept in the primary and
+    only moved under its write lock, so each entry is relayed exactly once.
+    """
+
+    def __init__(self, poll_interval: float = poll_interval):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Starts relaying in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the relay thread after its current batch."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def run_once(self, batch_size: int = relay_batch_size) -> int:
+        """
+        Relays the next batch of every shard's outbox.
+
+        :return: the number of entries relayed
+        """
+        return sum(relay_shard(shard, batch_size) for shard in range(1, len(db.shards.engines)))
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                while self.run_once() and not self._stop.is_set():
+                    pass
+            except OperationalError:
+                continue  # locked; retry on the next tick
+
+
+def relay_shard(shard: int, batch_size: int = relay_batch_size) -> int:
+    """
+    Relays one batch of a shard's outbox into the primary database.
+
+    Entries of chats that are gone or marked deleted are dropped, since the
+    chat's purge has removed or will remove everything they would add.
+
+    :param shard: index of the shard, 1 and up
+    :return: the number of entries relayed
+    """
+    router = db.shards
+    with Session(router.read_engines[0]) as session:
+        progress = session.get(OutboxProgressInDB, shard)
+        relayed_id = progress.relayed_id if progress else 0
+    with Session(router.read_engines[shard]) as shard_session:
+        entries = shard_session.exec(
+            select(MessageOutboxInDB)
+            .where(MessageOutboxInDB.id > relayed_id)
+            .order_by(MessageOutboxInDB.id)
+            .limit(batch_size)
+        ).all()
+    if not entries:
+        return 0
+
+    with Session(router.engines[0]) as session:
+        session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        progress = session.get(OutboxProgressInDB, shard) or OutboxProgressInDB(shard=shard)
+        if progress.relayed_id != relayed_id:
+            session.rollback()
+            return 0  # another worker relayed this batch
+        chat_ids = {entry.chat_id for entry in entries}
+        live_ids = set(session.exec(
+            select(ChatInDB.id).where(ChatInDB.id.in_(chat_ids)).where(ChatInDB.deleted_at.is_(None))
+        ).all())
+        published = set()
+        for entry in entries:
+            if entry.chat_id not in live_ids:
+                continue
+            payload = json.loads(entry.payload)
+            db.record_message(
+                session,
+                entry.message_id,
+                entry.chat_id,
+                entry.user_id,
+                entry.created_at,
+                [tuple(attachment) for attachment in payload["attachments"]],
+                payload["mentions"],
+            )
+            # buffers refilled before the links arrived, the writer's too, miss the attachments
+            topic, origin = ("chat", None) if payload["attachments"] else ("message", entry.origin)
+            if (topic, entry.chat_id, origin) not in published:
+                events.bus.publish(session, topic, entry.chat_id, origin=origin)
+                published.add((topic, entry.chat_id, origin))
+        relayed_id = entries[-1].id
+        progress.relayed_id = relayed_id
+        session.add(progress)
+        session.commit()
+
+    with Session(router.engines[shard]) as shard_session:
+        shard_session.execute(
+            delete(MessageOutboxInDB).where(MessageOutboxInDB.id <= relayed_id)
+        )
+        shard_session.commit()
+    return len(entries)
+
+
+relay = OutboxRelay()
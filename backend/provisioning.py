@@ -0,0 +1,172 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Iterable, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from backend import events
+from backend.auth import UserRegistration, pwd_context
+from backend.database import engine, release
+from backend.schema import ProvisionResult, UserInDB, UserResponseModel
+
+hash_workers = int(os.environ.get("PROVISION_HASH_WORKERS", default=os.cpu_count() or 1))
+provision_chunk_size = 500
+max_provision_batch = 10000
+lookup_chunk_size = 500  # values per IN (...) list
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """
+    Hashes passwords on every core.
+
+    bcrypt is deliberately slow and CPU bound, so hashes are spread over a
+    process pool with one worker per core, leaving the server's threads free.
+    The workers are spawned rather than forked, since forking a process that
+    already runs threads can copy locks they hold. With
+    ``PROVISION_HASH_WORKERS=1`` (e.g. on Lambda, which has no shared memory
+    for process pools) they are hashed in the calling thread.
+    """
+    global _pool
+    if hash_workers <= 1 or len(passwords) <= 1:
+        return [hash_password(password) for password in passwords]
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=hash_workers, mp_context=get_context("spawn"))
+    chunksize = max(1, len(passwords) // (hash_workers * 4))
+    return list(_pool.map(hash_password, passwords, chunksize=chunksize))
+
+
+def shutdown_pool():
+    """Stops the hashing workers, if any were started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def provision_users(
+    session: Session,
+    registrations: list[UserRegistration],
+    chunk_size: int = provision_chunk_size,
+) -> list[ProvisionResult]:
+    """
+    Creates many users at once, reporting the outcome of every row.
+
+    Usernames and emails that are taken, or repeated within the batch, are
+    found with a few set-based queries before any password is hashed. The
+    remaining rows are inserted ``chunk_size`` at a time, each chunk in its
+    own transaction; if a chunk loses a race with another writer, its rows
+    are retried one by one so only the conflicting ones fail.
+
+    :return: one result per registration, in input order
+    """
+    results = [ProvisionResult(index=index) for index in range(len(registrations))]
+    taken_usernames = _existing(session, UserInDB.username, {r.username for r in registrations})
+    taken_emails = _existing(session, UserInDB.email, {r.email for r in registrations})
+
+    accepted = []
+    for index, registration in enumerate(registrations):
+        if registration.username in taken_usernames:
+            results[index].error = _duplicate("username", registration.username)
+        elif registration.email in taken_emails:
+            results[index].error = _duplicate("email", registration.email)
+        else:
+            accepted.append(index)
+        taken_usernames.add(registration.username)
+        taken_emails.add(registration.email)
+
+    release(session)
+    hashes = hash_passwords([registrations[index].password for index in accepted])
+    for start in range(0, len(accepted), chunk_size):
+        chunk = [
+            (index, UserInDB(
+                username=registrations[index].username,
+                email=registrations[index].email,
+                hashed_password=hashed_password,
+            ))
+            for index, hashed_password in zip(
+                accepted[start:start + chunk_size], hashes[start:start + chunk_size]
+            )
+        ]
+        _insert_chunk(session, chunk, results)
+    return results
+
+
+def _existing(session: Session, column, values: set[str]) -> set[str]:
+    values = list(values)
+    found = set()
+    for start in range(0, len(values), lookup_chunk_size):
+        found.update(session.exec(
+            select(column).where(column.in_(values[start:start + lookup_chunk_size]))
+        ).all())
+    return found
+
+
+def _insert_chunk(session: Session, chunk: list[tuple[int, UserInDB]], results: list[ProvisionResult]):
+    try:
+        session.add_all([user for _, user in chunk])
+        events.bus.publish(session, "user")
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        if len(chunk) > 1:
+            for row in chunk:
+                _insert_chunk(session, [(row[0], UserInDB(**row[1].model_dump(exclude={"id"})))], results)
+        else:
+            index, user = chunk[0]
+            if session.exec(select(UserInDB.id).where(UserInDB.username == user.username)).first():
+                results[index].error = _duplicate("username", user.username)
+            else:
+                results[index].error = _duplicate("email", user.email)
+        return
+    for index, user in chunk:
+        results[index].user = UserResponseModel(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            created_at=user.created_at,
+        )
+
+
+def _duplicate(field: str, value: str) -> dict[str, str]:
+    return {
+        "type":"duplicate_value",
+        "entity_name":"User",
+        "entity_field":field,
+        "entity_value":value
+    }
+
+
+def read_registrations(lines: Iterable[str]) -> list[UserRegistration]:
+    """Reads registrations from CSV with a ``username,email,password`` header."""
+    return [UserRegistration(**row) for row in csv.DictReader(lines)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create users in bulk from a CSV file.")
+    parser.add_argument("file", help="CSV with username, email and password columns, or - for stdin")
+    parser.add_argument("--chunk-size", type=int, default=provision_chunk_size)
+    args = parser.parse_args()
+
+    if args.file == "-":
+        registrations = read_registrations(sys.stdin)
+    else:
+        with open(args.file, newline="") as file:
+            registrations = read_registrations(file)
+    with Session(engine) as session:
+        results = provision_users(session, registrations, args.chunk_size)
+    print(json.dumps({
+        "created": sum(result.user is not None for result in results),
+        "failed": [result.model_dump(exclude_none=True) for result in results if result.error is not None],
+    }))
@@ -0,0 +1,217 @@
+import argparse
+import json
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from backend import database as db
+from backend.database import MESSAGE_COLUMNS, engine
+from backend.jobs import JobContext
+from backend.schema import ChatInDB, ChatShardInDB, MessageArchiveBlockInDB, MessageInDB
+
+rebalance_batch_size = 500
+
+
+def move_chat(
+    session: Session,
+    chat_id: int,
+    target: int,
+    batch_size: int = rebalance_batch_size,
+) -> int:
+    """
+    Moves the messages of a chat to another shard while it stays writable.
+
+    Messages are copied in batches, each ending its read on the source so the
+    shard's writer connection is free for requests in between. Then the
+    remaining tail is copied and the placement flipped while the source
+    shard's write lock is held, so no write can slip in between, and the
+    target's id sequence is moved past the chat's ids so its new messages
+    keep sorting last. Finally the source rows are deleted in batches; any
+    straggler written by a request that resolved the old placement is copied
+    over before its batch is deleted.
+
+    :param session: a session on the primary database
+    :param chat_id: id of the chat to move
+    :param target: index of the destination shard
+    :param batch_size: number of rows copied or deleted per transaction
+    :return: the number of hot messages moved
+    """
+    router = db.shards
+    if not 0 <= target < len(router.engines):
+        raise ValueError(f"no such shard: {target}")
+    source = router.shard_of(chat_id, session)
+    session.commit()  # hand the primary's writer connection to whichever session below needs it
+    if source == target:
+        return 0
+
+    with Session(router.bind_for(source, session)) as source_session, \
+            Session(router.bind_for(target, session)) as target_session:
+        last_id = _copy_messages(source_session, target_session, chat_id, 0, batch_size)
+        archived_id = _copy_archive_blocks(source_session, target_session, chat_id)
+
+        source_session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        last_id = _copy_messages(source_session, target_session, chat_id, last_id, batch_size, release=False)
+        router.reserve_message_ids(target_session, max(last_id, archived_id))
+        target_session.commit()
+        if source == 0:
+            placement_session = source_session
+        elif target == 0:
+            placement_session = target_session
+        else:
+            placement_session = session
+        placement_session.merge(ChatShardInDB(chat_id=chat_id, shard=target))
+        placement_session.commit()
+        source_session.rollback()
+
+        return _drain_messages(source_session, target_session, chat_id, last_id, batch_size)
+
+
+def spread_chats(
+    session: Session,
+    batch_size: int = rebalance_batch_size,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict[int, int]:
+    """
+    Moves every chat to the shard given by its id modulo the shard count.
+
+    :param progress: called with ``(1, chat_count)`` after every chat
+    :return: the number of moved messages per chat id
+    """
+    moved = {}
+    chat_ids = session.exec(select(ChatInDB.id)).all()
+    for chat_id in chat_ids:
+        moved[chat_id] = move_chat(session, chat_id, chat_id % len(db.shards.engines), batch_size)
+        if progress is not None:
+            progress(1, len(chat_ids))
+    return moved
+
+
+def spread_chats_job(
+    session: Session,
+    context: JobContext,
+    batch_size: int = rebalance_batch_size,
+) -> dict[int, int]:
+    """Job handler for ``spread_chats``; reports moved chats as progress."""
+    return spread_chats(session, batch_size, context.advance)
+
+
+def shard_status(session: Session) -> list[dict[str, int]]:
+    """
+    Reports the number of chats and hot messages on every shard.
+
+    :return: one entry per shard, in shard order
+    """
+    message_counts = db.shards.fan_out(
+        session,
+        lambda shard_session: shard_session.scalar(select(func.count(MessageInDB.id))),
+    )
+    placements = dict(session.exec(
+        select(ChatShardInDB.shard, func.count(ChatShardInDB.chat_id))
+        .group_by(ChatShardInDB.shard)
+    ).all())
+    chat_count = session.scalar(select(func.count(ChatInDB.id)))
+    placements[0] = chat_count - sum(
+        count for shard, count in placements.items() if shard != 0
+    )
+    return [
+        {"shard": shard, "chats": placements.get(shard, 0), "messages": count}
+        for shard, count in enumerate(message_counts)
+    ]
+
+
+def _copy_messages(
+    source_session: Session,
+    target_session: Session,
+    chat_id: int,
+    after_id: int,
+    batch_size: int,
+    release: bool = True,
+) -> int:
+    while True:
+        rows = source_session.exec(
+            select(*MESSAGE_COLUMNS)
+            .where(MessageInDB.chat_id == chat_id)
+            .where(MessageInDB.id > after_id)
+            .order_by(MessageInDB.id)
+            .limit(batch_size)
+        ).all()
+        if release:
+            db.release(source_session)
+        if not rows:
+            return after_id
+        _insert_messages(target_session, rows)
+        after_id = rows[-1][0]
+
+
+def _copy_archive_blocks(source_session: Session, target_session: Session, chat_id: int) -> int:
+    blocks = source_session.exec(
+        select(MessageArchiveBlockInDB).where(MessageArchiveBlockInDB.chat_id == chat_id)
+    ).all()
+    copies = [MessageArchiveBlockInDB(**block.model_dump(exclude={"id"})) for block in blocks]
+    db.release(source_session)
+    target_session.add_all(copies)
+    target_session.commit()
+    return max((block.last_message_id for block in copies), default=0)
+
+
+def _drain_messages(
+    source_session: Session,
+    target_session: Session,
+    chat_id: int,
+    copied_id: int,
+    batch_size: int,
+) -> int:
+    moved = 0
+    while True:
+        rows = source_session.exec(
+            select(*MESSAGE_COLUMNS)
+            .where(MessageInDB.chat_id == chat_id)
+            .order_by(MessageInDB.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        stragglers = [row for row in rows if row[0] > copied_id]
+        if stragglers:
+            _insert_messages(target_session, stragglers)
+        source_session.execute(
+            delete(MessageInDB).where(MessageInDB.id.in_([row[0] for row in rows]))
+        )
+        source_session.commit()
+        moved += len(rows)
+
+    source_session.execute(
+        delete(MessageArchiveBlockInDB).where(MessageArchiveBlockInDB.chat_id == chat_id)
+    )
+    source_session.commit()
+    return moved
+
+
+def _insert_messages(target_session: Session, rows: list[tuple]):
+    target_session.add_all([
+        MessageInDB(id=message_id, chat_id=chat_id, text=text, created_at=created_at, user_id=user_id)
+        for message_id, chat_id, text, created_at, user_id in rows
+    ])
+    target_session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and rebalance message shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show chats and messages per shard")
+    move_parser = commands.add_parser("move", help="move one chat to another shard")
+    move_parser.add_argument("chat_id", type=int)
+    move_parser.add_argument("shard", type=int)
+    commands.add_parser("spread", help="move every chat to its default shard")
+    parser.add_argument("--batch-size", type=int, default=rebalance_batch_size)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        if args.command == "status":
+            result = shard_status(session)
+        elif args.command == "move":
+            result = move_chat(session, args.chat_id, args.shard, args.batch_size)
+        else:
+            result = spread_chats(session, args.batch_size)
+    print(json.dumps(result))
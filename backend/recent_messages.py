@@ -0,0 +1,237 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+from backend import events
+from backend.schema import MessageResponseModel
+
+recent_enabled = os.environ.get("RECENT_MESSAGES", default="1") == "1"
+recent_per_chat = int(os.environ.get("RECENT_MESSAGES_PER_CHAT", default=200))
+recent_capacity = int(os.environ.get("RECENT_MESSAGES_CAPACITY", default=50000))  # messages over all chats
+
+# loads the messages of a chat newer than an id (or the newest ones for None),
+# at most a limit of them, oldest first
+Loader = Callable[[Optional[int], int], list[MessageResponseModel]]
+
+
+class ChatBuffer:
+    """The newest messages of one chat, oldest first."""
+
+    __slots__ = ("messages", "complete", "loaded", "pending", "lock")
+
+    def __init__(self, size: int):
+        self.messages: deque[MessageResponseModel] = deque(maxlen=size)
+        self.complete = False  # holds every message of the chat
+        self.loaded = False
+        self.pending = 0  # message events not reflected in the buffer yet
+        self.lock = threading.Lock()
+
+    @property
+    def newest_id(self) -> Optional[int]:
+        return self.messages[-1].id if self.messages else None
+
+    def extend(self, messages: list[MessageResponseModel]):
+        newest_id = self.newest_id
+        for message in messages:
+            if newest_id is not None and message.id <= newest_id:
+                continue
+            if len(self.messages) == self.messages.maxlen:
+                self.complete = False
+            self.messages.append(message)
+
+
+class RecentMessageCache:
+    """
+    Ring buffers of the newest messages of recently read chats.
+
+    A chat's buffer is loaded on its first read and serves the latest page,
+    pages before a recent message and deltas after one without a query.
+    Every ``"message"`` event marks the chat's buffer behind; its next read
+    first loads only the messages newer than the buffer's newest one, on a
+    fresh snapshot. ``create_message`` appends its own message after commit
+    when it directly follows the buffer's newest one, which settles its own
+    event, so a chat with a single writer process is never read back. At most
+    ``capacity`` messages are held; the least recently read chats are dropped
+    whole to stay below it.
+    """
+
+    def __init__(self, per_chat: int = recent_per_chat, capacity: int = recent_capacity):
+        self.per_chat = per_chat
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._chats: OrderedDict[int, ChatBuffer] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(
+        self,
+        chat_id: int,
+        load: Loader,
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Optional[list[MessageResponseModel]]:
+        """
+        Serves a read of a chat's messages from its buffer.
+
+        :param load: reads messages from the database, see ``Loader``
+        :return: the matching messages, oldest first, or None if the buffer
+            cannot tell whether older messages would match
+        """
+        buffer = self._buffer(chat_id)
+        with buffer.lock:
+            with self._lock:
+                pending = buffer.pending
+            queried = not buffer.loaded or pending > 0
+            if queried:
+                newest = load(buffer.newest_id, self.per_chat)
+                if not buffer.loaded or len(newest) >= self.per_chat:
+                    # the gap to what was buffered may hold more messages
+                    buffer.messages.clear()
+                    buffer.complete = not buffer.loaded and len(newest) < self.per_chat
+                    buffer.loaded = True
+                buffer.extend(newest)
+            with self._lock:
+                buffer.pending -= pending
+                self._evict(chat_id)
+            messages = list(buffer.messages)
+            complete = buffer.complete
+
+        matching = [
+            message for message in messages
+            if (before is None or message.id < before) and (after is None or message.id > after)
+        ]
+        covered = (
+            complete
+            or (after is not None and bool(messages) and messages[0].id <= after)
+            or (limit is not None and len(matching) >= limit)
+        )
+        with self._lock:
+            if covered and not queried:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not covered:
+            return None
+        return matching if limit is None else matching[-limit:]
+
+    def __contains__(self, chat_id: int) -> bool:
+        with self._lock:
+            return chat_id in self._chats
+
+    def append(self, chat_id: int, message: MessageResponseModel, previous_id: Optional[int]):
+        """
+        Adds a message its writer has just committed.
+
+        It is only appended right after the message it directly follows in
+        the chat, and settles its own event. Otherwise another worker's message
+        may lie in between, so the buffer stays behind and its next read loads
+        everything after its newest message.
+
+        :param previous_id: id of the chat's message just before this one, as
+            seen by the writer's transaction
+        """
+        with self._lock:
+            buffer = self._chats.get(chat_id)
+        if buffer is None:
+            return
+        with buffer.lock:
+            if not buffer.loaded:
+                return
+            with self._lock:
+                if buffer.newest_id == previous_id:
+                    buffer.extend([message])
+                    buffer.pending = max(buffer.pending - 1, 0)
+                else:
+                    buffer.pending = max(buffer.pending, 1)
+                self._evict(chat_id)
+
+    def forget(self, chat_id: Optional[int] = None):
+        """Drops one chat's buffer, or every buffer."""
+        with self._lock:
+            if chat_id is None:
+                self._chats.clear()
+            else:
+                self._chats.pop(chat_id, None)
+
+    def mark_behind(self, chat_id: int):
+        """Records a message event; the chat's next read catches up first."""
+        with self._lock:
+            buffer = self._chats.get(chat_id)
+            if buffer is not None:
+                buffer.pending += 1
+
+    def snapshot(self) -> dict[str, int | float]:
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                "chats": len(self._chats),
+                "messages": sum(len(buffer.messages) for buffer in self._chats.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / reads if reads else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _buffer(self, chat_id: int) -> ChatBuffer:
+        with self._lock:
+            buffer = self._chats.get(chat_id)
+            if buffer is None:
+                buffer = self._chats[chat_id] = ChatBuffer(self.per_chat)
+            self._chats.move_to_end(chat_id)
+            return buffer
+
+    def _evict(self, keep: int):
+        size = sum(len(buffer.messages) for buffer in self._chats.values())
+        while size > self.capacity and len(self._chats) > 1:
+            chat_id = next(iter(self._chats))
+            if chat_id == keep:
+                self._chats.move_to_end(chat_id)
+                chat_id = next(iter(self._chats))
+            size -= len(self._chats.pop(chat_id).messages)
+            self.evictions += 1
+
+
+_caches: "weakref.WeakKeyDictionary[object, RecentMessageCache]" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def cache_for(bind) -> RecentMessageCache:
+    """Returns the cache of the database behind a (read-only) engine."""
+    with _caches_lock:
+        cache = _caches.get(bind)
+        if cache is None:
+            cache = _caches[bind] = RecentMessageCache(recent_per_chat, recent_capacity)
+        return cache
+
+
+def snapshot() -> list[dict[str, int | float]]:
+    with _caches_lock:
+        return [cache.snapshot() for cache in _caches.values()]
+
+
+def _on_message(topic: str, key: Optional[str]):
+    for cache in list(_caches.values()):
+        if key is None:
+            cache.forget()
+        else:
+            cache.mark_behind(int(key))
+
+
+def _on_chat(topic: str, key: Optional[str]):
+    for cache in list(_caches.values()):
+        cache.forget(None if key is None else int(key))
+
+
+def _on_user(topic: str, key: Optional[str]):
+    # buffered messages embed their authors
+    for cache in list(_caches.values()):
+        cache.forget()
+
+
+events.bus.subscribe("message", _on_message)
+events.bus.subscribe("chat", _on_chat)
+events.bus.subscribe("user", _on_user)
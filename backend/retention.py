@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from itertools import takewhile
+from typing import Callable, Optional
+
+from sqlalchemy import delete, insert
+from sqlmodel import Session, select
+
+from backend import database as db
+from backend import events, rollups
+from backend.database import engine, pack_message_block, unpack_message_block
+from backend.jobs import JobContext
+from backend.schema import (
+    ChangeInDB,
+    ChatInDB,
+    MentionInDB,
+    MessageArchiveBlockInDB,
+    MessageAttachmentLinkInDB,
+    MessageInDB,
+)
+
+# days messages are kept in chats without a policy of their own; 0 keeps them forever
+retention_days = int(os.environ.get("MESSAGE_RETENTION_DAYS", default=0))
+retention_batch_size = int(os.environ.get("RETENTION_BATCH_SIZE", default=500))
+retention_pause = float(os.environ.get("RETENTION_PAUSE", default=0.05))  # seconds between batches
+
+
+def effective_days(days: Optional[int]) -> Optional[int]:
+    """
+    Resolves a chat's policy against the global default.
+
+    :param days: the chat's ``retention_days``
+    :return: the number of days messages are kept, or None to keep them forever
+    """
+    if days is None:
+        days = retention_days
+    return days or None
+
+
+def set_policy(chat_id: str, days: Optional[int], session: Session) -> ChatInDB:
+    """
+    Sets how long the messages of a chat are kept.
+
+    :param days: None to follow the global default, 0 to keep messages forever
+    :return: the updated chat
+    :raises HTTPException: if no such chat exists
+    """
+    chat = db.get_chat_by_id(chat_id, session)
+    chat.retention_days = days
+    events.bus.publish(session, "chat", chat.id)
+    db.record_change(session, "chat", "update", chat.id, chat_id=chat.id)
+    session.commit()
+    session.refresh(chat)
+    return chat
+
+
+def purge_chat_messages(
+    session: Session,
+    chat_id: int,
+    cutoff: datetime,
+    batch_size: int = retention_batch_size,
+    pause: float = retention_pause,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Deletes the messages of a chat created before ``cutoff``.
+
+    Hot messages go in batches of at most ``batch_size`` ids found on the
+    ``(chat_id, created_at)`` index; archive blocks are trimmed one block at a
+    time. Every batch drops the messages' attachment links and mentions, takes
+    them out of the activity rollups and records their deletion in the change
+    feed before the messages themselves
+    are removed, each in a short transaction that also publishes a ``"chat"``
+    event, so readers stop serving the removed messages batch by batch. The
+    purge sleeps ``pause`` seconds between batches so requests get the write
+    lock in between. A purge cut short is simply run again.
+
+    :param session: a session on the primary database
+    :param progress: called with the number of messages removed by every batch
+    :return: the number of messages removed
+    """
+    progress = progress or (lambda deleted: None)
+    deleted = 0
+    with db.shards.session_for(chat_id, session) as shard_session:
+        sharded = shard_session is not session
+        while True:
+            rows = shard_session.exec(
+                select(MessageInDB.id, MessageInDB.created_at, MessageInDB.user_id)
+                .where(MessageInDB.chat_id == chat_id)
+                .where(MessageInDB.created_at < cutoff)
+                .order_by(MessageInDB.created_at)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            _forget_messages(session, chat_id, rows)
+            shard_session.execute(delete(MessageInDB).where(MessageInDB.id.in_([row[0] for row in rows])))
+            _commit(session, shard_session, chat_id)
+            deleted += len(rows)
+            progress(len(rows))
+            time.sleep(pause)
+
+        while True:
+            block = shard_session.exec(
+                select(MessageArchiveBlockInDB)
+                .where(MessageArchiveBlockInDB.chat_id == chat_id)
+                .order_by(MessageArchiveBlockInDB.first_message_id)
+                .limit(1)
+            ).first()
+            rows = [] if block is None else unpack_message_block(chat_id, block.payload)
+            expired = list(takewhile(lambda row: row[3] < cutoff, rows))
+            if not expired:
+                shard_session.rollback()
+                break
+            _forget_messages(session, chat_id, [(row[0], row[3], row[4]) for row in expired])
+            kept = rows[len(expired):]
+            if kept:
+                block.first_message_id = kept[0][0]
+                block.message_count = len(kept)
+                block.payload = pack_message_block(kept)
+            else:
+                shard_session.delete(block)
+            _commit(session, shard_session, chat_id)
+            deleted += len(expired)
+            progress(len(expired))
+            time.sleep(pause)
+
+    if deleted and sharded:
+        # the last batch's event was delivered before its shard commit
+        events.bus.publish(session, "chat", chat_id)
+        session.commit()
+    return deleted
+
+
+def purge_expired_messages(
+    session: Session,
+    batch_size: int = retention_batch_size,
+    pause: float = retention_pause,
+    progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """
+    Enforces the retention policy of every chat.
+
+    :param progress: called with the number of messages removed by every batch
+    :return: the number of removed messages per chat id, the total and the
+        rate it was removed at
+    """
+    started = time.monotonic()
+    now = datetime.now()
+    policies = session.exec(
+        select(ChatInDB.id, ChatInDB.retention_days).where(ChatInDB.deleted_at == None)
+    ).all()
+    db.release(session)
+    purged = {}
+    for chat_id, days in policies:
+        days = effective_days(days)
+        if days is None:
+            continue
+        count = purge_chat_messages(session, chat_id, now - timedelta(days=days), batch_size, pause, progress)
+        if count:
+            purged[chat_id] = count
+    seconds = time.monotonic() - started
+    deleted = sum(purged.values())
+    return {
+        "chats": purged,
+        "deleted": deleted,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(deleted / seconds, 1) if seconds else 0.0,
+    }
+
+
+def purge_expired_messages_job(
+    session: Session,
+    context: JobContext,
+    batch_size: int = retention_batch_size,
+) -> dict:
+    """Job handler for ``purge_expired_messages``; reports removed messages as progress."""
+    # the job runner's throttle already pauses after every batch
+    return purge_expired_messages(session, batch_size, pause=0, progress=context.advance)
+
+
+def _forget_messages(session: Session, chat_id: int, rows: list[tuple]):
+    # rows are (id, created_at, user_id) of the expired messages
+    message_ids = [row[0] for row in rows]
+    session.execute(
+        delete(MessageAttachmentLinkInDB).where(MessageAttachmentLinkInDB.message_id.in_(message_ids))
+    )
+    session.execute(delete(MentionInDB).where(MentionInDB.message_id.in_(message_ids)))
+    rollups.subtract_messages(session, chat_id, rows)
+    session.execute(insert(ChangeInDB), [
+        {"kind": "message", "op": "delete", "entity_id": message_id, "chat_id": chat_id, "created_at": datetime.now()}
+        for message_id in message_ids
+    ])
+
+
+def _commit(session: Session, shard_session: Session, chat_id: int):
+    # buffered recent messages and cached counts of the chat are stale now
+    events.bus.publish(session, "chat", chat_id)
+    # the primary first: a crash in between leaves messages that the next run
+    # removes again, never links or changes pointing at removed messages
+    session.commit()
+    if shard_session is not session:
+        shard_session.commit()
+
+
+def lambda_handler(event, context):
+    try:
+        with Session(engine) as session:
+            result = purge_expired_messages(session)
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result),
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)}),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete messages older than their chat's retention policy.")
+    parser.add_argument("--batch-size", type=int, default=retention_batch_size)
+    parser.add_argument("--pause", type=float, default=retention_pause, help="seconds between batches")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        result = purge_expired_messages(session, args.batch_size, args.pause)
+    print(json.dumps(result))
@@ -0,0 +1,185 @@
+import argparse
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, select
+
+from backend import database as db
+from backend.coalesce import coalesced
+from backend.database import ROLLUP_PERIODS, engine, record_activity, rollup_bucket, unpack_message_block
+from backend.jobs import JobContext
+from backend.schema import (
+    ActivityBucket,
+    ChatActivityInDB,
+    ChatInDB,
+    ChatPosterInDB,
+    ChatStatsResponse,
+    MessageArchiveBlockInDB,
+    MessageInDB,
+    PosterCount,
+    UserInDB,
+    UserResponseModel,
+)
+
+PERIOD_LENGTHS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+@coalesced
+def get_chat_stats(
+    chat_id: int,
+    session: Session,
+    period: str = "day",
+    buckets: int = 30,
+    top: int = 10,
+) -> ChatStatsResponse:
+    """
+    Reads the activity of a chat from its rollups.
+
+    Both queries are range scans of a primary key or index bounded by
+    ``buckets`` and ``top``, so they take the same time however long the
+    chat's history is.
+
+    :param period: ``"hour"`` or ``"day"``
+    :param buckets: number of most recent periods to return; periods without
+        messages are left out
+    :param top: number of top posters to return
+    """
+    since = rollup_bucket(datetime.now(), period) - PERIOD_LENGTHS[period] * (buckets - 1)
+    activity = session.exec(
+        select(ChatActivityInDB.bucket, ChatActivityInDB.message_count)
+        .where(ChatActivityInDB.chat_id == chat_id)
+        .where(ChatActivityInDB.period == period)
+        .where(ChatActivityInDB.bucket >= since)
+        .order_by(ChatActivityInDB.bucket)
+    ).all()
+    posters = session.exec(
+        select(ChatPosterInDB.message_count, UserInDB.id, UserInDB.username, UserInDB.email, UserInDB.created_at)
+        .join(UserInDB, UserInDB.id == ChatPosterInDB.user_id)
+        .where(ChatPosterInDB.chat_id == chat_id)
+        .order_by(ChatPosterInDB.message_count.desc(), ChatPosterInDB.user_id)
+        .limit(top)
+    ).all()
+    total = session.scalar(
+        select(func.sum(ChatPosterInDB.message_count)).where(ChatPosterInDB.chat_id == chat_id)
+    )
+    return ChatStatsResponse(
+        chat_id=chat_id,
+        period=period,
+        message_count=total or 0,
+        activity=[ActivityBucket(bucket=bucket, message_count=count) for bucket, count in activity],
+        top_posters=[
+            PosterCount(
+                user=UserResponseModel(id=user_id, username=username, email=email, created_at=created_at),
+                message_count=count,
+            ) for count, user_id, username, email, created_at in posters
+        ],
+    )
+
+
+def subtract_messages(session: Session, chat_id: int, rows: list[tuple]):
+    """
+    Takes removed messages out of the rollups of a chat in the session's
+    current transaction; buckets and posters left without messages are dropped.
+
+    :param rows: ``(id, created_at, user_id)`` of every removed message
+    """
+    counts = Counter((rollup_bucket(created_at, "hour"), user_id) for _id, created_at, user_id in rows)
+    for (hour, user_id), count in counts.items():
+        record_activity(session, chat_id, user_id, hour, -count)
+    session.execute(
+        delete(ChatActivityInDB)
+        .where(ChatActivityInDB.chat_id == chat_id)
+        .where(ChatActivityInDB.message_count <= 0)
+    )
+    session.execute(
+        delete(ChatPosterInDB)
+        .where(ChatPosterInDB.chat_id == chat_id)
+        .where(ChatPosterInDB.message_count <= 0)
+    )
+
+
+def backfill_chat(session: Session, chat_id: int) -> int:
+    """
+    Rebuilds the rollups of one chat from its hot and archived messages.
+
+    Hot messages are counted with one GROUP BY on the chat's shard; archive
+    blocks are decompressed one at a time. The old rollups are replaced in a
+    single transaction on the primary database.
+
+    :param session: a session on the primary database
+    :return: the number of counted messages
+    """
+    hours: Counter = Counter()
+    posters: Counter = Counter()
+    with db.shards.session_for(chat_id, session) as shard_session:
+        hour = func.strftime("%Y-%m-%d %H:00:00", MessageInDB.created_at)
+        for started, user_id, count in shard_session.exec(
+            select(hour, MessageInDB.user_id, func.count(MessageInDB.id))
+            .where(MessageInDB.chat_id == chat_id)
+            .where(MessageInDB.created_at != None)
+            .group_by(hour, MessageInDB.user_id)
+        ):
+            hours[datetime.fromisoformat(started)] += count
+            posters[user_id] += count
+        for payload in shard_session.exec(
+            select(MessageArchiveBlockInDB.payload).where(MessageArchiveBlockInDB.chat_id == chat_id)
+        ):
+            for _id, _chat_id, _text, created_at, user_id in unpack_message_block(chat_id, payload):
+                hours[rollup_bucket(created_at, "hour")] += 1
+                posters[user_id] += 1
+
+    buckets = {"hour": hours, "day": Counter()}
+    for started, count in hours.items():
+        buckets["day"][rollup_bucket(started, "day")] += count
+    session.execute(delete(ChatActivityInDB).where(ChatActivityInDB.chat_id == chat_id))
+    session.execute(delete(ChatPosterInDB).where(ChatPosterInDB.chat_id == chat_id))
+    activity = [
+        {"chat_id": chat_id, "period": period, "bucket": bucket, "message_count": count}
+        for period in ROLLUP_PERIODS
+        for bucket, count in buckets[period].items()
+    ]
+    if activity:
+        session.execute(insert(ChatActivityInDB), activity)
+        session.execute(insert(ChatPosterInDB), [
+            {"chat_id": chat_id, "user_id": user_id, "message_count": count}
+            for user_id, count in posters.items()
+        ])
+    session.commit()
+    return sum(posters.values())
+
+
+def backfill_rollups(
+    session: Session,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict[int, int]:
+    """
+    Rebuilds the rollups of every chat, one chat per transaction.
+
+    :param progress: called with ``(1, chat_count)`` after every chat
+    :return: the number of counted messages per chat id
+    """
+    chat_ids = session.exec(select(ChatInDB.id).where(ChatInDB.deleted_at == None)).all()
+    db.release(session)
+    counted = {}
+    for chat_id in chat_ids:
+        counted[chat_id] = backfill_chat(session, chat_id)
+        if progress is not None:
+            progress(1, len(chat_ids))
+    return counted
+
+
+def backfill_rollups_job(session: Session, context: JobContext) -> dict[int, int]:
+    """Job handler for ``backfill_rollups``; reports rebuilt chats as progress."""
+    return backfill_rollups(session, context.advance)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the activity rollups of every chat.")
+    parser.parse_args()
+
+    with Session(engine) as session:
+        result = backfill_rollups(session)
+    print(json.dumps(result))
@@ -0,0 +1,126 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session
+
+from backend import admission, backup, coalesce, contention, jobs, provisioning, recent_messages
+from backend import database as db
+from backend.auth import UserRegistration, get_admin_user
+from backend.schema import EnqueueJob, JobCollection, JobResponse, Metadata, ProvisionResponse
+
+admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(get_admin_user)])
+
+@admin_router.get("/admission")
+def get_admission_status() -> dict[str, dict[str, int | float]]:
+    """Get concurrency, queue depth and shed counts per route class."""
+    return admission.controller.snapshot()
+
+@admin_router.get("/coalescing")
+def get_coalescing_status() -> dict[str, int]:
+    """Get the number of coalesced reads in flight, and how many calls ran or joined one."""
+    return coalesce.flights.snapshot()
+
+@admin_router.get("/contention")
+def get_contention_status() -> dict:
+    """Get this worker's lock waits, commit latency and "database is locked" errors; recorded with `CONTENTION_STATS=1`."""
+    snapshot = contention.monitor.snapshot()
+    snapshot["enabled"] = contention.contention_enabled
+    return snapshot
+
+@admin_router.get("/recent-messages")
+def get_recent_messages_status() -> list[dict[str, int | float]]:
+    """Get the size, hit rate and evictions of the recent messages buffers of each database."""
+    return recent_messages.snapshot()
+
+@admin_router.post("/users", response_model=ProvisionResponse, response_model_exclude_none=True)
+def provision_users(registrations: list[UserRegistration], session: Session = Depends(db.get_session)):
+    """Create users in bulk; every row reports the created user or why it was rejected."""
+    if len(registrations) > provisioning.max_provision_batch:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "type":"batch_too_large",
+                "entity_name":"User",
+                "max_size":provisioning.max_provision_batch
+            }
+        )
+    results = provisioning.provision_users(session, registrations)
+    created = sum(result.user is not None for result in results)
+    return ProvisionResponse(
+        meta={"created": created, "failed": len(results) - created},
+        results=results,
+    )
+
+@admin_router.get("/jobs", response_model=JobCollection)
+def get_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    session: Session = Depends(db.get_session),
+):
+    """Get the most recent background jobs, optionally filtered by status."""
+    count, found = jobs.list_jobs(session, status, limit)
+    return JobCollection(
+        meta=Metadata(count=count),
+        jobs=[jobs.to_response(job) for job in found],
+    )
+
+@admin_router.post("/jobs", response_model=JobResponse, status_code=202)
+def enqueue_job(job: EnqueueJob, session: Session = Depends(db.get_session)):
+    """Queue a background job; it runs on the next free worker."""
+    if job.kind not in jobs.HANDLERS:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "type":"invalid_value",
+                "entity_name":"Job",
+                "entity_field":"kind",
+                "entity_value":job.kind
+            }
+        )
+    queued = jobs.enqueue(session, job.kind, job.payload, job.max_attempts)
+    session.commit()
+    session.refresh(queued)
+    return JobResponse(job=jobs.to_response(queued))
+
+@admin_router.post("/backups", response_model=JobResponse, status_code=202)
+def start_backup(allow_blocking: bool = False, session: Session = Depends(db.get_session)):
+    """Queue an online backup of every database; follow it under `/admin/jobs/{job_id}`.
+
+    Without WAL (e.g. on EFS) writes wait while the backup runs, so it is only
+    queued with `allow_blocking=true`."""
+    if backup.blocks_writers() and not allow_blocking:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "type":"backup_blocks_writers",
+                "journal_mode":db.journal_mode
+            }
+        )
+    queued = jobs.enqueue(session, "backup_database", max_attempts=1)
+    session.commit()
+    session.refresh(queued)
+    return JobResponse(job=jobs.to_response(queued))
+
+@admin_router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: int, session: Session = Depends(db.get_session)):
+    """Get the status and progress of a background job."""
+    return JobResponse(job=jobs.to_response(_get_job(job_id, session)))
+
+@admin_router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+def cancel_job(job_id: int, session: Session = Depends(db.get_session)):
+    """Cancel a background job. Running jobs stop after their current step."""
+    _get_job(job_id, session)
+    return JobResponse(job=jobs.to_response(jobs.cancel(session, job_id)))
+
+def _get_job(job_id: int, session: Session):
+    job = jobs.get_job(session, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "type":"entity_not_found",
+                "entity_name":"Job",
+                "entity_id":job_id
+            }
+        )
+    return job
@@ -0,0 +1,49 @@
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from sqlmodel import Session
+from typing import Optional
+from backend import attachments
+from backend import database as db
+
+from backend.schema import AttachmentInDB
+
+attachments_router = APIRouter(prefix="/attachments", tags=["Attachments"])
+
+@attachments_router.api_route("/{attachment_id}", methods=["GET", "HEAD"])
+def download_attachment(attachment_id: str,
+                        request: Request,
+                        range: Optional[str] = Header(None),
+                        session: Session = Depends(db.get_session)):
+    """Download an attachment, or the byte range given in the `Range` header.
+
+    With `ATTACHMENT_ACCEL_PREFIX` set, the file is left to nginx through `X-Accel-Redirect`."""
+    attachment = session.get(AttachmentInDB, attachment_id)
+    path = attachments.attachment_path(attachment_id)
+    if attachment is None or not os.path.exists(path):
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "type":"entity_not_found",
+                "entity_name":"Attachment",
+                "entity_id":attachment_id
+            }
+        )
+    headers = {
+        "etag": f'"{attachment.id}"',
+        "cache-control": "public, max-age=31536000, immutable",
+    }
+    if attachments.accel_prefix:
+        # nginx answers the Range header itself
+        return Response(
+            media_type=attachment.content_type,
+            headers={**headers, "x-accel-redirect": attachments.accel_redirect(attachment.id)},
+        )
+    return attachments.RangeFileResponse(
+        path,
+        stat_result=os.stat(path),
+        range_header=range,
+        media_type=attachment.content_type,
+        method=request.method,
+        headers=headers,
+    )
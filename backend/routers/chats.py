@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Depends, Query
+import zlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
-from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Iterator, Optional
+from backend import attachments, retention, rollups
 from backend import database as db
 from backend import auth
 
 from backend.schema import (
+    AttachmentInDB,
+    AttachmentResponse,
+    AttachmentResponseModel,
     UserInDB,
     ChatUpdate,
+    RetentionPolicy,
+    RetentionResponse,
     ChatMetadata,
     ChatResponse,
     ChatResponseModel,
+    ChatStatsResponse,
     UserResponseModel,
     UserCollection,
     MessageCollection,
@@ -22,15 +32,16 @@ from backend.schema import (
 
 chats_router = APIRouter(prefix="/chats", tags=["Chats"])
 
-@chats_router.get("", response_model=ChatCollection)
-def get_chats(session: Session = Depends(db.get_session)):
-    """Get a collection of Chats."""
+@chats_router.get("", response_model=ChatCollection, response_model_exclude_none=True)
+def get_chats(limit: int = Query(100, ge=1, le=1000),
+              cursor: Optional[str] = None,
+              session: Session = Depends(db.get_session)):
+    """Get a page of Chats ordered by name; pass `meta.next_cursor` as `cursor` for the next one."""
 
-    sort_key = lambda chat: getattr(chat, "name")
-    chats = db.get_all_chats(session)
+    chats, next_cursor = db.get_chats_page(session, limit, cursor)
     return ChatCollection(
-        meta={"count": len(chats)},
-        chats=sorted(chats, key=sort_key),
+        meta={"count": db.count_chats(session), "next_cursor": next_cursor},
+        chats=chats,
     )
 
 @chats_router.get("/{chat_id}", response_model=ChatResponse, response_model_exclude_none=True)
@@ -40,7 +51,7 @@ def get_chat_by_id(chat_id: str, session: Session = Depends(db.get_session), inc
     chat=db.get_chat_by_id(chat_id, session)
     chat_user=chat.owner
     response_data = {
-            "meta": ChatMetadata(message_count=len(chat.messages), user_count=len(chat.users)),
+            "meta": ChatMetadata(message_count=db.count_chat_messages(chat_id, session), user_count=len(chat.users)),
             "chat": ChatResponseModel(
                 id=chat.id,
                 name=chat.name,
@@ -55,18 +66,7 @@ def get_chat_by_id(chat_id: str, session: Session = Depends(db.get_session), inc
         }
     if include:
         if 'messages' in include:
-            response_data['messages'] = [MessageResponseModel(
-                                            id=message.id,
-                                            text=message.text,
-                                            chat_id=message.chat_id,
-                                            user=UserResponseModel(
-                                                id=message.user.id,
-                                                username=message.user.username,
-                                                email=message.user.email,
-                                                created_at=message.user.created_at
-                                            ),
-                                            created_at=message.created_at
-                                        ) for message in chat.messages]
+            response_data['messages'] = db.get_chat_messages(chat_id, session)
         if 'users' in include:
             response_data['users'] = [UserResponseModel(
                                         id=user.id,
@@ -91,20 +91,88 @@ def update_chat(chat_id: str, chat_update: ChatUpdate, session: Session = Depend
 
 @chats_router.delete("/{chat_id}", status_code=204)
 def delete_chat(chat_id: str, session: Session = Depends(db.get_session)):
-    """Delete a chat."""
+    """Delete a chat. Large chats disappear at once and are purged by a background job."""
     db.delete_chat(chat_id, session)
 
+@chats_router.get("/{chat_id}/stats", response_model=ChatStatsResponse)
+def get_chat_stats(chat_id: str,
+                   period: str = Query("day", pattern="^(hour|day)$"),
+                   buckets: int = Query(30, ge=1, le=1000),
+                   top: int = Query(10, ge=1, le=100),
+                   session: Session = Depends(db.get_session)):
+    """Get the message count of a chat per hour or day for the last `buckets` periods, and its top posters."""
+    chat = db.get_chat_by_id(chat_id, session)
+    return rollups.get_chat_stats(chat.id, session, period, buckets, top)
+
+@chats_router.get("/{chat_id}/retention", response_model=RetentionResponse)
+def get_chat_retention(chat_id: str, session: Session = Depends(db.get_session)):
+    """Get how many days the messages of a chat are kept; `effective_days` applies the global default."""
+    chat = db.get_chat_by_id(chat_id, session)
+    return _retention_response(chat)
+
+@chats_router.put("/{chat_id}/retention", response_model=RetentionResponse)
+def update_chat_retention(chat_id: str,
+                          policy: RetentionPolicy,
+                          session: Session = Depends(db.get_session),
+                          user: UserInDB = Depends(auth.get_current_user)):
+    """Set how many days the messages of a chat are kept; null follows the global default and 0 keeps them forever.
+    Only the chat's owner may change it."""
+    chat = db.get_chat_by_id(chat_id, session)
+    if chat.owner_id != user.id:
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "type":"permission_denied",
+                "entity_name":"Chat",
+                "entity_id":chat.id
+            }
+        )
+    chat = retention.set_policy(chat_id, policy.days, session)
+    return _retention_response(chat)
+
+def _retention_response(chat) -> RetentionResponse:
+    return RetentionResponse(
+        chat_id=chat.id,
+        days=chat.retention_days,
+        effective_days=retention.effective_days(chat.retention_days),
+    )
+
 @chats_router.get("/{chat_id}/messages", response_model=MessageCollection)
-def get_chat_messages(chat_id: str, session: Session = Depends(db.get_session)):
-    """Get the messages of a chat."""
+def get_chat_messages(chat_id: str,
+                      limit: Optional[int] = Query(None, ge=1, le=1000),
+                      before: Optional[int] = None,
+                      after: Optional[int] = None,
+                      session: Session = Depends(db.get_session)):
+    """Get the messages of a chat, optionally only the newest `limit` before message id `before`
+    and/or after message id `after`."""
 
     sort_key = lambda message: getattr(message, "created_at")
-    messages = db.get_chat_messages(chat_id, session)
+    messages = db.get_chat_messages(chat_id, session, limit=limit, before=before, after=after)
     return MessageCollection(
         meta={"count": len(messages)},
         messages=sorted(messages, key=sort_key),
     )
 
+@chats_router.get("/{chat_id}/messages/export")
+def export_chat_messages(chat_id: str, compress: bool = False, session: Session = Depends(db.get_session)):
+    """Stream the full message history of a chat as newline-delimited JSON."""
+
+    db.get_chat_by_id(chat_id, session)
+    headers = {"Content-Disposition": f'attachment; filename="chat-{chat_id}-messages.ndjson"'}
+    chunks = db.export_chat_messages(chat_id, session)
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        chunks = _gzip_chunks(chunks)
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
+def _gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 @chats_router.get("/{chat_id}/users", response_model=UserCollection)
 def get_chat_users(chat_id: str, session: Session = Depends(db.get_session)):
     """Get the messages of a chat."""
@@ -122,10 +190,36 @@ def create_chat_message(chat_id: str,
                    session: Session = Depends(db.get_session),
                    user: UserInDB = Depends(auth.get_current_user)):
     """write a message to a chat."""
-    message = db.create_message(chat_id, text.text, session, user)
+    message = db.create_message(chat_id, text.text, session, user, text.attachments)
+    attachments = db.get_attachment_responses(text.attachments, session)
     return MessageResponse(message=MessageResponseModel(id=message.id, text=message.text, chat_id=message.chat_id,
                                                         user=UserResponseModel(id=user.id,
                                                                                 username=user.username,
                                                                                 email=user.email,
                                                                                 created_at=user.created_at),
-                                                        created_at=message.created_at))
+                                                        created_at=message.created_at,
+                                                        attachments=attachments))
+
+@chats_router.post("/{chat_id}/attachments", response_model=AttachmentResponse, status_code=201)
+async def upload_attachment(chat_id: str,
+                            request: Request,
+                            filename: str = "attachment",
+                            session: Session = Depends(db.get_session),
+                            user: UserInDB = Depends(auth.get_current_user)):
+    """Upload a file as the raw request body, to be attached to a message of this chat.
+
+    Clients that already know the SHA-256 of the file may send it as `X-Content-SHA256`;
+    if the content is already stored, the body is not read at all."""
+    await run_in_threadpool(db.get_chat_by_id, chat_id, session)
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    known_digest = request.headers.get("x-content-sha256")
+    attachment = None
+    if known_digest:
+        attachment = await run_in_threadpool(session.get, AttachmentInDB, known_digest.lower())
+    if attachment is None:
+        await run_in_threadpool(db.release, session)  # the body may take a while to arrive
+        attachment = await attachments.store_upload(request.stream(), content_type, session)
+    return AttachmentResponse(attachment=AttachmentResponseModel(id=attachment.id,
+                                                                 filename=filename,
+                                                                 content_type=attachment.content_type,
+                                                                 size=attachment.size))
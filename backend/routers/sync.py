@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, Query
+from sqlmodel import Session
+from backend import database as db
+from backend import auth
+
+from backend.schema import SyncResponse, UserInDB
+
+sync_router = APIRouter(prefix="/sync", tags=["Sync"])
+
+@sync_router.get("", response_model=SyncResponse, response_model_exclude_none=True)
+def get_changes(since: int = Query(0, ge=0),
+                limit: int = Query(1000, ge=1, le=5000),
+                session: Session = Depends(db.get_session),
+                user: UserInDB = Depends(auth.get_current_user)):
+    """Retrieves the changes visible to the current user after sequence number `since`."""
+    changes = db.get_changes(user.id, since, limit + 1, session)
+    return SyncResponse(
+        changes=changes[:limit],
+        next=changes[:limit][-1].seq if changes else since,
+        has_more=len(changes) > limit,
+    )
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import Session
+from typing import Optional
 from backend import database as db
 from backend import auth
+from backend import search
 
 from backend.schema import (
+    BootstrapResponse,
+    MentionCollection,
     UserResponseModel,
     UserInDB,
     UserResponse,
@@ -14,6 +18,8 @@ from backend.schema import (
 
 users_router = APIRouter(prefix="/users", tags=["Users"])
 
+max_batch_size = 100
+
 @users_router.get("/me", response_model=UserResponse)
 def get_me(session: Session = Depends(db.get_session),
                    user: UserInDB = Depends(auth.get_current_user)):
@@ -21,6 +27,46 @@ def get_me(session: Session = Depends(db.get_session),
     if user:
         return UserResponse(user=UserResponseModel(id=user.id, username=user.username, email=user.email, created_at=user.created_at))
 
+@users_router.get("/me/bootstrap", response_model=BootstrapResponse, response_model_exclude_none=True)
+def get_bootstrap(chat_id: Optional[int] = None,
+                  limit: int = Query(50, ge=1, le=1000),
+                  session: Session = Depends(db.get_session),
+                  user: UserInDB = Depends(auth.get_current_user)):
+    """Retrieves the current user, their chats sorted by name, and the latest messages of `chat_id`,
+    which must be one of their chats."""
+
+    sort_key = lambda chat: getattr(chat, "name")
+    chats = db.get_member_chats(user.id, session)
+    messages = None
+    if chat_id is not None:
+        if chat_id not in {chat.id for chat in chats}:
+            raise HTTPException(
+                status_code=404,
+                detail={
+                    "type":"entity_not_found",
+                    "entity_name":"Chat",
+                    "entity_id":chat_id
+                }
+            )
+        messages = db.get_chat_messages(chat_id, session, limit=limit)
+    return BootstrapResponse(
+        user=UserResponseModel(id=user.id, username=user.username, email=user.email, created_at=user.created_at),
+        chats=sorted(chats, key=sort_key),
+        messages=messages,
+    )
+
+@users_router.get("/me/mentions", response_model=MentionCollection, response_model_exclude_none=True)
+def get_my_mentions(limit: int = Query(50, ge=1, le=1000),
+                    cursor: Optional[str] = None,
+                    session: Session = Depends(db.get_session),
+                    user: UserInDB = Depends(auth.get_current_user)):
+    """Retrieves the messages that @-mention the current user, newest first; pass `meta.next_cursor` as `cursor` for older ones."""
+    mentions, next_cursor = db.get_mentions_page(user.id, session, limit, cursor)
+    return MentionCollection(
+        meta={"count": db.count_mentions(user.id, session), "next_cursor": next_cursor},
+        mentions=mentions,
+    )
+
 @users_router.put("/me", response_model=UserResponse)
 def update_me(user_update: UserUpdate,
                 session: Session = Depends(db.get_session),
@@ -30,17 +76,59 @@ def update_me(user_update: UserUpdate,
     if user:
         return UserResponse(user=UserResponseModel(id=user.id, username=user.username, email=user.email, created_at=user.created_at))
 
-@users_router.get("", response_model=UserCollection)
-def get_users(session: Session = Depends(db.get_session)):
-    """Retrives all users within the database."""
-    
-    sort_key = lambda user: getattr(user, "id")
-    users = db.get_all_users(session)
+@users_router.get("", response_model=UserCollection, response_model_exclude_none=True)
+def get_users(ids: Optional[str] = None,
+              limit: int = Query(100, ge=1, le=1000),
+              cursor: Optional[str] = None,
+              session: Session = Depends(db.get_session)):
+    """Retrives a page of users ordered by id, or only those in the comma separated `ids`."""
+
+    if ids is not None:
+        return _get_user_batch(ids, session)
+    users, next_cursor = db.get_users_page(session, limit, cursor)
+    return UserCollection(
+        meta={"count": db.count_users(session), "next_cursor": next_cursor},
+        users=users,
+    )
+
+def _get_user_batch(ids: str, session: Session) -> UserCollection:
+    try:
+        user_ids = [int(user_id) for user_id in ids.split(",") if user_id.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "type":"invalid_value",
+                "entity_name":"User",
+                "entity_field":"ids",
+                "entity_value":ids
+            }
+        )
+    if len(user_ids) > max_batch_size:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "type":"batch_too_large",
+                "entity_name":"User",
+                "max_size":max_batch_size
+            }
+        )
+    users, missing = db.get_users_by_ids(user_ids, session)
     return UserCollection(
         meta={"count": len(users)},
-        users=sorted(users, key=sort_key),
+        users=users,
+        missing=missing,
     )
 
+@users_router.get("/search", response_model=UserCollection, response_model_exclude_none=True)
+def search_users(prefix: str = Query(..., min_length=1, max_length=64),
+                 limit: int = Query(10, ge=1, le=search.max_search_results),
+                 session: Session = Depends(db.get_session)):
+    """Retrieves users whose username starts with `prefix`, ignoring case, ordered by username."""
+
+    users = search.search_users(session, prefix, limit)
+    return UserCollection(meta={"count": len(users)}, users=users)
+
 @users_router.get("/{user_id}", response_model=UserResponse)
 def get_user(user_id: str, session: Session = Depends(db.get_session)):
     """Retrieves a user from the database by user_id"""
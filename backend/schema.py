@@ -1,6 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 
+from sqlalchemy import Index, event
 from sqlmodel import Field, Relationship, SQLModel
 from pydantic import BaseModel
 
@@ -9,6 +10,9 @@ class UserChatLinkInDB(SQLModel, table=True):
     """Database model for many-to-many relation of users to chats."""
 
     __tablename__ = "user_chat_links"
+    __table_args__ = (
+        Index("ix_user_chat_links_chat_id", "chat_id"),
+    )
 
     user_id: int = Field(foreign_key="users.id", primary_key=True)
     chat_id: int = Field(foreign_key="chats.id", primary_key=True)
@@ -20,6 +24,7 @@ class UserInDB(SQLModel, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(unique=True, index=True)
+    username_lower: Optional[str] = Field(default=None, index=True)
     email: str = Field(unique=True)
     hashed_password: str
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
@@ -29,15 +34,23 @@ class UserInDB(SQLModel, table=True):
         link_model=UserChatLinkInDB,
     )
 
+@event.listens_for(UserInDB, "before_insert")
+@event.listens_for(UserInDB, "before_update")
+def _normalize_username(mapper, connection, user: UserInDB):
+    user.username_lower = user.username.lower()
+
 class ChatInDB(SQLModel, table=True):
     """Database model for chat."""
 
     __tablename__ = "chats"
+    __table_args__ = (Index("ix_chats_name_id", "name", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     owner_id: int = Field(foreign_key="users.id")
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    deleted_at: Optional[datetime] = None
+    retention_days: Optional[int] = None  # None follows MESSAGE_RETENTION_DAYS, 0 keeps forever
 
     owner: UserInDB = Relationship()
     users: list[UserInDB] = Relationship(
@@ -50,6 +63,11 @@ class MessageInDB(SQLModel, table=True):
     """Database model for message."""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_created_at", "chat_id", "created_at"),
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        Index("ix_messages_user_id", "user_id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     text: str
@@ -60,10 +78,191 @@ class MessageInDB(SQLModel, table=True):
     user: UserInDB = Relationship()
     chat: ChatInDB = Relationship(back_populates="messages")
 
+class MessageArchiveBlockInDB(SQLModel, table=True):
+    """Database model for a compressed block of archived messages of one chat."""
+
+    __tablename__ = "message_archive_blocks"
+    __table_args__ = (
+        Index("ix_message_archive_blocks_chat_id_first_message_id", "chat_id", "first_message_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chat_id: int = Field(foreign_key="chats.id")
+    first_message_id: int
+    last_message_id: int
+    message_count: int
+    payload: bytes
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+class AttachmentInDB(SQLModel, table=True):
+    """Database model for an uploaded file, addressed by the SHA-256 of its content."""
+
+    __tablename__ = "attachments"
+
+    id: str = Field(primary_key=True)
+    size: int
+    content_type: str
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+class MessageAttachmentLinkInDB(SQLModel, table=True):
+    """Database model for many-to-many relation of messages to attachments."""
+
+    __tablename__ = "message_attachments"
+    __table_args__ = (
+        Index("ix_message_attachments_chat_id", "chat_id"),
+    )
+
+    message_id: int = Field(primary_key=True)
+    attachment_id: str = Field(foreign_key="attachments.id", primary_key=True)
+    chat_id: int = Field(foreign_key="chats.id")
+    filename: str
+
+class MentionInDB(SQLModel, table=True):
+    """Database model for an @-mention of a user in a message."""
+
+    __tablename__ = "mentions"
+    __table_args__ = (
+        Index("ix_mentions_user_id_id", "user_id", "id"),
+        Index("ix_mentions_message_id", "message_id"),
+        Index("ix_mentions_chat_id", "chat_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="users.id")
+    message_id: int
+    chat_id: int = Field(foreign_key="chats.id")
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+class ChatActivityInDB(SQLModel, table=True):
+    """Database model for the number of messages posted to a chat in one hour or day."""
+
+    __tablename__ = "chat_activity"
+
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    period: str = Field(primary_key=True)  # "hour" or "day"
+    bucket: datetime = Field(primary_key=True)  # start of the hour or day
+    message_count: int = 0
+
+class ChatPosterInDB(SQLModel, table=True):
+    """Database model for the number of messages a user has posted to a chat."""
+
+    __tablename__ = "chat_posters"
+    __table_args__ = (
+        Index("ix_chat_posters_chat_id_message_count", "chat_id", "message_count"),
+    )
+
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    message_count: int = 0
+
+class ChatShardInDB(SQLModel, table=True):
+    """Database model for the shard that holds the messages of a chat."""
+
+    __tablename__ = "chat_shards"
+
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    shard: int
+
+class MessageIdSequenceInDB(SQLModel, table=True):
+    """Database model that hands out globally unique message ids on a shard."""
+
+    __tablename__ = "message_id_sequence"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+class MessageOutboxInDB(SQLModel, table=True):
+    """Database model for the primary database's rows of a message on a shard, waiting to be relayed."""
+
+    __tablename__ = "message_outbox"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    message_id: int
+    chat_id: int
+    user_id: int
+    created_at: datetime
+    origin: str
+    payload: str = "{}"
+
+class OutboxProgressInDB(SQLModel, table=True):
+    """Database model for the last outbox entry of a shard relayed to the primary database."""
+
+    __tablename__ = "outbox_progress"
+
+    shard: int = Field(primary_key=True)
+    relayed_id: int = 0
+
+class ChangeInDB(SQLModel, table=True):
+    """Database model for an entry of the change feed that clients sync from."""
+
+    __tablename__ = "changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    op: str
+    entity_id: int
+    chat_id: Optional[int] = None
+    user_id: Optional[int] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+class RefreshTokenInDB(SQLModel, table=True):
+    """Database model for a refresh token, stored as an HMAC of the token."""
+
+    __tablename__ = "refresh_tokens"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    token_hash: str = Field(unique=True)
+    family: str = Field(index=True)
+    user_id: int = Field(foreign_key="users.id", index=True)
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    expires_at: datetime
+    revoked_at: Optional[datetime] = None
+
+class EventInDB(SQLModel, table=True):
+    """Database model for a change notification shared between worker processes."""
+
+    __tablename__ = "events"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    key: Optional[str] = None
+    origin: str
+    created_at: Optional[datetime] = Field(default_factory=datetime.now, index=True)
+
+class JobInDB(SQLModel, table=True):
+    """Database model for a queued or finished background job."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: str = "{}"
+    status: str = "queued"
+    attempts: int = 0
+    max_attempts: int = 3
+    progress: int = 0
+    total: Optional[int] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    worker: Optional[str] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    run_after: Optional[datetime] = Field(default_factory=datetime.now)
+    heartbeat_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 class Metadata(BaseModel):
     """Represents metadata for a collection."""
     count: int
 
+class PageMetadata(Metadata):
+    """Represents metadata for one page of a collection."""
+    next_cursor: Optional[str] = None
+
 class ChatMetadata(BaseModel):
     """Represents metadata for a chat collection."""
     message_count: int
@@ -80,12 +279,50 @@ class UserResponse(BaseModel):
     """Represents an API response for a User"""
     user: UserResponseModel
 
+class AttachmentResponseModel(BaseModel):
+    """Represents a response model for an Attachment"""
+    id: str
+    filename: str
+    content_type: str
+    size: int
+
+class AttachmentResponse(BaseModel):
+    """Represents an API response for an Attachment"""
+    attachment: AttachmentResponseModel
+
 class MessageResponseModel(BaseModel):
     id: int
     chat_id: int
     text: str
     user: UserResponseModel
     created_at: datetime
+    attachments: list[AttachmentResponseModel] = []
+
+class ActivityBucket(BaseModel):
+    bucket: datetime
+    message_count: int
+
+class PosterCount(BaseModel):
+    user: UserResponseModel
+    message_count: int
+
+class ChatStatsResponse(BaseModel):
+    """Represents an API response for the activity statistics of a Chat."""
+    chat_id: int
+    period: str
+    message_count: int
+    activity: list[ActivityBucket]
+    top_posters: list[PosterCount]
+
+class MentionResponseModel(BaseModel):
+    id: int
+    created_at: datetime
+    message: MessageResponseModel
+
+class MentionCollection(BaseModel):
+    """Represents an API response for a page of a User's Mentions, newest first."""
+    meta: PageMetadata
+    mentions: list[MentionResponseModel]
 
 class MessageResponse(BaseModel):
     """Represents an API response for a Message"""
@@ -107,6 +344,26 @@ class ChatResponse(BaseModel):
 class SingleChatResponse(BaseModel):
     chat: ChatResponseModel
     
+class BootstrapResponse(BaseModel):
+    """Represents everything a client needs to render its first screen."""
+    user: UserResponseModel
+    chats: list[ChatResponseModel]
+    messages: Optional[list[MessageResponseModel]] = None
+
+class ChangeModel(BaseModel):
+    """Represents one entry of the change feed."""
+    seq: int
+    kind: str
+    op: str
+    id: int
+    chat_id: Optional[int] = None
+
+class SyncResponse(BaseModel):
+    """Represents the changes visible to a user since a sequence number."""
+    changes: list[ChangeModel]
+    next: int
+    has_more: bool
+
 class UserUpdate(BaseModel):
     """Represents parameters for updating an User in the system."""
     username: Optional[str] = None
@@ -116,21 +373,86 @@ class ChatUpdate(BaseModel):
     """Represents parameters for updating an Chat in the system."""
     name: str
 
+class RetentionPolicy(BaseModel):
+    """Represents the message retention of a Chat; None follows the global default and 0 keeps forever."""
+    days: Optional[int] = Field(default=None, ge=0)
+
+class RetentionResponse(BaseModel):
+    """Represents an API response for the retention policy of a Chat."""
+    chat_id: int
+    days: Optional[int]
+    effective_days: Optional[int]
+
 class ChatCollection(BaseModel): 
     """Represents an API response for a collection of Chats."""
-    meta: Metadata
+    meta: PageMetadata
     chats: list[ChatResponseModel]
 
 class UserCollection(BaseModel): 
     """Represents an API response for a collection of Users."""
-    meta: Metadata
+    meta: PageMetadata
     users: list[UserResponseModel]
+    missing: Optional[list[int]] = None
 
 class MessageCollection(BaseModel): 
     """Represents an API response for a collection of Messages."""
     meta: Metadata
     messages: list[MessageResponseModel]
 
+class AttachmentReference(BaseModel):
+    """Represents an uploaded Attachment to be linked to a new Message."""
+    id: str
+    filename: str
+
 class CreateMessage(BaseModel):
     text: str
+    attachments: list[AttachmentReference] = []
+
+
+class ProvisionResult(BaseModel):
+    """Represents the outcome of one row of a bulk user provisioning request."""
+    index: int
+    user: Optional[UserResponseModel] = None
+    error: Optional[dict[str, str]] = None
+
+class ProvisionMetadata(BaseModel):
+    """Represents metadata for a bulk user provisioning request."""
+    created: int
+    failed: int
+
+class ProvisionResponse(BaseModel):
+    """Represents an API response for a bulk user provisioning request."""
+    meta: ProvisionMetadata
+    results: list[ProvisionResult]
 
+class EnqueueJob(BaseModel):
+    """Represents parameters for enqueueing a background Job."""
+    kind: str
+    payload: dict[str, Any] = {}
+    max_attempts: int = 3
+
+class JobResponseModel(BaseModel):
+    """Represents a response model for a background Job."""
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    status: str
+    attempts: int
+    max_attempts: int
+    progress: int
+    total: Optional[int] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: datetime
+    run_after: datetime
+    finished_at: Optional[datetime] = None
+
+class JobResponse(BaseModel):
+    """Represents an API response for a background Job."""
+    job: JobResponseModel
+
+class JobCollection(BaseModel):
+    """Represents an API response for a collection of background Jobs."""
+    meta: Metadata
+    jobs: list[JobResponseModel]
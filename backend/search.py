@@ -0,0 +1,144 @@
+import bisect
+import os
+import sys
+import threading
+import weakref
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from backend import events
+from backend.schema import UserInDB, UserResponseModel
+
+max_search_results = 50
+prefix_index_enabled = os.environ.get("USERNAME_PREFIX_INDEX", default="1") == "1"
+
+
+def prefix_range(prefix: str) -> tuple[str, Optional[str]]:
+    """
+    Turns a prefix into the half-open range of strings that start with it.
+
+    :return: the lower bound and the exclusive upper bound, if there is one
+    """
+    key = prefix.lower()
+    last = ord(key[-1])
+    if last == sys.maxunicode:
+        return key, None
+    return key, key[:-1] + chr(last + 1)
+
+
+def search_usernames(session: Session, prefix: str, limit: int) -> list[UserResponseModel]:
+    """
+    Finds users whose username starts with ``prefix``, ignoring case.
+
+    Runs as a range scan on the ``username_lower`` index.
+
+    :param limit: maximum number of users to return
+    :return: the users ordered by lowercase username
+    """
+    lower, upper = prefix_range(prefix)
+    statement = select(UserInDB).where(UserInDB.username_lower >= lower)
+    if upper is not None:
+        statement = statement.where(UserInDB.username_lower < upper)
+    users = session.exec(statement.order_by(UserInDB.username_lower).limit(limit)).all()
+    return [_to_response(user) for user in users]
+
+
+class UsernameIndex:
+    """
+    Sorted in-memory copy of the lowercase usernames of one database.
+
+    Lookups are a binary search plus a slice, fast enough for autocomplete on
+    every keystroke. The index is loaded on first use; user events mark single
+    users for reloading, which happens on the next lookup, so a rename shows
+    up as soon as its event arrives.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._keys: list[tuple[str, int]] = []
+        self._users: list[UserResponseModel] = []
+        self._key_of: dict[int, tuple[str, int]] = {}
+        self._dirty: set[int] = set()
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Marks one user, or with no id the whole index, for reloading."""
+        with self._lock:
+            if user_id is None:
+                self._loaded = False
+            else:
+                self._dirty.add(user_id)
+
+    def search(self, session: Session, prefix: str, limit: int) -> list[UserResponseModel]:
+        """Same as ``search_usernames``, served from memory."""
+        key = prefix.lower()
+        with self._lock:
+            self._catch_up(session)
+            start = bisect.bisect_left(self._keys, (key,))
+            results = []
+            for position in range(start, min(start + limit, len(self._keys))):
+                if not self._keys[position][0].startswith(key):
+                    break
+                results.append(self._users[position])
+            return results
+
+    def _catch_up(self, session: Session):
+        if not self._loaded:
+            users = session.exec(select(UserInDB).order_by(UserInDB.username_lower, UserInDB.id)).all()
+            self._keys = [(user.username_lower, user.id) for user in users]
+            self._users = [_to_response(user) for user in users]
+            self._key_of = {user.id: key for user, key in zip(users, self._keys)}
+            self._dirty.clear()
+            self._loaded = True
+            return
+        if not self._dirty:
+            return
+        users = session.exec(select(UserInDB).where(UserInDB.id.in_(self._dirty))).all()
+        self._dirty.clear()
+        for user in users:
+            old_key = self._key_of.get(user.id)
+            if old_key is not None:
+                position = bisect.bisect_left(self._keys, old_key)
+                del self._keys[position]
+                del self._users[position]
+            key = (user.username_lower, user.id)
+            position = bisect.bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._users.insert(position, _to_response(user))
+            self._key_of[user.id] = key
+
+
+_indexes: "weakref.WeakKeyDictionary[object, UsernameIndex]" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def search_users(session: Session, prefix: str, limit: int) -> list[UserResponseModel]:
+    """
+    Finds users by username prefix, from the in-memory index if it is enabled.
+
+    :param limit: maximum number of users to return, at most ``max_search_results``
+    """
+    limit = min(limit, max_search_results)
+    if not prefix_index_enabled:
+        return search_usernames(session, prefix, limit)
+    with _indexes_lock:
+        index = _indexes.setdefault(session.get_bind(), UsernameIndex())
+    return index.search(session, prefix, limit)
+
+
+def _invalidate_indexes(topic: str, key: Optional[str]):
+    for index in list(_indexes.values()):
+        index.invalidate(None if key is None else int(key))
+
+
+events.bus.subscribe("user", _invalidate_indexes)
+
+
+def _to_response(user: UserInDB) -> UserResponseModel:
+    return UserResponseModel(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        created_at=user.created_at,
+    )
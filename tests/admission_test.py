@@ -0,0 +1,62 @@
+import asyncio
+
+from backend.admission import AdmissionController, AdmissionMiddleware, RouteClassLimiter
+
+
+def test_limiter_queues_then_sheds():
+    async def scenario():
+        limiter = RouteClassLimiter("writes", limit=1, queue_size=1, timeout=1.0)
+        assert await limiter.acquire()
+
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.snapshot()["queue_depth"] == 1
+
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await queued
+        limiter.release()
+        return limiter.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["active"] == 0
+    assert snapshot["admitted"] == 2
+    assert snapshot["shed"] == 1
+
+
+def test_limiter_expires_waiters():
+    async def scenario():
+        limiter = RouteClassLimiter("reads", limit=1, queue_size=4, timeout=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        limiter.release()
+        return limiter.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["expired"] == 1
+    assert snapshot["queue_depth"] == 0
+    assert snapshot["active"] == 0
+
+
+def test_middleware_sheds_with_retry_after():
+    limiter = RouteClassLimiter("reads", limit=0, queue_size=0, timeout=2.5)
+    controller = AdmissionController(auth=limiter, writes=limiter, reads=limiter)
+    messages = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("request should have been shed")
+
+    async def send(message):
+        messages.append(message)
+
+    middleware = AdmissionMiddleware(app, controller=controller)
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/chats", "headers": []}, None, send))
+
+    assert messages[0]["status"] == 503
+    assert (b"retry-after", b"3") in messages[0]["headers"]
+
+
+def test_get_admission_status(client, admin_headers):
+    response = client.get("/admin/admission", headers=admin_headers)
+    assert response.status_code == 200
+    assert set(response.json()) == {"auth", "writes", "reads"}
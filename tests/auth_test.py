@@ -0,0 +1,69 @@
+from backend import auth
+from backend.schema import UserInDB
+
+
+def _login(client):
+    response = client.post("/auth/token", data={"username": "dallas", "password": "password"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_refresh_rotates_token(client, user, monkeypatch):
+    tokens = _login(client)
+    assert tokens["refresh_expires_in"] == auth.refresh_token_duration
+
+    def no_bcrypt(*args, **kwargs):
+        raise AssertionError("refresh must not verify a password")
+    monkeypatch.setattr(auth.pwd_context, "verify", no_bcrypt)
+
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {refreshed['access_token']}"})
+    assert response.json()["user"]["username"] == "dallas"
+
+    # replaying the rotated token revokes the whole login
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+    assert response.json()["detail"]["error"] == "invalid_grant"
+    response = client.post("/auth/refresh", json={"refresh_token": refreshed["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_revoke_refresh_token(client, user):
+    tokens = _login(client)
+    other_login = _login(client)
+
+    response = client.post("/auth/revoke", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 204
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+    response = client.post("/auth/refresh", json={"refresh_token": other_login["refresh_token"]})
+    assert response.status_code == 200
+
+
+def test_refresh_fail(client):
+    response = client.post("/auth/refresh", json={"refresh_token": "made-up"})
+    assert response.status_code == 401
+    assert client.post("/auth/revoke", json={"refresh_token": "made-up"}).status_code == 204
+
+
+def test_registration_racing_a_duplicate(client, session, monkeypatch):
+    def hash_during_a_race(password):
+        # another worker registers the same username while this one hashes
+        session.add(UserInDB(username="ash", email="ash@other.email", hashed_password="x"))
+        session.commit()
+        return "x"
+    monkeypatch.setattr(auth.pwd_context, "hash", hash_during_a_race)
+
+    response = client.post("/auth/registration", json={
+        "username": "ash", "email": "ash@cool.email", "password": "password",
+    })
+    assert response.status_code == 422
+    assert response.json()["detail"] == {
+        "type": "duplicate_value",
+        "entity_name": "User",
+        "entity_field": "username",
+        "entity_value": "ash",
+    }
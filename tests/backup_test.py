@@ -0,0 +1,110 @@
+import os
+import sqlite3
+
+import pytest
+from sqlmodel import Session, SQLModel, select
+
+from backend import backup, jobs
+from backend import database as db
+from backend.schema import EventInDB, UserInDB
+
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    engine = db.get_engine(db_path=str(tmp_path / "pony_express.db"))
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([
+            UserInDB(username=f"user{n}", email=f"user{n}@cool.email", hashed_password="x" * 500)
+            for n in range(200)
+        ])
+        session.commit()
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(db, "shards", db.ShardRouter([engine]))
+    monkeypatch.setattr(backup, "backup_dir", str(tmp_path / "backups"))
+    yield engine
+    engine.dispose()
+
+
+def _usernames(path):
+    with sqlite3.connect(path) as connection:
+        return {row[0] for row in connection.execute("SELECT username FROM users")}
+
+
+def test_copy_steps_through_pages(live, tmp_path):
+    steps = []
+    stats = backup.backup_database(
+        live, str(tmp_path / "copy.db"), step_pages=2, pause=0, progress=lambda done, total: steps.append(done)
+    )
+    assert stats["steps"] > 1 and stats["restarts"] == 0
+    assert sum(steps) == stats["pages"]
+    assert len(_usernames(tmp_path / "copy.db")) == 200
+    assert not os.path.exists(tmp_path / "copy.db.partial")
+
+
+def test_copy_stays_consistent_while_written(live, tmp_path):
+    writer = sqlite3.connect(live.url.database)
+    written = []
+
+    def write(done, total):
+        name = f"late{len(written)}"
+        writer.execute(
+            "INSERT INTO users (username, username_lower, email, hashed_password, created_at) "
+            "VALUES (?, ?, ?, 'x', '2024-01-01')",
+            (name, name, f"{name}@cool.email"),
+        )
+        writer.commit()
+        written.append(name)
+
+    stats = backup.backup_database(live, str(tmp_path / "copy.db"), step_pages=2, pause=0, progress=write)
+    writer.close()
+    assert stats["restarts"] == backup.max_restarts + 1
+    with sqlite3.connect(tmp_path / "copy.db") as connection:
+        assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    assert len(_usernames(tmp_path / "copy.db")) >= 200
+
+
+def test_backup_job_and_restore(client, session, live, admin_headers):
+    response = client.post("/admin/backups", headers=admin_headers)
+    assert response.status_code == 202
+    jobs.runner.run_once(session.get_bind())
+    job = client.get(f"/admin/jobs/{response.json()['job']['id']}", headers=admin_headers).json()["job"]
+    assert job["status"] == "succeeded"
+    (path,) = job["result"]
+
+    with Session(live) as live_session:
+        live_session.add(UserInDB(username="after", email="after@cool.email", hashed_password="x"))
+        for _ in range(3):
+            live_session.add(EventInDB(topic="user", origin="elsewhere"))
+        live_session.commit()
+        last_event_id = live_session.scalar(select(EventInDB.id).order_by(EventInDB.id.desc()))
+
+    backup.restore_all([path], step_pages=2)
+    assert "after" not in _usernames(live.url.database)
+    assert len(_usernames(live.url.database)) == 200
+    with Session(live) as live_session:
+        topics = live_session.exec(select(EventInDB.topic).where(EventInDB.id > last_event_id)).all()
+    assert sorted(topics) == sorted(backup.RESTORED_TOPICS)
+
+
+def test_old_backups_are_pruned(live, tmp_path, monkeypatch):
+    backups = tmp_path / "backups"
+    for name in ("20240101-000000", "20240102-000000", "20240103-000000", "notes"):
+        (backups / name).mkdir(parents=True)
+
+    removed = backup.prune_backups(str(backups), keep=2)
+    assert [os.path.basename(path) for path in removed] == ["20240101-000000"]
+
+    monkeypatch.setattr(backup, "backup_keep", 2)
+    (path,) = backup.backup_all(str(backups), step_pages=2, pause=0)
+    new_backup = os.path.basename(os.path.dirname(path))
+    assert sorted(os.listdir(backups)) == sorted(["20240103-000000", new_backup, "notes"])
+
+
+def test_backup_route_refuses_to_block_writers(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(db, "journal_mode", "DELETE")
+    response = client.post("/admin/backups", headers=admin_headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["type"] == "backup_blocks_writers"
+    assert client.post("/admin/backups", params={"allow_blocking": True}, headers=admin_headers).status_code == 202
+    assert client.post("/admin/backups", headers={}).status_code == 401
@@ -1,5 +1,16 @@
+import hashlib
+import json
+from datetime import datetime
+
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, func, select
+
+from backend import archive, attachments, jobs, rebalance
+from backend import database as db
 from backend.main import app
+from backend.schema import ChatInDB, JobInDB, MessageIdSequenceInDB, MessageInDB, UserChatLinkInDB, UserInDB
 
 def test_get_all_chats():
     client = TestClient(app)
@@ -136,4 +147,267 @@ def test_get_chat_users_fail():
             "entity_name": "Chat",
             "entity_id": "1"
         }
-    }
\ No newline at end of file
+    }
+
+def test_export_chat_messages(client, session, create_chat):
+    chat = create_chat(message_count=5)
+    response = client.get(f"/chats/{chat.id}/messages/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    messages = [json.loads(line) for line in response.text.splitlines()]
+    assert [message["text"] for message in messages] == [f"message {i}" for i in range(5)]
+    assert all(message["user"]["username"] == "ripley" for message in messages)
+
+def test_export_chat_messages_gzip(client, session, create_chat):
+    chat = create_chat(message_count=3)
+    response = client.get(f"/chats/{chat.id}/messages/export", params={"compress": True})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 3
+
+def test_export_chat_messages_fail(client):
+    response = client.get("/chats/1/messages/export")
+    assert response.status_code == 404
+    assert response.json()["detail"]["entity_name"] == "Chat"
+
+def test_get_chat_messages_stitches_archive(client, session, create_chat):
+    chat = create_chat(message_count=10)
+    expected = client.get(f"/chats/{chat.id}/messages").json()["messages"]
+
+    cutoff = expected[6]["created_at"]
+    archived = archive.archive_chat(session, chat.id, datetime.fromisoformat(cutoff), block_size=4)
+    assert archived == 6
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 4
+
+    response = client.get(f"/chats/{chat.id}/messages")
+    assert response.json()["messages"] == expected
+
+    response = client.get(f"/chats/{chat.id}/messages", params={"limit": 3, "before": expected[5]["id"]})
+    assert response.json()["messages"] == expected[2:5]
+
+    response = client.get(f"/chats/{chat.id}/messages", params={"limit": 5})
+    assert response.json()["messages"] == expected[5:]
+
+    response = client.get(f"/chats/{chat.id}")
+    assert response.json()["meta"]["message_count"] == 10
+
+    response = client.get(f"/chats/{chat.id}/messages/export")
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+def test_get_chats_paginated(client, session):
+    owner = UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x")
+    session.add_all([ChatInDB(name=name, owner=owner) for name in ["b", "a", "c", "a"]])
+    session.commit()
+
+    response = client.get("/chats", params={"limit": 3})
+    assert response.json()["meta"]["count"] == 4
+    first = response.json()["chats"]
+    cursor = response.json()["meta"]["next_cursor"]
+    response = client.get("/chats", params={"limit": 3, "cursor": cursor})
+    assert "next_cursor" not in response.json()["meta"]
+    chats = first + response.json()["chats"]
+    assert [chat["name"] for chat in chats] == ["a", "a", "b", "c"]
+    assert chats[0]["id"] < chats[1]["id"]
+
+def test_delete_chat_purges_messages(client, session, monkeypatch, create_chat):
+    monkeypatch.setattr(db, "delete_batch_size", 4)
+    chat = create_chat(message_count=10)
+    archive.archive_chat(session, chat.id, datetime.now(), block_size=4)
+    db.create_message(chat.id, "last words", session, chat.owner)
+
+    chat_id = chat.id
+    response = client.delete(f"/chats/{chat_id}")
+    assert response.status_code == 204
+    session.expire_all()
+    assert session.get(ChatInDB, chat_id) is None
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 0
+    assert session.exec(select(func.count(UserChatLinkInDB.user_id))).one() == 0
+    assert client.get(f"/chats/{chat_id}").status_code == 404
+    assert session.exec(select(JobInDB)).all() == []
+
+def test_failed_inline_purge_is_left_to_a_job(client, session, monkeypatch, create_chat):
+    monkeypatch.setattr(jobs, "throttle", 0)
+    chat_id = create_chat(message_count=3).id
+    def locked(chat_id, session):
+        raise OperationalError("DELETE FROM messages", {}, Exception("database is locked"))
+    monkeypatch.setattr(db, "purge_chat", locked)
+
+    assert client.delete(f"/chats/{chat_id}").status_code == 204
+    assert client.get(f"/chats/{chat_id}").status_code == 404
+    monkeypatch.undo()
+    job = session.exec(select(JobInDB)).one()
+    assert job.kind == "purge_chat"
+
+    assert jobs.JobRunner().run_once(session.get_bind()) == job.id
+    session.expire_all()
+    assert session.get(ChatInDB, chat_id) is None
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 0
+
+def test_delete_large_chat_in_background(client, session, admin_headers, monkeypatch, create_chat):
+    monkeypatch.setattr(db, "inline_delete_limit", 2)
+    monkeypatch.setattr(db, "delete_batch_size", 2)
+    monkeypatch.setattr(jobs, "throttle", 0)
+    chat_id = create_chat(message_count=5).id
+
+    assert client.delete(f"/chats/{chat_id}").status_code == 204
+    assert client.get(f"/chats/{chat_id}").status_code == 404
+    assert chat_id not in [chat["id"] for chat in client.get("/chats").json()["chats"]]
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 5
+
+    job = client.get("/admin/jobs", headers=admin_headers).json()["jobs"][0]
+    assert (job["kind"], job["payload"]) == ("purge_chat", {"chat_id": chat_id})
+    assert jobs.JobRunner().run_once(session.get_bind()) == job["id"]
+
+    session.expire_all()
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 0
+    assert session.get(ChatInDB, chat_id) is None
+    job = client.get(f"/admin/jobs/{job['id']}", headers=admin_headers).json()["job"]
+    assert (job["status"], job["progress"], job["result"]) == ("succeeded", 6, {"deleted": 6})
+
+def test_sharded_chat_messages(client, session, shard_engine, create_chat):
+    chat = create_chat(message_count=3)
+    assert rebalance.move_chat(session, chat.id, 1) == 3
+    assert session.exec(select(func.count(MessageInDB.id))).one() == 0
+
+    message = db.create_message(chat.id, "hello shard", session, chat.owner)
+    assert message.id >= db.SHARD_ID_BASE
+    with Session(shard_engine) as shard_session:
+        assert shard_session.exec(select(func.count(MessageInDB.id))).one() == 4
+
+    response = client.get(f"/chats/{chat.id}/messages")
+    texts = [message["text"] for message in response.json()["messages"]]
+    assert texts == ["message 0", "message 1", "message 2", "hello shard"]
+
+    assert rebalance.move_chat(session, chat.id, 0) == 4
+    response = client.get(f"/chats/{chat.id}/messages")
+    assert [message["text"] for message in response.json()["messages"]] == texts
+    assert [status["messages"] for status in rebalance.shard_status(session)] == [4, 0]
+
+def test_move_chat_frees_the_source_writer_between_batches(tmp_path, monkeypatch):
+    primary = db.get_engine(db_path=str(tmp_path / "primary.db"))
+    shard = db.get_engine(db_path=str(tmp_path / "shard1.db"))
+    SQLModel.metadata.create_all(primary)
+    SQLModel.metadata.create_all(shard, tables=db.SHARDED_TABLES)
+    monkeypatch.setattr(db, "shards", db.ShardRouter([primary, shard]))
+    with Session(primary) as session:
+        owner = UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x")
+        chat = ChatInDB(name="nostromo", owner=owner, users=[owner])
+        session.add(chat)
+        session.commit()
+        session.add_all([MessageInDB(text=f"message {i}", user_id=owner.id, chat_id=chat.id) for i in range(6)])
+        session.commit()
+        chat_id = chat.id
+
+    held = []
+    insert_messages = rebalance._insert_messages
+    def record_held(target_session, rows):
+        held.append(primary.pool.checkedout())
+        insert_messages(target_session, rows)
+    monkeypatch.setattr(rebalance, "_insert_messages", record_held)
+
+    with Session(primary) as session:
+        assert rebalance.move_chat(session, chat_id, 1, batch_size=2) == 6
+    assert held == [0, 0, 0]
+    primary.dispose()
+    shard.dispose()
+
+def test_sharded_message_ids_grow_across_moves(client, session, shard_engine, create_chat, monkeypatch):
+    monkeypatch.setattr(db.shards, "clock", lambda: 0)  # only the moves keep the ids growing
+    chat = create_chat(message_count=0)
+    rebalance.move_chat(session, chat.id, 1)
+    for n in range(3):
+        db.create_message(chat.id, f"old {n}", session, chat.owner)
+    rebalance.move_chat(session, chat.id, 0)
+    newest = db.create_message(chat.id, "newest", session, chat.owner)
+
+    response = client.get(f"/chats/{chat.id}/messages", params={"limit": 1})
+    assert [message["text"] for message in response.json()["messages"]] == ["newest"]
+    assert newest.id % db.MAX_SHARDS == 0
+
+def test_seed_message_ids_moves_each_shard_past_its_messages(session, shard_engine, monkeypatch):
+    monkeypatch.setattr(db.shards, "clock", lambda: 0)
+    with Session(shard_engine) as shard_session:
+        shard_session.add(MessageIdSequenceInDB(id=50))
+        shard_session.commit()
+        db.shards.seed_message_ids()
+        assert db.shards.allocate_message_id(1, shard_session) == db.SHARD_ID_BASE + 51 * db.MAX_SHARDS + 1
+        shard_session.commit()
+
+        shard_session.add(MessageInDB(id=db.SHARD_ID_BASE + 70 * db.MAX_SHARDS + 1, text="restored", user_id=1, chat_id=1))
+        shard_session.commit()
+        db.shards.seed_message_ids()
+        assert db.shards.allocate_message_id(1, shard_session) == db.SHARD_ID_BASE + 71 * db.MAX_SHARDS + 1
+
+def test_message_ids_follow_the_clock(session, shard_engine, monkeypatch):
+    monkeypatch.setattr(db.shards, "clock", lambda: 2.5)
+    with Session(shard_engine) as shard_session:
+        assert db.shards.allocate_message_id(1, shard_session) == db.SHARD_ID_BASE + 2500 * db.MAX_SHARDS + 1
+        # never backwards, not even when the clock is
+        monkeypatch.setattr(db.shards, "clock", lambda: 1)
+        assert db.shards.allocate_message_id(1, shard_session) == db.SHARD_ID_BASE + 2501 * db.MAX_SHARDS + 1
+        assert shard_session.exec(select(MessageIdSequenceInDB.id)).all() == [2501]
+
+def test_message_attachments(client, session, user, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "attachment_dir", str(tmp_path))
+    chat = ChatInDB(name="nostromo", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+    content = bytes(range(256)) * 1000
+
+    response = client.post(f"/chats/{chat.id}/attachments", params={"filename": "scan.bin"},
+                           content=content, headers={**auth_headers, "Content-Type": "image/png"})
+    assert response.status_code == 201
+    attachment = response.json()["attachment"]
+    assert attachment["id"] == hashlib.sha256(content).hexdigest()
+    assert attachment["size"] == len(content)
+
+    response = client.post(f"/chats/{chat.id}/attachments", content=content, headers=auth_headers)
+    assert response.json()["attachment"]["id"] == attachment["id"]
+    response = client.post(f"/chats/{chat.id}/attachments", content=b"",
+                           headers={**auth_headers, "X-Content-SHA256": attachment["id"]})
+    assert response.json()["attachment"]["size"] == len(content)
+    assert len(list(tmp_path.rglob("*"))) == 2
+
+    response = client.post(f"/chats/{chat.id}/messages", headers=auth_headers, json={
+        "text": "see attached",
+        "attachments": [{"id": attachment["id"], "filename": "scan.png"}],
+    })
+    assert response.status_code == 201
+    assert response.json()["message"]["attachments"][0]["filename"] == "scan.png"
+    response = client.get(f"/chats/{chat.id}/messages")
+    assert response.json()["messages"][0]["attachments"][0]["content_type"] == "image/png"
+
+    response = client.get(f"/attachments/{attachment['id']}")
+    assert response.status_code == 200
+    assert response.content == content
+    response = client.get(f"/attachments/{attachment['id']}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(content)}"
+    assert response.content == content[100:200]
+    response = client.get(f"/attachments/{attachment['id']}", headers={"Range": "bytes=-10"})
+    assert response.content == content[-10:]
+    response = client.get(f"/attachments/{attachment['id']}", headers={"Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+
+    monkeypatch.setattr(attachments, "accel_prefix", "/protected-attachments/")
+    response = client.get(f"/attachments/{attachment['id']}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == f"/protected-attachments/{attachment['id'][:2]}/{attachment['id']}"
+    assert response.headers["content-type"] == "image/png"
+
+def test_message_attachments_fail(client, session, user, auth_headers):
+    chat = ChatInDB(name="nostromo", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+
+    response = client.post(f"/chats/{chat.id}/messages", headers=auth_headers, json={
+        "text": "see attached",
+        "attachments": [{"id": "missing", "filename": "scan.png"}],
+    })
+    assert response.status_code == 404
+    assert response.json()["detail"]["entity_name"] == "Attachment"
+
+    response = client.get("/attachments/missing")
+    assert response.status_code == 404
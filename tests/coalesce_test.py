@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from sqlmodel import Session
+
+from backend import coalesce, events
+from backend.coalesce import SingleFlight, coalesced
+
+
+def test_concurrent_calls_share_one_computation():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return ["result"]
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("key", compute)))
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    while flights.snapshot()["joined"] < 3:
+        pass
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(result is results[0] for result in results)
+    assert flights.snapshot() == {"in_flight": 0, "led": 1, "joined": 3}
+
+
+def test_finished_computations_are_not_reused():
+    flights = SingleFlight()
+    assert flights.do("key", lambda: 1) == 1
+    assert flights.do("key", lambda: 2) == 2
+
+
+def test_errors_reach_every_caller():
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do("key", fail)
+    assert flights.snapshot()["in_flight"] == 0
+
+
+@pytest.fixture
+def flights(monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(coalesce, "flights", flights)
+    return flights
+
+
+def test_coalesced_keys_on_arguments_and_generation(session, flights, monkeypatch):
+    seen_keys = []
+    monkeypatch.setattr(flights, "do", lambda key, compute: seen_keys.append(key) or compute())
+
+    @coalesced
+    def read(chat_id, session, limit=None):
+        return chat_id, limit
+
+    read_session = Session(session.get_bind(), info={"read_only": True})
+    assert read("1", read_session) == ("1", None)
+    assert read("1", session=read_session, limit=None) == ("1", None)
+    events.bus.dispatch("message", "1")
+    read("1", read_session)
+    read("1", read_session, 10)
+
+    assert seen_keys[0] == seen_keys[1]
+    assert seen_keys[2] != seen_keys[0]
+    assert seen_keys[3] != seen_keys[2]
+
+
+def test_writer_sessions_are_not_coalesced(session, flights):
+    @coalesced
+    def read(session):
+        return "fresh"
+
+    assert read(session) == "fresh"
+    assert flights.snapshot()["led"] == 0
@@ -1,9 +1,37 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, StaticPool, create_engine
+from sqlmodel import Session, SQLModel, StaticPool, create_engine, select
+
+# tests without the session override go through the app's own engines; point
+# them at a copy of the shipped database before backend.database creates them,
+# so test runs never write to backend/pony_express.db
+db_dir = tempfile.mkdtemp(prefix="pony-tests-")
+shutil.copyfile(
+    os.path.join(os.path.dirname(__file__), os.pardir, "backend", "pony_express.db"),
+    os.path.join(db_dir, "pony_express.db"),
+)
+os.environ["DB_DIR"] = db_dir
+os.environ.pop("DB_LOCATION", None)
 
 from backend.main import app
+from backend import auth
 from backend import database as db
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    # migrated like the server does on startup
+    db.create_db_and_tables()
+    yield
+    for shard_engine in db.shards.engines + db.shards.read_engines:
+        shard_engine.dispose()
+    shutil.rmtree(db_dir, ignore_errors=True)
 
 
 @pytest.fixture
@@ -27,4 +55,72 @@ def client(session):
 
     yield TestClient(app)
 
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+@pytest.fixture
+def user(session):
+    user = UserInDB(
+        username="dallas",
+        email="dallas@cool.email",
+        hashed_password=auth.pwd_context.hash("password"),
+    )
+    session.add(user)
+    session.commit()
+    return user
+
+
+@pytest.fixture
+def auth_headers(client, user):
+    response = client.post("/auth/token", data={"username": "dallas", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def admin_headers(auth_headers, user, monkeypatch):
+    monkeypatch.setattr(auth, "admin_usernames", {user.username})
+    return auth_headers
+
+
+@pytest.fixture
+def create_chat(session):
+    """
+    Factory for chats with messages by their owner.
+
+    The owner defaults to "ripley", who is created by the first chat.
+    ``message_count`` messages are texted "message <n>"; one message is added
+    per entry of ``ages``, created that many days ago.
+    """
+    def create(name="nostromo", owner=None, members=(), message_count=0, ages=(), retention_days=None):
+        if owner is None:
+            owner = session.exec(select(UserInDB).where(UserInDB.username == "ripley")).first()
+        if owner is None:
+            owner = UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x")
+        chat = ChatInDB(name=name, owner=owner, users=[owner, *members], retention_days=retention_days)
+        session.add(chat)
+        session.commit()
+        now = datetime.now()
+        session.add_all([
+            MessageInDB(text=f"message {i}", user_id=owner.id, chat_id=chat.id)
+            for i in range(message_count)
+        ])
+        session.add_all([
+            MessageInDB(text=f"{age} days old", user_id=owner.id, chat_id=chat.id, created_at=now - timedelta(days=age))
+            for age in ages
+        ])
+        session.commit()
+        return chat
+
+    return create
+
+
+@pytest.fixture
+def shard_engine(session, monkeypatch):
+    """A second, in-memory shard next to the primary of ``session``."""
+    shard_engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(shard_engine, tables=db.SHARDED_TABLES)
+    monkeypatch.setattr(db, "shards", db.ShardRouter([session.get_bind(), shard_engine]))
+    return shard_engine
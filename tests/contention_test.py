@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import contention
+from backend.schema import UserInDB
+
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    monitor = contention.ContentionMonitor()
+    monkeypatch.setattr(contention, "monitor", monitor)
+    db_path = str(tmp_path / "contention.db")
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False, "timeout": 0.05},
+        poolclass=contention.TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+    )
+    SQLModel.metadata.create_all(engine)
+    monitor.instrument(engine)
+    yield monitor, engine, db_path
+    engine.dispose()
+
+
+def test_records_writer_and_lock_waits(monitor):
+    monitor, engine, _ = monitor
+    with Session(engine) as session:
+        session.add(UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x"))
+        session.commit()
+        session.add(UserInDB(username="ash", email="ash@cool.email", hashed_password="x"))
+        session.commit()
+
+    snapshot = monitor.snapshot()
+    assert snapshot["writer_wait"]["count"] >= 1
+    assert snapshot["lock_wait"]["count"] == 2
+    assert snapshot["locked_errors"] == 0
+
+
+def test_counts_locked_errors(monitor):
+    monitor, engine, db_path = monitor
+    other = sqlite3.connect(db_path)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        with Session(engine) as session:
+            session.add(UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x"))
+            with pytest.raises(OperationalError):
+                session.commit()
+    finally:
+        other.rollback()
+        other.close()
+
+    snapshot = monitor.snapshot()
+    assert snapshot["locked_errors"] == 1
+    assert snapshot["lock_wait"]["max_ms"] >= 40
+
+
+def test_dump_appends_samples(monitor, tmp_path):
+    monitor, _, _ = monitor
+    monitor.commit.record(0.002)
+    path = str(tmp_path / "contention.jsonl")
+    monitor.dump(path)
+    monitor.dump(path)
+    with open(path) as log:
+        lines = log.read().splitlines()
+    assert len(lines) == 2
+    assert '"commit": [0.002]' in lines[0]
+
+
+def test_summarize():
+    summary = contention.summarize([0.001 * n for n in range(1, 101)])
+    assert (summary["count"], summary["p50_ms"], summary["p99_ms"], summary["max_ms"]) == (100, 51.0, 100.0, 100.0)
+    assert contention.summarize([])["max_ms"] == 0.0
+
+
+def test_contention_route(client, admin_headers):
+    response = client.get("/admin/contention", headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["enabled"] is contention.contention_enabled
+    assert set(response.json()) >= {"writer_wait", "lock_wait", "commit", "locked_errors"}
@@ -0,0 +1,105 @@
+import tracemalloc
+
+import pytest
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlmodel import Session, SQLModel, select
+from starlette.requests import Request
+
+from backend import database as db
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "writer_timeout", 0.1)
+    db_path = str(tmp_path / "split.db")
+    writer = db.get_engine(db_path=db_path)
+    SQLModel.metadata.create_all(writer)
+    reader = db.get_read_engine(db_path=db_path)
+    yield writer, reader
+    reader.dispose()
+    writer.dispose()
+
+
+def _request(method: str) -> Request:
+    return Request({"type": "http", "method": method, "headers": []})
+
+
+def test_writer_uses_wal(engines):
+    writer, _ = engines
+    with writer.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+
+def test_reader_rejects_writes(engines):
+    writer, reader = engines
+    with Session(writer) as session:
+        session.add(UserInDB(username="reader", email="reader@cool.email", hashed_password="x"))
+        session.commit()
+
+    with Session(reader) as session:
+        assert session.exec(select(UserInDB.username)).all() == ["reader"]
+        session.add(UserInDB(username="writer", email="writer@cool.email", hashed_password="x"))
+        with pytest.raises(OperationalError):
+            session.commit()
+
+
+def test_reader_does_not_wait_for_writer(engines):
+    writer, reader = engines
+    with Session(writer) as write_session, Session(reader) as read_session:
+        write_session.add(UserInDB(username="pending", email="pending@cool.email", hashed_password="x"))
+        write_session.flush()
+        assert read_session.exec(select(UserInDB)).all() == []
+
+
+def test_writes_queue_for_the_single_writer(engines):
+    writer, _ = engines
+    with writer.connect():
+        with pytest.raises(TimeoutError):
+            with writer.connect():
+                pass
+    with writer.connect() as connection:
+        assert connection.exec_driver_sql("SELECT 1").scalar() == 1
+
+
+def test_get_session_picks_engine_by_method():
+    sessions = db.get_session(_request("GET"))
+    session = next(sessions)
+    assert session.get_bind() is db.read_engine
+    assert session.info["read_only"]
+    sessions.close()
+
+    sessions = db.get_session(_request("POST"))
+    session = next(sessions)
+    assert session.get_bind() is db.engine
+    sessions.close()
+
+
+def _memory_per_message(session, read, count):
+    session.expunge_all()
+    tracemalloc.start()
+    try:
+        result = read()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert len(result) == count
+    return size / count
+
+
+def test_message_reads_skip_orm_entities(session):
+    count = 2000
+    session.add(UserInDB(id=1, username="author", email="author@cool.email", hashed_password="x"))
+    session.add(ChatInDB(id=1, name="busy", owner_id=1))
+    session.add_all([MessageInDB(chat_id=1, user_id=1, text=f"message {n}") for n in range(count)])
+    session.commit()
+
+    entities = _memory_per_message(session, lambda: session.exec(select(MessageInDB)).all(), count)
+    rows = _memory_per_message(session, lambda: session.exec(select(*db.MESSAGE_COLUMNS)).all(), count)
+    responses = _memory_per_message(session, lambda: db.get_chat_messages(1, session), count)
+
+    assert rows < entities / 3
+    assert responses < entities / 1.5
+    messages = db.get_chat_messages(1, session, limit=2)
+    assert [message.text for message in messages] == ["message 1998", "message 1999"]
+    assert messages[0].user is messages[1].user
@@ -0,0 +1,60 @@
+import threading
+from datetime import timedelta
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import events
+from backend.events import EventBus
+
+
+def test_publish_dispatches_locally_on_commit(session):
+    bus = EventBus(origin="worker-a")
+    received = []
+    bus.subscribe("chat", lambda topic, key: received.append((topic, key)))
+
+    bus.publish(session, "chat", 7)
+    assert received == []
+    session.commit()
+    assert received == [("chat", "7")]
+
+    bus.publish(session, "chat", 8)
+    session.rollback()
+    session.commit()
+    assert received == [("chat", "7")]
+
+
+def test_poller_delivers_events_from_other_workers(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    writer = EventBus(origin="worker-a")
+    reader = EventBus(origin="worker-b")
+    received = threading.Event()
+    reader.subscribe("user", lambda topic, key: key == "3" and received.set())
+
+    reader.start(engine)
+    try:
+        with Session(engine) as session:
+            writer.publish(session, "user", 3)
+            session.commit()
+        assert received.wait(timeout=5)
+    finally:
+        reader.stop()
+
+
+def test_pruned_event_ids_are_not_reused(session, monkeypatch):
+    writer = EventBus(origin="worker-a")
+    reader = EventBus(origin="worker-b")
+    received = []
+    reader.subscribe("chat", lambda topic, key: received.append(key))
+
+    for chat_id in range(5):
+        writer.publish(session, "chat", chat_id)
+        session.commit()
+    reader.poll_once(session)
+    monkeypatch.setattr(events, "event_retention", timedelta(0))
+    events._prune(session)
+
+    writer.publish(session, "chat", 5)
+    session.commit()
+    reader.poll_once(session)
+    assert received == ["0", "1", "2", "3", "4", "5"]
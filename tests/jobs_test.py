@@ -0,0 +1,129 @@
+import json
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import database as db
+from backend import db_seeder, jobs
+from backend.schema import ChatInDB, JobInDB
+
+
+def _counting_job(session, context, steps):
+    for _ in range(steps):
+        context.advance(1, steps)
+    return {"steps": steps}
+
+
+def _failing_job(session, context):
+    raise RuntimeError("boom")
+
+
+def _cancelled_job(session, context):
+    jobs.cancel(session, context.job_id)
+    context.advance()
+    return {"finished": True}
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    monkeypatch.setattr(jobs, "throttle", 0)
+    monkeypatch.setattr(jobs, "retry_delay", 0)
+    monkeypatch.setitem(jobs.HANDLERS, "count", "tests.jobs_test:_counting_job")
+    monkeypatch.setitem(jobs.HANDLERS, "fail", "tests.jobs_test:_failing_job")
+    monkeypatch.setitem(jobs.HANDLERS, "cancel_self", "tests.jobs_test:_cancelled_job")
+
+
+def test_enqueue_and_run_job(client, session, handlers, admin_headers):
+    response = client.post("/admin/jobs", json={"kind": "count", "payload": {"steps": 3}}, headers=admin_headers)
+    assert response.status_code == 202
+    job_id = response.json()["job"]["id"]
+    assert response.json()["job"]["status"] == "queued"
+
+    runner = jobs.JobRunner(origin="worker-a")
+    assert runner.run_once(session.get_bind()) == job_id
+    assert runner.run_once(session.get_bind()) is None
+
+    job = client.get(f"/admin/jobs/{job_id}", headers=admin_headers).json()["job"]
+    assert job["status"] == "succeeded"
+    assert (job["progress"], job["total"], job["attempts"]) == (3, 3, 1)
+    assert job["result"] == {"steps": 3}
+
+    response = client.get("/admin/jobs", params={"status": "succeeded"}, headers=admin_headers)
+    assert response.json()["meta"]["count"] == 1
+
+
+def test_failed_job_is_retried(session, handlers):
+    job = jobs.enqueue(session, "fail", max_attempts=2)
+    session.commit()
+    runner = jobs.JobRunner(origin="worker-a")
+
+    runner.run_once(session.get_bind())
+    session.refresh(job)
+    assert (job.status, job.attempts) == ("queued", 1)
+
+    runner.run_once(session.get_bind())
+    session.refresh(job)
+    assert (job.status, job.attempts) == ("failed", 2)
+    assert "boom" in job.error
+
+
+def test_cancel_job(client, session, handlers, admin_headers):
+    queued = jobs.enqueue(session, "count", {"steps": 1})
+    running = jobs.enqueue(session, "cancel_self")
+    session.commit()
+
+    response = client.post(f"/admin/jobs/{queued.id}/cancel", headers=admin_headers)
+    assert response.json()["job"]["status"] == "cancelled"
+
+    runner = jobs.JobRunner(origin="worker-a")
+    assert runner.run_once(session.get_bind()) == running.id
+    assert runner.run_once(session.get_bind()) is None
+    session.refresh(running)
+    assert running.status == "cancelled"
+    assert running.result is None
+
+
+def test_job_fail(client, session, admin_headers):
+    response = client.post("/admin/jobs", json={"kind": "no_such_job"}, headers=admin_headers)
+    assert response.status_code == 422
+    assert response.json()["detail"]["entity_field"] == "kind"
+
+    response = client.get("/admin/jobs/42", headers=admin_headers)
+    assert response.status_code == 404
+    assert session.get(JobInDB, 42) is None
+
+
+def test_admin_routes_require_an_admin(client, auth_headers):
+    assert client.get("/admin/jobs").status_code == 401
+    response = client.post("/admin/jobs", json={"kind": "seed_database"}, headers=auth_headers)
+    assert response.status_code == 403
+    assert response.json()["detail"]["type"] == "permission_denied"
+
+
+def test_purge_refuses_live_chats(session, user):
+    chat = ChatInDB(name="nostromo", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+
+    with pytest.raises(ValueError):
+        db.purge_chat(chat.id, session)
+    assert session.get(ChatInDB, chat.id) is not None
+
+
+def test_seed_job_reads_the_initial_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "throttle", 0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'seeded.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(db_seeder, "engine", engine)
+    with Session(engine) as session:
+        job = jobs.enqueue(session, "seed_database")
+        session.commit()
+        job_id = job.id
+
+    assert jobs.JobRunner().run_once(engine) == job_id
+    with Session(engine) as session:
+        job = session.get(JobInDB, job_id)
+        assert job.status == "succeeded", job.error
+        result = json.loads(job.result)
+    assert result["user_count"]["additions"] == result["user_count"]["local"] > 0
+    assert result["message_count"]["final"] == result["message_count"]["local"] > 0
@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import inspect
+from sqlmodel import Session, SQLModel, StaticPool, create_engine, select
+
+from backend.migrations import MIGRATIONS, migrate, migration_status
+from backend.schema import JobInDB
+
+def _legacy_engine():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with engine.connect() as connection:
+        for index in ("ix_messages_chat_id_created_at", "ix_messages_chat_id_id",
+                      "ix_messages_user_id", "ix_user_chat_links_chat_id"):
+            connection.exec_driver_sql(f"DROP INDEX {index}")
+        connection.commit()
+    return engine
+
+def test_migrate_adds_missing_indexes():
+    engine = _legacy_engine()
+    assert migrate(engine) == [migration.version for migration in MIGRATIONS]
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("messages")}
+    assert {"ix_messages_chat_id_created_at", "ix_messages_user_id"} <= indexes
+    indexes = {index["name"] for index in inspect(engine).get_indexes("user_chat_links")}
+    assert "ix_user_chat_links_chat_id" in indexes
+
+    assert migrate(engine) == []
+    assert all(status["applied_at"] is not None for status in migration_status(engine))
+
+def test_migrate_resumes_partial_migration():
+    engine = _legacy_engine()
+    with engine.connect() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE schema_migrations (version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "steps_done INTEGER NOT NULL DEFAULT 0, applied_at DATETIME)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO schema_migrations (version, name, steps_done) VALUES (1, 'partial', 1)"
+        )
+        connection.commit()
+
+    assert 1 in migrate(engine)
+    indexes = {index["name"] for index in inspect(engine).get_indexes("messages")}
+    assert "ix_messages_chat_id_id" in indexes
+    assert "ix_messages_chat_id_created_at" not in indexes
+
+def test_concurrent_workers_migrate_once(tmp_path):
+    path = tmp_path / "legacy.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        "CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, email VARCHAR NOT NULL, "
+        "hashed_password VARCHAR NOT NULL, created_at DATETIME, PRIMARY KEY (id), UNIQUE (email));"
+        "CREATE UNIQUE INDEX ix_users_username ON users (username);"
+        "CREATE TABLE chats (id INTEGER NOT NULL, name VARCHAR NOT NULL, owner_id INTEGER NOT NULL, "
+        "created_at DATETIME, PRIMARY KEY (id));"
+        "INSERT INTO users (username, email, hashed_password) VALUES ('Ripley', 'ripley@cool.email', 'x');"
+    )
+    connection.close()
+    workers = 4
+    barrier = threading.Barrier(workers)
+
+    def start_worker(_):
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        barrier.wait()
+        return migrate(engine, SQLModel.metadata.create_all)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(start_worker, range(workers)))
+
+    applied = [version for result in results for version in result]
+    assert sorted(applied) == [migration.version for migration in MIGRATIONS]
+    engine = create_engine(f"sqlite:///{path}")
+    columns = {column["name"] for column in inspect(engine).get_columns("chats")}
+    assert {"deleted_at", "retention_days"} <= columns
+    assert "message_archive_blocks" in inspect(engine).get_table_names()
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT username_lower FROM users").scalar() == "ripley"
+
+def test_migrate_queues_rollup_backfill_for_existing_chats():
+    engine = _legacy_engine()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("INSERT INTO users (username, email, hashed_password) VALUES ('ripley', 'r@x', 'x')")
+        connection.exec_driver_sql("INSERT INTO chats (name, owner_id) VALUES ('nostromo', 1)")
+        connection.commit()
+    migrate(engine)
+    migrate(engine)
+
+    with Session(engine) as session:
+        queued = session.exec(select(JobInDB)).all()
+    assert [(job.kind, job.status) for job in queued] == [("backfill_rollups", "queued")]
+
+def test_migrate_queues_nothing_without_chats():
+    engine = _legacy_engine()
+    migrate(engine)
+
+    with Session(engine) as session:
+        assert session.exec(select(JobInDB)).all() == []
+
+def test_migrate_rebuilds_events_with_autoincrement():
+    engine = _legacy_engine()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("DROP TABLE events")
+        connection.exec_driver_sql(
+            "CREATE TABLE events (id INTEGER NOT NULL, topic VARCHAR NOT NULL, \"key\" VARCHAR, "
+            "origin VARCHAR NOT NULL, created_at DATETIME, PRIMARY KEY (id))"
+        )
+        connection.exec_driver_sql("INSERT INTO events (id, topic, origin) VALUES (7, 'chat', 'worker-a')")
+        connection.commit()
+    migrate(engine)
+
+    with engine.connect() as connection:
+        sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'events'").scalar()
+        assert "AUTOINCREMENT" in sql
+        connection.exec_driver_sql("DELETE FROM events")
+        connection.exec_driver_sql("INSERT INTO events (topic, origin) VALUES ('chat', 'worker-a')")
+        assert connection.exec_driver_sql("SELECT id FROM events").scalar() == 8
+    indexes = {index["name"] for index in inspect(engine).get_indexes("events")}
+    assert "ix_events_created_at" in indexes
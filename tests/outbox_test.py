@@ -0,0 +1,71 @@
+from sqlmodel import Session, func, select
+
+from backend import database as db
+from backend import outbox, rebalance
+from backend.schema import (
+    AttachmentInDB,
+    AttachmentReference,
+    ChangeInDB,
+    ChatActivityInDB,
+    EventInDB,
+    MentionInDB,
+    MessageAttachmentLinkInDB,
+    MessageIdSequenceInDB,
+    MessageOutboxInDB,
+)
+
+
+def count(session, model):
+    return session.exec(select(func.count()).select_from(model)).one()
+
+def test_sharded_message_leaves_the_primary_to_the_relay(session, shard_engine, user, create_chat):
+    chat = create_chat(members=(user,))
+    rebalance.move_chat(session, chat.id, 1)
+    session.add(AttachmentInDB(id="f00d", size=4, content_type="text/plain"))
+    session.commit()
+    written = {model: count(session, model) for model in (ChangeInDB, EventInDB, MessageIdSequenceInDB)}
+
+    message = db.create_message(chat.id, "ping @dallas", session, chat.owner,
+                                [AttachmentReference(id="f00d", filename="log.txt")])
+    assert {model: count(session, model) for model in written} == written
+    with Session(shard_engine) as shard_session:
+        assert count(shard_session, MessageIdSequenceInDB) == 1
+        assert shard_session.exec(select(MessageOutboxInDB.message_id)).all() == [message.id]
+
+    session.commit()
+    assert outbox.relay.run_once() == 1
+    assert session.exec(select(MentionInDB.user_id).where(MentionInDB.message_id == message.id)).all() == [user.id]
+    link = session.exec(select(MessageAttachmentLinkInDB)).one()
+    assert (link.message_id, link.filename) == (message.id, "log.txt")
+    assert session.exec(select(ChangeInDB.entity_id).where(ChangeInDB.kind == "message")).all() == [message.id]
+    assert session.exec(select(ChatActivityInDB.message_count).where(ChatActivityInDB.chat_id == chat.id)).all()
+    assert session.exec(select(EventInDB.topic).order_by(EventInDB.id.desc())).first() == "chat"
+    with Session(shard_engine) as shard_session:
+        assert count(shard_session, MessageOutboxInDB) == 0
+    assert outbox.relay.run_once() == 0
+
+def test_relay_tells_other_workers_about_messages(session, shard_engine, create_chat):
+    chat = create_chat()
+    rebalance.move_chat(session, chat.id, 1)
+    for n in range(3):
+        db.create_message(chat.id, f"message {n}", session, chat.owner)
+
+    session.commit()
+    assert outbox.relay.run_once(batch_size=2) == 2
+    assert outbox.relay.run_once(batch_size=2) == 1
+    assert count(session, ChangeInDB) == 3
+    events = session.exec(select(EventInDB.topic, EventInDB.key, EventInDB.origin)).all()
+    # the writer dispatched them itself, so only other workers pick them up
+    assert events[-2:] == [("message", str(chat.id), db.events.bus.origin)] * 2
+
+def test_relay_drops_messages_of_deleted_chats(session, shard_engine, user, create_chat):
+    chat = create_chat(members=(user,))
+    rebalance.move_chat(session, chat.id, 1)
+    db.create_message(chat.id, "ping @dallas", session, chat.owner)
+    assert db.delete_chat(chat.id, session) is False
+
+    assert outbox.relay.run_once() == 1
+    assert count(session, MentionInDB) == 0
+    assert count(session, ChatActivityInDB) == 0
+    with Session(shard_engine) as shard_session:
+        assert count(shard_session, MessageOutboxInDB) == 0
@@ -0,0 +1,55 @@
+import io
+
+from sqlmodel import func, select
+
+from backend import auth, provisioning
+from backend.schema import UserInDB
+
+
+def test_provision_users(client, session, user, admin_headers, monkeypatch):
+    monkeypatch.setattr(provisioning, "hash_workers", 2)
+    registrations = [
+        {"username": "kane", "email": "kane@cool.email", "password": "secret1"},
+        {"username": "dallas", "email": "other@cool.email", "password": "secret2"},
+        {"username": "kane", "email": "kane2@cool.email", "password": "secret3"},
+        {"username": "lambert", "email": "dallas@cool.email", "password": "secret4"},
+        {"username": "parker", "email": "parker@cool.email", "password": "secret5"},
+    ]
+
+    response = client.post("/admin/users", json=registrations, headers=admin_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["meta"] == {"created": 2, "failed": 3}
+    assert [result.get("error", {}).get("entity_field") for result in body["results"]] == [
+        None, "username", "username", "email", None,
+    ]
+    assert body["results"][0]["user"]["username"] == "kane"
+
+    parker = session.exec(select(UserInDB).where(UserInDB.username == "parker")).one()
+    assert auth.pwd_context.verify("secret5", parker.hashed_password)
+    assert session.exec(select(func.count(UserInDB.id))).one() == 3
+    assert provisioning._pool._mp_context.get_start_method() == "spawn"
+    provisioning.shutdown_pool()
+    assert provisioning._pool is None
+
+
+def test_provision_users_from_csv(session):
+    registrations = provisioning.read_registrations(io.StringIO(
+        "username,email,password\nash,ash@cool.email,secret\nbrett,brett@cool.email,secret\n"
+    ))
+    results = provisioning.provision_users(session, registrations, chunk_size=1)
+    assert [result.user.username for result in results] == ["ash", "brett"]
+
+
+def test_provision_users_fail(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(provisioning, "max_provision_batch", 1)
+    registration = {"username": "ash", "email": "ash@cool.email", "password": "secret"}
+    response = client.post("/admin/users", json=[registration, registration], headers=admin_headers)
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "batch_too_large"
+
+
+def test_provision_users_requires_an_admin(client, auth_headers):
+    registration = {"username": "ash", "email": "ash@cool.email", "password": "secret"}
+    assert client.post("/admin/users", json=[registration]).status_code == 401
+    assert client.post("/admin/users", json=[registration], headers=auth_headers).status_code == 403
@@ -0,0 +1,138 @@
+from datetime import datetime
+
+import pytest
+from sqlmodel import Session
+
+from backend import database as db
+from backend import events, recent_messages
+from backend.recent_messages import RecentMessageCache
+from backend.schema import ChatInDB, MessageResponseModel, UserChatLinkInDB
+
+AUTHOR = {"id": 1, "username": "author", "email": "author@cool.email", "created_at": datetime(2024, 1, 1)}
+
+
+def _message(message_id: int) -> MessageResponseModel:
+    return MessageResponseModel(
+        id=message_id, chat_id=1, text=f"message {message_id}", user=AUTHOR, created_at=datetime(2024, 1, 1)
+    )
+
+
+class Store:
+    """Stands in for the database: messages 1..count, oldest first."""
+
+    def __init__(self, count: int):
+        self.messages = [_message(message_id) for message_id in range(1, count + 1)]
+        self.loads = 0
+
+    def load(self, after, limit):
+        self.loads += 1
+        newer = [message for message in self.messages if after is None or message.id > after]
+        return newer[-limit:]
+
+    def add(self, cache: RecentMessageCache) -> MessageResponseModel:
+        message = _message(self.messages[-1].id + 1)
+        self.messages.append(message)
+        cache.mark_behind(1)
+        return message
+
+
+def _ids(messages):
+    return None if messages is None else [message.id for message in messages]
+
+
+def test_serves_latest_pages_and_deltas_from_memory():
+    cache, store = RecentMessageCache(per_chat=5, capacity=100), Store(8)
+
+    assert _ids(cache.read(1, store.load, limit=3)) == [6, 7, 8]
+    assert _ids(cache.read(1, store.load, limit=2, before=7)) == [5, 6]
+    assert _ids(cache.read(1, store.load, after=6)) == [7, 8]
+    assert store.loads == 1
+    assert cache.read(1, store.load, limit=3, before=5) is None  # older than the buffer
+    assert cache.read(1, store.load) is None  # the whole history
+    assert cache.snapshot()["hits"] == 2
+
+
+def test_small_chats_are_served_whole():
+    cache, store = RecentMessageCache(per_chat=5, capacity=100), Store(3)
+    assert _ids(cache.read(1, store.load)) == [1, 2, 3]
+    assert _ids(cache.read(1, store.load, limit=10, before=2)) == [1]
+
+
+def test_own_writes_are_appended_and_others_caught_up():
+    cache, store = RecentMessageCache(per_chat=5, capacity=100), Store(3)
+    cache.read(1, store.load)
+
+    cache.append(1, store.add(cache), previous_id=3)
+    assert _ids(cache.read(1, store.load, limit=2)) == [3, 4]
+    assert store.loads == 1
+
+    store.add(cache)  # written by another worker
+    assert _ids(cache.read(1, store.load, limit=2)) == [4, 5]
+    assert store.loads == 2
+
+    for _ in range(3):
+        store.add(cache)
+    assert _ids(cache.read(1, store.load)) is None  # message 1 fell out of the ring
+    assert _ids(cache.read(1, store.load, after=5)) == [6, 7, 8]
+
+
+def test_own_write_after_an_unseen_one_catches_up():
+    cache, store = RecentMessageCache(per_chat=5, capacity=100), Store(3)
+    cache.read(1, store.load)
+
+    store.messages.append(_message(4))  # another worker's message, its event not polled yet
+    cache.append(1, store.add(cache), previous_id=4)
+    assert _ids(cache.read(1, store.load, limit=3)) == [3, 4, 5]
+    assert store.loads == 2
+
+
+def test_long_gaps_reload_the_buffer():
+    cache, store = RecentMessageCache(per_chat=3, capacity=100), Store(3)
+    cache.read(1, store.load)
+    for _ in range(4):
+        store.add(cache)
+    assert _ids(cache.read(1, store.load, limit=3)) == [5, 6, 7]
+    assert cache.read(1, store.load, after=3) is None
+
+
+def test_evicts_least_recently_read_chats():
+    cache = RecentMessageCache(per_chat=5, capacity=10)
+    stores = {chat_id: Store(5) for chat_id in (1, 2, 3)}
+    cache.read(1, stores[1].load)
+    cache.read(2, stores[2].load)
+    cache.read(1, stores[1].load)
+    cache.read(3, stores[3].load)
+
+    assert 2 not in cache and 1 in cache and 3 in cache
+    assert cache.snapshot()["evictions"] == 1
+    assert cache.snapshot()["messages"] == 10
+
+
+@pytest.fixture
+def chat(session, user):
+    chat = ChatInDB(name="busy", owner_id=user.id)
+    session.add(chat)
+    session.commit()
+    session.add(UserChatLinkInDB(user_id=user.id, chat_id=chat.id))
+    session.commit()
+    return chat
+
+
+def test_database_reads_use_the_buffer(session, user, chat, monkeypatch):
+    monkeypatch.setattr(recent_messages, "_caches", type(recent_messages._caches)())
+    chat_id = chat.id
+    for n in range(3):
+        db.create_message(chat_id, f"hello {n}", session, user)
+    read_session = Session(session.get_bind(), info={"read_only": True})
+
+    latest = db.get_chat_messages(chat_id, read_session, limit=2)
+    assert [message.text for message in latest] == ["hello 1", "hello 2"]
+    db.create_message(chat_id, "hello 3", session, user)
+    delta = db.get_chat_messages(chat_id, read_session, after=latest[-1].id)
+    assert [message.text for message in delta] == ["hello 3"]
+
+    cache = recent_messages.cache_for(session.get_bind())
+    assert cache.snapshot()["hits"] == 1 and cache.snapshot()["misses"] == 1
+
+    events.bus.dispatch("user", str(user.id))
+    assert chat_id not in cache
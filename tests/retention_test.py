@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import func, select
+
+from backend import archive, jobs, retention
+from backend import database as db
+from backend.schema import (
+    AttachmentInDB,
+    ChangeInDB,
+    ChatInDB,
+    EventInDB,
+    MentionInDB,
+    MessageArchiveBlockInDB,
+    MessageAttachmentLinkInDB,
+    MessageInDB,
+    UserInDB,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(jobs, "throttle", 0)
+    monkeypatch.setattr(retention, "retention_days", 0)
+
+
+def _texts(session, chat_id: int) -> list[str]:
+    return [message.text for message in db.get_chat_messages(chat_id, session)]
+
+
+def test_purge_removes_messages_past_the_policy(session, create_chat):
+    chat = create_chat("short", ages=[40, 35, 31, 20, 1], retention_days=30)
+    kept = create_chat("forever", ages=[400, 1])
+    message_id = session.exec(select(MessageInDB.id).where(MessageInDB.chat_id == chat.id)).first()
+    session.add(AttachmentInDB(id="a" * 64, content_type="text/plain", size=1))
+    session.add(MessageAttachmentLinkInDB(
+        message_id=message_id, attachment_id="a" * 64, chat_id=chat.id, filename="notes.txt"
+    ))
+    session.add(MentionInDB(user_id=chat.owner_id, message_id=message_id, chat_id=chat.id))
+    session.commit()
+    batches = []
+
+    result = retention.purge_expired_messages(session, batch_size=2, pause=0, progress=batches.append)
+
+    assert result["chats"] == {chat.id: 3}
+    assert result["deleted"] == 3
+    assert result["rows_per_second"] > 0
+    assert batches == [2, 1]
+    assert _texts(session, chat.id) == ["20 days old", "1 days old"]
+    assert _texts(session, kept.id) == ["400 days old", "1 days old"]
+    assert db.count_chat_messages(chat.id, session) == 2
+    assert session.exec(select(func.count()).select_from(MessageAttachmentLinkInDB)).one() == 0
+    assert session.exec(select(func.count()).select_from(MentionInDB)).one() == 0
+    deletions = session.exec(select(ChangeInDB.entity_id).where(ChangeInDB.op == "delete")).all()
+    assert len(deletions) == 3 and message_id in deletions
+
+
+def test_global_default_and_opt_out(session, monkeypatch, create_chat):
+    monkeypatch.setattr(retention, "retention_days", 365)
+    default = create_chat("default", ages=[500, 10])
+    opted_out = create_chat("opted out", ages=[500, 10], retention_days=0)
+
+    result = retention.purge_expired_messages(session, pause=0)
+
+    assert result["chats"] == {default.id: 1}
+    assert _texts(session, default.id) == ["10 days old"]
+    assert _texts(session, opted_out.id) == ["500 days old", "10 days old"]
+
+
+def test_purge_trims_archive_blocks(session, create_chat):
+    chat = create_chat("archived", ages=[50, 45, 40, 35, 20, 10], retention_days=30)
+    archive.archive_chat(session, chat.id, datetime.now() - timedelta(days=15), block_size=3)
+
+    result = retention.purge_expired_messages(session, pause=0)
+
+    assert result["deleted"] == 4
+    assert _texts(session, chat.id) == ["20 days old", "10 days old"]
+    assert db.count_chat_messages(chat.id, session) == 2
+    blocks = session.exec(select(MessageArchiveBlockInDB)).all()
+    assert [block.message_count for block in blocks] == [1]
+    assert retention.purge_expired_messages(session, pause=0)["deleted"] == 0
+
+
+def test_retention_policy_route(client, session, user, auth_headers, create_chat):
+    chat = create_chat("policy", owner=user, ages=[40, 1])
+
+    response = client.get(f"/chats/{chat.id}/retention")
+    assert response.json() == {"chat_id": chat.id, "days": None, "effective_days": None}
+
+    response = client.put(f"/chats/{chat.id}/retention", json={"days": 30}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == {"chat_id": chat.id, "days": 30, "effective_days": 30}
+    assert client.put(f"/chats/{chat.id}/retention", json={"days": -1}, headers=auth_headers).status_code == 422
+    assert client.put("/chats/999/retention", json={"days": 30}, headers=auth_headers).status_code == 404
+
+
+def test_only_the_owner_sets_the_policy(client, session, user, auth_headers):
+    ripley = UserInDB(username="ripley", email="ripley@cool.email", hashed_password="x")
+    chat = ChatInDB(name="not mine", owner=ripley, users=[ripley, user])
+    session.add(chat)
+    session.commit()
+
+    assert client.put(f"/chats/{chat.id}/retention", json={"days": 1}).status_code == 401
+    response = client.put(f"/chats/{chat.id}/retention", json={"days": 1}, headers=auth_headers)
+    assert response.status_code == 403
+    assert response.json()["detail"]["type"] == "permission_denied"
+    session.refresh(chat)
+    assert chat.retention_days is None
+
+
+def test_purge_publishes_every_batch(session, create_chat):
+    chat = create_chat("events", ages=[40, 35, 31, 1], retention_days=30)
+
+    retention.purge_expired_messages(session, batch_size=2, pause=0)
+
+    published = session.exec(
+        select(func.count()).where(EventInDB.topic == "chat", EventInDB.key == str(chat.id))
+    ).one()
+    assert published == 2
+
+
+def test_purge_job_reports_progress(client, session, admin_headers, create_chat):
+    chat = create_chat("job", ages=[40, 35, 1], retention_days=30)
+
+    response = client.post(
+        "/admin/jobs", json={"kind": "purge_expired_messages", "payload": {"batch_size": 1}}, headers=admin_headers
+    )
+    job_id = response.json()["job"]["id"]
+    assert jobs.JobRunner().run_once(session.get_bind()) == job_id
+
+    job = client.get(f"/admin/jobs/{job_id}", headers=admin_headers).json()["job"]
+    assert (job["status"], job["progress"]) == ("succeeded", 2)
+    assert job["result"]["chats"] == {str(chat.id): 2}
+    assert _texts(session, chat.id) == ["1 days old"]
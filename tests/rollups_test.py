@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import select
+
+from backend import archive, jobs, retention, rollups
+from backend import database as db
+from backend.schema import ChatActivityInDB, ChatPosterInDB, MessageInDB, UserInDB
+
+
+@pytest.fixture
+def ash():
+    return UserInDB(username="ash", email="ash@cool.email", hashed_password="x")
+
+
+def test_create_message_updates_rollups(client, session, create_chat, ash):
+    chat = create_chat(members=[ash])
+    ripley = chat.owner
+    for text in ["one", "two", "three"]:
+        db.create_message(chat.id, text, session, ash)
+    db.create_message(chat.id, "four", session, ripley)
+
+    response = client.get(f"/chats/{chat.id}/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["message_count"] == 4
+    today = db.rollup_bucket(datetime.now(), "day")
+    assert [(datetime.fromisoformat(b["bucket"]), b["message_count"]) for b in stats["activity"]] == [(today, 4)]
+    assert [(p["user"]["username"], p["message_count"]) for p in stats["top_posters"]] == [("ash", 3), ("ripley", 1)]
+
+    response = client.get(f"/chats/{chat.id}/stats", params={"period": "hour", "top": 1})
+    assert [b["message_count"] for b in response.json()["activity"]] == [4]
+    assert len(response.json()["top_posters"]) == 1
+
+
+def test_get_chat_stats_fail(client, session, create_chat):
+    chat = create_chat()
+    assert client.get("/chats/999/stats").status_code == 404
+    assert client.get(f"/chats/{chat.id}/stats", params={"period": "week"}).status_code == 422
+
+
+def test_backfill_counts_hot_and_archived_messages(client, session, admin_headers, monkeypatch, create_chat, ash):
+    monkeypatch.setattr(jobs, "throttle", 0)
+    chat = create_chat(members=[ash])
+    ripley = chat.owner
+    now = datetime.now()
+    session.add_all([
+        MessageInDB(chat_id=chat.id, user_id=author.id, text="old", created_at=now - timedelta(days=days))
+        for days, author in [(3, ash), (3, ash), (2, ripley), (0, ash)]
+    ])
+    session.commit()
+    archive.archive_chat(session, chat.id, now - timedelta(days=1), block_size=2)
+    assert rollups.get_chat_stats(chat.id, session).message_count == 0
+
+    response = client.post("/admin/jobs", json={"kind": "backfill_rollups"}, headers=admin_headers)
+    assert jobs.JobRunner().run_once(session.get_bind()) == response.json()["job"]["id"]
+
+    stats = rollups.get_chat_stats(chat.id, session, "day", buckets=7)
+    assert stats.message_count == 4
+    assert [bucket.message_count for bucket in stats.activity] == [2, 1, 1]
+    assert [(poster.user.username, poster.message_count) for poster in stats.top_posters] == [("ash", 3), ("ripley", 1)]
+    assert len(rollups.get_chat_stats(chat.id, session, "day", buckets=1).activity) == 1
+
+    assert rollups.backfill_chat(session, chat.id) == 4
+    assert rollups.get_chat_stats(chat.id, session).message_count == 4
+
+
+def test_purges_keep_rollups_consistent(session, monkeypatch, create_chat, ash):
+    monkeypatch.setattr(retention, "retention_days", 0)
+    chat = create_chat(members=[ash])
+    ripley = chat.owner
+    now = datetime.now()
+    session.add_all([
+        MessageInDB(chat_id=chat.id, user_id=author.id, text="old", created_at=now - timedelta(days=days))
+        for days, author in [(40, ripley), (1, ash), (0, ash)]
+    ])
+    chat.retention_days = 30
+    session.commit()
+    rollups.backfill_chat(session, chat.id)
+
+    retention.purge_expired_messages(session, pause=0)
+    stats = rollups.get_chat_stats(chat.id, session, "day", buckets=60)
+    assert stats.message_count == 2
+    assert [poster.user.username for poster in stats.top_posters] == ["ash"]
+    assert len(stats.activity) == 2
+
+    chat.deleted_at = now
+    session.commit()
+    db.purge_chat(chat.id, session)
+    assert session.exec(select(ChatActivityInDB)).all() == []
+    assert session.exec(select(ChatPosterInDB)).all() == []
@@ -0,0 +1,300 @@
+"""
+Drives mixed read/write traffic from many concurrent clients against real
+uvicorn workers on a file-backed database, and reports throughput, request
+latencies, lock waits, commit latency and "database is locked" errors.
+
+    python -m tests.stress.harness --workers 4 --clients 32 --duration 30
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import httpx
+
+from backend.contention import summarize
+
+PASSWORD = "password"
+READS = ("chat_messages", "chat_stats", "mentions", "chats")
+STARTUP_TIMEOUT = 60.0  # seconds
+LOGIN_TIMEOUT = 120.0  # seconds
+
+
+class Recorder:
+    """Latencies and statuses of the requests of every client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: Counter = Counter()
+        self.statuses: Counter = Counter()
+
+    def record(self, operation: str, seconds: float, status: Optional[int]):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            self.statuses["error" if status is None else str(status)] += 1
+            if status is None or status >= 400:
+                self.errors[operation] += 1
+
+    def report(self, seconds: float) -> dict:
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        writes = len(self.latencies.get("post_message", []))
+        return {
+            "requests": requests,
+            "seconds": round(seconds, 3),
+            "requests_per_second": round(requests / seconds, 1),
+            "writes_per_second": round(writes / seconds, 1),
+            "statuses": dict(self.statuses),
+            "operations": {
+                operation: {**summarize(latencies), "errors": self.errors[operation]}
+                for operation, latencies in sorted(self.latencies.items())
+            },
+        }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_env(db_dir: str, log_path: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        DB_DIR=db_dir,
+        DB_ECHO="0",
+        CONTENTION_STATS="1",
+        CONTENTION_LOG=log_path,
+        PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")])),
+    )
+    env.pop("DB_LOCATION", None)
+    return env
+
+
+def prepare_database(env: dict[str, str], users: int, chats: int) -> tuple[list[str], list[int]]:
+    """
+    Creates the schema in a separate process, then adds users that share one
+    password hash and chats that every user belongs to.
+
+    :return: the usernames and chat ids
+    """
+    subprocess.run(
+        [sys.executable, "-m", "backend.migrations"],
+        env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    from backend.auth import pwd_context
+
+    hashed_password = pwd_context.hash(PASSWORD)
+    now = datetime.now().isoformat(" ")
+    usernames = [f"stress{n}" for n in range(users)]
+    connection = sqlite3.connect(os.path.join(env["DB_DIR"], "pony_express.db"))
+    try:
+        user_ids = [
+            connection.execute(
+                "INSERT INTO users (username, username_lower, email, hashed_password, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (username, username, f"{username}@stress.test", hashed_password, now),
+            ).lastrowid
+            for username in usernames
+        ]
+        chat_ids = [
+            connection.execute(
+                "INSERT INTO chats (name, owner_id, created_at) VALUES (?, ?, ?)",
+                (f"stress chat {n}", user_ids[n % len(user_ids)], now),
+            ).lastrowid
+            for n in range(chats)
+        ]
+        connection.executemany(
+            "INSERT INTO user_chat_links (user_id, chat_id) VALUES (?, ?)",
+            [(user_id, chat_id) for user_id in user_ids for chat_id in chat_ids],
+        )
+        connection.commit()
+    finally:
+        connection.close()
+    return usernames, chat_ids
+
+
+def start_server(env: dict[str, str], port: int, workers: int, log_file) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "backend.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1.0).status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("uvicorn did not start in time")
+
+
+def stop_server(server: subprocess.Popen):
+    """Stops the workers gracefully, so each one writes its contention statistics."""
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def log_in(base_url: str, username: str) -> str:
+    """Logs a user in, retrying while the auth admission limiter sheds the login with 503."""
+    deadline = time.monotonic() + LOGIN_TIMEOUT
+    while True:
+        response = httpx.post(f"{base_url}/auth/token", data={"username": username, "password": PASSWORD}, timeout=60)
+        if response.status_code != 503 or time.monotonic() >= deadline:
+            break
+        time.sleep(float(response.headers.get("retry-after", 1)))
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def run_client(
+    base_url: str,
+    token: str,
+    usernames: list[str],
+    chat_ids: list[int],
+    write_ratio: float,
+    deadline: float,
+    recorder: Recorder,
+    seed: int,
+):
+    """Sends requests until ``deadline``; most of them go to the first, busiest chats."""
+    rng = random.Random(seed)
+    headers = {"Authorization": f"Bearer {token}"}
+    with httpx.Client(base_url=base_url, headers=headers, timeout=60) as client:
+        while time.monotonic() < deadline:
+            chat_id = chat_ids[min(int(rng.expovariate(1.0)), len(chat_ids) - 1)]
+            if rng.random() < write_ratio:
+                operation = "post_message"
+                text = f"stress message {rng.random():.6f}"
+                if rng.random() < 0.2:
+                    text = f"@{rng.choice(usernames)} {text}"
+                request = lambda: client.post(f"/chats/{chat_id}/messages", json={"text": text})
+            else:
+                operation = rng.choice(READS)
+                request = {
+                    "chat_messages": lambda: client.get(f"/chats/{chat_id}/messages", params={"limit": 50}),
+                    "chat_stats": lambda: client.get(f"/chats/{chat_id}/stats"),
+                    "mentions": lambda: client.get("/users/me/mentions"),
+                    "chats": lambda: client.get("/chats", params={"limit": 50}),
+                }[operation]
+            started = time.perf_counter()
+            try:
+                status = request().status_code
+            except httpx.TransportError:
+                status = None
+            recorder.record(operation, time.perf_counter() - started, status)
+
+
+def read_server_stats(log_path: str) -> dict:
+    """Merges the contention statistics every worker wrote on shutdown."""
+    if not os.path.exists(log_path):
+        return {"workers": 0}
+    with open(log_path) as log:
+        records = [json.loads(line) for line in log if line.strip()]
+    result = {
+        "workers": len(records),
+        "locked_errors": sum(record["locked_errors"] for record in records),
+        "commits_per_second": round(sum(record["commits_per_second"] for record in records), 1),
+    }
+    for name in ("writer_wait", "lock_wait", "commit"):
+        samples = [sample for record in records for sample in record["samples"][name]]
+        result[name] = summarize(samples, sum(record[name]["count"] for record in records))
+    return result
+
+
+def run(
+    workers: int = 4,
+    clients: int = 32,
+    duration: float = 30.0,
+    write_ratio: float = 0.3,
+    chats: int = 8,
+    db_dir: Optional[str] = None,
+) -> dict:
+    """
+    Runs one stress test against a fresh database.
+
+    :param db_dir: directory for the database and server log; a temporary
+        one that is removed afterwards by default
+    :return: the client-side report with the merged server statistics under ``"server"``
+    """
+    directory = db_dir or tempfile.mkdtemp(prefix="pony-stress-")
+    os.makedirs(directory, exist_ok=True)
+    log_path = os.path.join(directory, "contention.jsonl")
+    env = server_env(directory, log_path)
+    try:
+        usernames, chat_ids = prepare_database(env, clients, chats)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        with open(os.path.join(directory, "server.log"), "w") as server_log:
+            server = start_server(env, port, workers, server_log)
+            try:
+                with ThreadPoolExecutor(max_workers=clients) as executor:
+                    tokens = list(executor.map(lambda username: log_in(base_url, username), usernames))
+                recorder = Recorder()
+                started = time.monotonic()
+                deadline = started + duration
+                with ThreadPoolExecutor(max_workers=clients) as executor:
+                    futures = [
+                        executor.submit(
+                            run_client, base_url, token, usernames, chat_ids, write_ratio, deadline, recorder, seed
+                        )
+                        for seed, token in enumerate(tokens)
+                    ]
+                    for future in futures:
+                        future.result()
+                elapsed = time.monotonic() - started
+            finally:
+                stop_server(server)
+        report = recorder.report(elapsed)
+        report["config"] = {
+            "workers": workers, "clients": clients, "duration": duration,
+            "write_ratio": write_ratio, "chats": chats,
+        }
+        report["server"] = read_server_stats(log_path)
+        return report
+    finally:
+        if db_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure SQLite lock contention under concurrent traffic.")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients, one user each")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--write-ratio", type=float, default=0.3, help="share of requests that post a message")
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--db-dir", default=None, help="keep the database and server log in this directory")
+    parser.add_argument("--output", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args.workers, args.clients, args.duration, args.write_ratio, args.chats, args.db_dir)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
@@ -0,0 +1,34 @@
+import os
+
+import httpx
+import pytest
+
+from tests.stress import harness
+
+
+@pytest.mark.skipif(os.environ.get("STRESS_TESTS") != "1", reason="starts uvicorn workers; set STRESS_TESTS=1")
+def test_harness_reports_contention(tmp_path):
+    report = harness.run(workers=2, clients=4, duration=2, write_ratio=0.5, chats=2, db_dir=str(tmp_path))
+
+    assert report["requests"] > 0
+    assert report["operations"]["post_message"]["count"] > 0
+    assert report["server"]["workers"] == 2
+    assert report["server"]["commit"]["count"] >= report["statuses"].get("201", 0)
+    assert report["server"]["lock_wait"]["count"] > 0
+
+
+
+def test_log_in_retries_shed_logins(monkeypatch):
+    statuses = [503, 503, 200]
+    def post(url, **kwargs):
+        status = statuses.pop(0)
+        return httpx.Response(
+            status,
+            headers={"Retry-After": "0"} if status == 503 else {},
+            json={"access_token": "token"} if status == 200 else None,
+            request=httpx.Request("POST", url),
+        )
+    monkeypatch.setattr(httpx, "post", post)
+
+    assert harness.log_in("http://127.0.0.1:1", "stress0") == "token"
+    assert statuses == []
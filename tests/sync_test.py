@@ -0,0 +1,44 @@
+from backend import database as db
+from backend.schema import ChatInDB, ChatUpdate, UserInDB, UserUpdate
+
+
+def test_sync_returns_visible_changes(client, session, user, auth_headers):
+    stranger = UserInDB(username="ash", email="ash@cool.email", hashed_password="x")
+    own_chat = ChatInDB(name="nostromo", owner=user, users=[user])
+    other_chat = ChatInDB(name="sulaco", owner=stranger, users=[stranger])
+    session.add_all([own_chat, other_chat])
+    session.commit()
+
+    message = db.create_message(own_chat.id, "hello", session, user)
+    db.create_message(other_chat.id, "secret", session, stranger)
+    db.update_chat(own_chat.id, ChatUpdate(name="narcissus"), session)
+    db.update_user(stranger, UserUpdate(username="bishop"), session)
+
+    response = client.get("/sync", headers=auth_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert [(change["kind"], change["op"], change["id"]) for change in body["changes"]] == [
+        ("message", "create", message.id),
+        ("chat", "update", own_chat.id),
+        ("user", "update", stranger.id),
+    ]
+    assert body["next"] == body["changes"][-1]["seq"]
+    assert body["has_more"] is False
+
+    response = client.get("/sync", params={"since": body["next"]}, headers=auth_headers)
+    assert response.json() == {"changes": [], "next": body["next"], "has_more": False}
+
+    chat_id = own_chat.id
+    db.delete_chat(chat_id, session)
+    db.update_user(stranger, UserUpdate(username="ash"), session)
+    response = client.get("/sync", params={"since": body["next"], "limit": 1}, headers=auth_headers)
+    assert response.json()["has_more"] is True
+    response = client.get("/sync", params={"since": body["next"]}, headers=auth_headers)
+    assert [(change["kind"], change["op"], change["id"]) for change in response.json()["changes"]] == [
+        ("chat", "delete", chat_id),
+        ("user", "update", stranger.id),
+    ]
+
+
+def test_sync_fail(client):
+    assert client.get("/sync").status_code == 401
@@ -1,5 +1,11 @@
+import pytest
 from fastapi.testclient import TestClient
+from sqlmodel import select
+
+from backend import database as db
+from backend import search
 from backend.main import app
+from backend.schema import ChatInDB, MessageInDB, UserInDB, UserUpdate
 
 def test_get_all_users():
     client = TestClient(app)
@@ -94,4 +100,150 @@ def test_get_user_chats_fail():
             "entity_name": "User",
             "entity_id": "1"
         }
-    }
\ No newline at end of file
+    }
+
+def test_get_users_batch(client, session):
+    users = [UserInDB(username=name, email=f"{name}@cool.email", hashed_password="x")
+             for name in ("ripley", "hicks", "bishop")]
+    session.add_all(users)
+    session.commit()
+
+    ids = [users[2].id, 999, users[0].id]
+    response = client.get("/users", params={"ids": ",".join(map(str, ids))})
+    assert response.status_code == 200
+    data = response.json()
+    assert [user["username"] for user in data["users"]] == ["bishop", "ripley"]
+    assert data["missing"] == [999]
+    assert data["meta"]["count"] == 2
+
+def test_get_users_batch_fail(client):
+    response = client.get("/users", params={"ids": "1,two"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["entity_field"] == "ids"
+
+    response = client.get("/users", params={"ids": ",".join(map(str, range(101)))})
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "batch_too_large"
+
+def test_get_bootstrap(client, session, user, auth_headers):
+    chats = [ChatInDB(name=name, owner=user, users=[user]) for name in ("zeta", "alpha")]
+    session.add_all(chats)
+    session.add(ChatInDB(name="other", owner=user))
+    session.commit()
+    for i in range(5):
+        session.add(MessageInDB(text=f"message {i}", user_id=user.id, chat_id=chats[0].id))
+    session.commit()
+
+    response = client.get("/users/me/bootstrap", params={"chat_id": chats[0].id, "limit": 2}, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["user"]["username"] == "dallas"
+    assert [chat["name"] for chat in data["chats"]] == ["alpha", "zeta"]
+    assert [message["text"] for message in data["messages"]] == ["message 3", "message 4"]
+
+    response = client.get("/users/me/bootstrap", headers=auth_headers)
+    assert "messages" not in response.json()
+
+def test_get_bootstrap_of_another_chat(client, session, user, auth_headers):
+    other = ChatInDB(name="other", owner=user)
+    session.add(other)
+    session.commit()
+    session.add(MessageInDB(text="private", user_id=user.id, chat_id=other.id))
+    session.commit()
+
+    response = client.get("/users/me/bootstrap", params={"chat_id": other.id}, headers=auth_headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == {"type": "entity_not_found", "entity_name": "Chat", "entity_id": other.id}
+
+def test_get_bootstrap_fail(client):
+    response = client.get("/users/me/bootstrap")
+    assert response.status_code == 401
+
+def test_get_users_paginated(client, session):
+    session.add_all([
+        UserInDB(username=f"user{i}", email=f"user{i}@cool.email", hashed_password="x")
+        for i in range(5)
+    ])
+    session.commit()
+
+    response = client.get("/users", params={"limit": 2})
+    assert response.status_code == 200
+    assert response.json()["meta"]["count"] == 5
+    pages = [response.json()["users"]]
+    while "next_cursor" in response.json()["meta"]:
+        cursor = response.json()["meta"]["next_cursor"]
+        response = client.get("/users", params={"limit": 2, "cursor": cursor})
+        pages.append(response.json()["users"])
+    assert [len(page) for page in pages] == [2, 2, 1]
+    ids = [user["id"] for page in pages for user in page]
+    assert ids == sorted(ids) and len(set(ids)) == 5
+
+    response = client.post("/auth/registration", json={
+        "username": "newcomer", "email": "newcomer@cool.email", "password": "password",
+    })
+    assert response.status_code == 201
+    assert client.get("/users").json()["meta"]["count"] == 6
+
+def test_get_users_paginated_fail(client):
+    response = client.get("/users", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["entity_field"] == "cursor"
+
+@pytest.mark.parametrize("prefix_index_enabled", [True, False])
+def test_search_users(client, session, monkeypatch, prefix_index_enabled):
+    monkeypatch.setattr(search, "prefix_index_enabled", prefix_index_enabled)
+    session.add_all([
+        UserInDB(username=username, email=f"{username}@cool.email", hashed_password="x")
+        for username in ["Ripley", "ripper", "rip", "Ash", "Ripley2", "dallas"]
+    ])
+    session.commit()
+
+    response = client.get("/users/search", params={"prefix": "RIP"})
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()["users"]] == ["rip", "Ripley", "Ripley2", "ripper"]
+
+    response = client.get("/users/search", params={"prefix": "rip", "limit": 2})
+    assert response.json()["meta"]["count"] == 2
+
+    ash = session.exec(select(UserInDB).where(UserInDB.username == "Ash")).one()
+    db.update_user(ash, UserUpdate(username="Ripcord"), session)
+    response = client.get("/users/search", params={"prefix": "ripc"})
+    assert [user["username"] for user in response.json()["users"]] == ["Ripcord"]
+    assert client.get("/users/search", params={"prefix": "as"}).json()["users"] == []
+
+def test_search_users_fail(client):
+    assert client.get("/users/search", params={"prefix": ""}).status_code == 422
+    assert client.get("/users/search", params={"prefix": "a", "limit": 1000}).status_code == 422
+
+def test_parse_mentions():
+    text = "@dallas and @ash.bot, ping @dallas again; mail me@cool.email or @@kane @-"
+    assert db.parse_mentions(text) == ["dallas", "ash.bot"]
+
+def test_get_mentions(client, session, user, auth_headers):
+    ash = UserInDB(username="ash", email="ash@cool.email", hashed_password="x")
+    chat = ChatInDB(name="nostromo", owner=ash, users=[ash, user])
+    private = ChatInDB(name="private", owner=ash, users=[ash])
+    session.add_all([chat, private])
+    session.commit()
+    for i in range(3):
+        db.create_message(chat.id, f"@dallas status {i}", session, ash)
+    db.create_message(chat.id, "@dallas note to self", session, user)
+    db.create_message(chat.id, "@nobody there?", session, ash)
+    db.create_message(private.id, "@dallas secret", session, ash)
+
+    response = client.get("/users/me/mentions", params={"limit": 2}, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["meta"]["count"] == 3
+    assert [mention["message"]["text"] for mention in data["mentions"]] == ["@dallas status 2", "@dallas status 1"]
+    assert data["mentions"][0]["message"]["user"]["username"] == "ash"
+
+    cursor = data["meta"]["next_cursor"]
+    response = client.get("/users/me/mentions", params={"cursor": cursor}, headers=auth_headers)
+    assert [mention["message"]["text"] for mention in response.json()["mentions"]] == ["@dallas status 0"]
+    assert "next_cursor" not in response.json()["meta"]
+
+def test_get_mentions_fail(client, auth_headers):
+    assert client.get("/users/me/mentions").status_code == 401
+    response = client.get("/users/me/mentions", params={"cursor": "not-a-cursor"}, headers=auth_headers)
+    assert response.status_code == 422